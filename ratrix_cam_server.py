@@ -2,69 +2,75 @@
 import argparse
 import multiprocessing
 import os
-import shutil
 import signal
+import sys
 import time
 import math
+from collections import deque
 from datetime import datetime
 from multiprocessing import Process
+from multiprocessing.connection import Connection
 from multiprocessing.synchronize import Event
+from threading import Thread
 from types import FrameType
 from typing import NamedTuple
 
 import cv2
+import numpy as np
 from cv2.typing import MatLike
 from pydantic import BaseModel
 
-from ratrix_utils import Config, ensure_dir_exists, load_settings, still_path
-
-video_codec = cv2.VideoWriter.fourcc(*"mp4v")
+from ratrix_camera_probe import negotiated_size, probe_camera
+from ratrix_catalog import (
+    GapRecord,
+    SliceRecord,
+    record_gap,
+    record_placement,
+    record_slice,
+)
+from ratrix_fmp4 import FragmentedMp4Writer, ffmpeg_available
+from ratrix_idle import IdleGate
+from ratrix_qos import (
+    DEFER_TRANSFERS,
+    SIMPLIFY_OVERLAYS,
+    SKIP_PREVIEWS,
+    FrameMeter,
+    QosLevel,
+    reduced_fps,
+)
+from ratrix_timestamps import TimestampTrack, sidecar_path
+from ratrix_sched import CAPTURE, apply_policy
+from ratrix_transfer import (
+    queue_transfer,
+    run_background_job,
+    start_finisher,
+    transfer_queue_dir,
+)
+from ratrix_ttl import FrameClock
+from ratrix_utils import (
+    Config,
+    catalog_path,
+    ensure_dir_exists,
+    load_settings,
+    recording_name,
+    save_volumes,
+    still_path,
+)
+from ratrix_volumes import choose_volume
+
+# exit code of a camera process whose camera cannot deliver the configured mode
+EXIT_MODE_UNAVAILABLE = 3
+
+# pauses before each attempt to reopen a camera that stopped delivering frames; if all
+# fail the process exits and the supervisor relaunches it
+RECONNECT_BACKOFF = [0.05, 0.1, 0.2, 0.4, 0.8, 1.6]
+
+video_fourcc = "mp4v"
+video_codec = cv2.VideoWriter.fourcc(*video_fourcc)
 
 
 # ----------------------------------------------------------------------
 # BEGIN FUNCTION DEFINITIONS
-# function to move video file from temporary to permanent location
-# NOTE TRY MODIFYING THIS FUNCTION TO TEST TRANSCODING INSTEAD OF COPYING?
-def move_file(temp_file: str, out_file: str):
-    """
-    Utility function for moving video file from temporary to permanent location copy
-    the file from the temporary location to the permanent one
-    Args:
-        temp_file:
-        out_file:
-    """
-    xfer_mode="copy" # hardwire until compression fully supported
-    timeout:float = 3 # hand tuned to be sufficient to prevent race condition failures (fragile)
-
-    if not os.path.exists(temp_file):
-        print(f"WARNING: the temp file '{temp_file}' was not found!")
-        return
-    
-    while True:
-        try:     
-            time.sleep(timeout)# pause before first attempt reduces failures
-            if xfer_mode == "copy":
-                _ = shutil.copy2(temp_file, out_file)
-            else: 
-                # The following works with timeout=3 but only for 640x480 on most cameras;can handle 2 780p cams
-                conversion_failed: int = os.system(command=f"ffmpeg -i {temp_file} -c:v hevc_videotoolbox -q:v 65 -tag:v hvc1 -loglevel error {out_file}")
-                if conversion_failed:  # returns 0 for success, other outcomes
-                    print(f"fmpeg conversion of {temp_file} failed with exit code {conversion_failed}")
-
-            # verify existence of the copied or transcoded output file
-            if os.path.exists(out_file) and os.path.isfile(out_file):
-                break
-        except Exception as e:
-            print(
-                f"WARNING: Failed to copy {temp_file} to {out_file}, retrying in {timeout} seconds",
-                e,
-            )
-        
-    os.remove(temp_file)
-    if os.path.exists(temp_file):
-        print("WARNING: failed to clean up ", temp_file)
-
-
 class CameraParams(BaseModel):
     name: str
     row: int
@@ -74,142 +80,508 @@ class CameraParams(BaseModel):
     cam_exposure: float
 
 
+def probe_cache_dir(config: Config) -> str:
+    return os.path.join(config.temp_path, "camera_probe")
+
+
+def camera_params(config: Config, device_id: int) -> CameraParams:
+    camera = config.cameras[device_id]
+    return CameraParams(
+        name=camera.name,
+        row=camera.row,
+        width=(camera.width or config.default_width),
+        height=(camera.height or config.default_height),
+        fps=(camera.fps or config.default_fps),
+        cam_exposure=(camera.exposure or config.default_cam_exposure),
+    )
+
+
+class ControlMessage(BaseModel):
+    """Settings sent by the supervisor to a running camera process"""
+
+    params: CameraParams
+    study_label: str
+    preview_interval: int
+
+
+def control_message(config: Config, device_id: int) -> ControlMessage:
+    return ControlMessage(
+        params=camera_params(config, device_id),
+        study_label=config.study_label,
+        preview_interval=config.preview_interval,
+    )
+
+
+def receive_control(
+    control: Connection | None,
+) -> tuple[ControlMessage | None, QosLevel | None]:
+    # only the most recent message of each kind matters, older ones are superseded
+    message, qos = None, None
+    try:
+        while control is not None and control.poll():
+            received = control.recv()
+            if isinstance(received, QosLevel):
+                qos = received
+            else:
+                message = received
+    except (EOFError, OSError):
+        pass  # supervisor went away, keep recording with current settings
+    return message, qos
+
+
+class FramePool:
+    """
+    Fixed set of preallocated frame buffers that capture.read fills in place, so
+    steady-state recording allocates no frame memory. A buffer is returned to the
+    pool once the writer and the still update are done with it; if none is free a
+    new one is allocated and counted in `dry_count`.
+    """
+
+    def __init__(self, size: int, width: int, height: int):
+        self.size = size
+        self.shape = (height, width, 3)
+        self.free: deque[np.ndarray] = deque(
+            np.empty(self.shape, dtype=np.uint8) for _ in range(size)
+        )
+        self.dry_count = 0
+
+    def acquire(self) -> np.ndarray:
+        if self.free:
+            return self.free.popleft()
+        self.dry_count += 1
+        return np.empty(self.shape, dtype=np.uint8)
+
+    def release(self, buffer: MatLike):
+        if (
+            isinstance(buffer, np.ndarray)
+            and buffer.shape == self.shape
+            and len(self.free) < self.size
+        ):
+            self.free.append(buffer)
+
+    def resize(self, width: int, height: int):
+        if (height, width, 3) != self.shape:
+            self.__init__(self.size, width, height)
+
+
+class WriteLatency:
+    """Moving average of the time the writer takes per frame."""
+
+    def __init__(self, alpha: float = 0.05):
+        self.alpha = alpha
+        self.average_ms = 0.0
+
+    def update(self, seconds: float):
+        self.average_ms += self.alpha * (1000 * seconds - self.average_ms)
+
+
 def save_frame_to_writer(
     capture: cv2.VideoCapture,
     writer: cv2.VideoWriter,
     params: CameraParams,
     current_time: datetime,  
-    label: str
+    label: str,
+    pool: FramePool,
+    latency: WriteLatency | None = None,
+    clock: FrameClock | None = None,
+    burn_in: bool = True,
+    track: TimestampTrack | None = None,
+    simple_overlay: bool = False,
+    idle: IdleGate | None = None,
 ) -> MatLike | None:
 
     ret=False
+    buffer = pool.acquire()
+    frame = buffer
     for _ in range(3):
-        ret, frame = capture.read()
+        ret, frame = capture.read(image=buffer)
         if ret:
             break 
 
     if not ret:
+        pool.release(buffer)
         print(
             f"Cam_server: Failed to capture a frame from camera {params.name} at {datetime.now().strftime('%H:%M:%S.%f')}"
         )
         return  
-    
 
-    # time stamp to overlay on video frame
-    video_date = current_time.strftime("%Y%m%d")  
-    video_time_long = current_time.strftime("%H:%M:%S.%f")[:-4] # Truncate to .01s to reflect actual accuracy of timestamps
-
-    # NOTE text position is hardwired for 640x480 videos, needs generalization
-    font = cv2.FONT_HERSHEY_PLAIN
-    font_scale = params.height/480 #params.width / 640
-    _ = cv2.putText(
-        frame,
-        label,
-        (math.ceil(0.015*params.width), math.floor(0.97*params.height )),  #(10, params.height - 10),
-        font,
-        font_scale,
-        (255, 255, 255),
-        thickness=1,
-        lineType=cv2.LINE_AA,
-    )
-    _ = cv2.putText(
-        frame,
-        video_date,
-        (math.floor(0.8*params.width), math.floor(0.94*params.height) ), #(params.width - 115, params.height - 25),
-        font,
-        font_scale,
-        (255, 255, 255),
-        thickness=1,
-        lineType=cv2.LINE_AA,
-    )
-    _ = cv2.putText(
-        frame,
-        video_time_long,
-        (math.floor(0.8*params.width), math.floor(0.97*params.height) ),#(params.width - 115, params.height - 10),
-        font,
-        font_scale,
-        (255, 255, 255),
-        thickness=1,
-        lineType=cv2.LINE_AA,
-    )
+    # the writer silently drops frames of any other size
+    if frame.shape[:2] != (params.height, params.width):
+        print(
+            f"Cam_server: Camera {params.name} switched to {frame.shape[1]}x{frame.shape[0]} frames, expected {params.width}x{params.height}"
+        )
+        pool.release(buffer)
+        return
+    
+    if idle is not None and not idle.admit(frame):
+        return frame  # nothing moving: captured and compared, but not written
+
+    if clock is not None:
+        clock.stamp()  # as soon as the frame is in, for alignment with TTL events
+
+    if burn_in and simple_overlay:
+        # shedding load: only the time, without anti-aliasing
+        _ = cv2.putText(
+            frame,
+            current_time.strftime("%H:%M:%S.%f")[:-4],
+            (math.floor(0.8*params.width), math.floor(0.97*params.height) ),
+            cv2.FONT_HERSHEY_PLAIN,
+            params.height/480,
+            (255, 255, 255),
+            thickness=1,
+            lineType=cv2.LINE_8,
+        )
+    elif burn_in:
+        # time stamp to overlay on video frame
+        video_date = current_time.strftime("%Y%m%d")  
+        video_time_long = current_time.strftime("%H:%M:%S.%f")[:-4] # Truncate to .01s to reflect actual accuracy of timestamps
+
+        # NOTE text position is hardwired for 640x480 videos, needs generalization
+        font = cv2.FONT_HERSHEY_PLAIN
+        font_scale = params.height/480 #params.width / 640
+        _ = cv2.putText(
+            frame,
+            label,
+            (math.ceil(0.015*params.width), math.floor(0.97*params.height )),  #(10, params.height - 10),
+            font,
+            font_scale,
+            (255, 255, 255),
+            thickness=1,
+            lineType=cv2.LINE_AA,
+        )
+        _ = cv2.putText(
+            frame,
+            video_date,
+            (math.floor(0.8*params.width), math.floor(0.94*params.height) ), #(params.width - 115, params.height - 25),
+            font,
+            font_scale,
+            (255, 255, 255),
+            thickness=1,
+            lineType=cv2.LINE_AA,
+        )
+        _ = cv2.putText(
+            frame,
+            video_time_long,
+            (math.floor(0.8*params.width), math.floor(0.97*params.height) ),#(params.width - 115, params.height - 10),
+            font,
+            font_scale,
+            (255, 255, 255),
+            thickness=1,
+            lineType=cv2.LINE_AA,
+        )
 
-    writer.write(frame)
+    if latency is None:
+        writer.write(frame)
+    else:
+        write_start = time.perf_counter()
+        writer.write(frame)
+        latency.update(time.perf_counter() - write_start)
+    if track is not None:
+        track.add(label, current_time)
+    if idle is not None:
+        idle.wrote()
 
     return frame
 
+def open_capture(device_id: int, params: CameraParams) -> cv2.VideoCapture:
+    capture = cv2.VideoCapture(int(device_id))  # hardware address
+    _ = capture.set(cv2.CAP_PROP_FRAME_WIDTH, params.width)
+    _ = capture.set(cv2.CAP_PROP_FRAME_HEIGHT, params.height)
+    _ = capture.set(cv2.CAP_PROP_FPS, params.fps)
+    _ = capture.set(cv2.CAP_PROP_EXPOSURE, params.cam_exposure)
+    return capture
+
+
+def reconnect_camera(
+    capture: cv2.VideoCapture,
+    device_id: int,
+    params: CameraParams,
+    stop_event: Event,
+) -> cv2.VideoCapture | None:
+    """
+    Release and reopen a camera that stopped delivering frames, retrying with
+    increasing pauses. Returns the reopened capture once it delivers a frame of the
+    expected size, or None if every attempt failed.
+    """
+    capture.release()
+    for attempt, pause in enumerate(RECONNECT_BACKOFF):
+        if stop_event.wait(pause):
+            return None
+        capture = open_capture(device_id, params)
+        if capture.isOpened():
+            ret, frame = capture.read()
+            if ret and frame.shape[:2] == (params.height, params.width):
+                return capture
+        capture.release()
+        print(
+            f"Cam_server: Camera {params.name} reconnect attempt {attempt + 1}/{len(RECONNECT_BACKOFF)} failed"
+        )
+    return None
+
+
+def open_writer(
+    path: str, params: CameraParams, config: Config
+) -> cv2.VideoWriter | FragmentedMp4Writer:
+    # fragmented mp4 stays readable up to the last fragment if the process dies
+    if config.fragmented_mp4:
+        if ffmpeg_available():
+            return FragmentedMp4Writer(
+                path, params.fps, (params.width, params.height), config.fragment_seconds
+            )
+        print("WARNING: ffmpeg not found, recording regular mp4 instead of fragmented")
+    return cv2.VideoWriter(path, video_codec, params.fps, (params.width, params.height))
+
+
 class WriterState(NamedTuple):
-    writer: cv2.VideoWriter
+    writer: cv2.VideoWriter | FragmentedMp4Writer
     save_dir: str
     temp_dir: str
     file_name: str
+    start_time: float  # time.time() of the first frame in this slice
+    direct: bool = False  # written in save_dir under its recording_name, not in temp_dir
+    track: TimestampTrack | None = None  # per-frame timestamps, see ratrix_timestamps
 
 
-def close_writer(writer_state: WriterState, file_transfer_processes: list[Process]):
+def catalog_direct_slice(db_path: str, record: SliceRecord):
+    try:
+        stat = os.stat(record.path)
+    except OSError:
+        return
+    _ = record_slice(db_path, record._replace(n_bytes=stat.st_size, mtime=stat.st_mtime))
+
+
+def close_writer(
+    writer_state: WriterState,
+    file_transfer_processes: list[Process],
+    n_frames: int,
+    params: CameraParams,
+    config: Config,
+    deferred_transfers: list[str] | None = None,
+    idle: IdleGate | None = None,
+):
     writer_state.writer.release()
+    if writer_state.track is not None:
+        writer_state.track.close()
 
     temp_video_path = os.path.join(writer_state.temp_dir, writer_state.file_name)
     out_path = os.path.join(writer_state.save_dir, writer_state.file_name)
+    recording_path = os.path.join(writer_state.save_dir, recording_name(writer_state.file_name))
+    if idle is not None:
+        # while the file is still where it was written
+        idle.report_slice(params.name, writer_state.file_name, recording_path if writer_state.direct else temp_video_path)
+    # the catalog entry is written by the transfer process once the file is in place
+    record = SliceRecord(
+        path=out_path,
+        camera=params.name,
+        study_label=config.study_label,
+        start_time=writer_state.start_time,
+        end_time=time.time(),
+        n_frames=n_frames,
+        n_bytes=None,
+        codec=video_fourcc,
+        location="raw",
+    )
 
+    if writer_state.direct:
+        # already on the output drive: only drop the in-progress suffix
+        try:
+            os.replace(recording_path, out_path)
+        except OSError as e:
+            print(f"WARNING: could not finish {writer_state.file_name}, it will be salvaged at the next start: {e}")
+            return
+        if writer_state.track is not None:
+            # not muxed: that would mean writing the slice to the drive a second time
+            try:
+                os.replace(sidecar_path(recording_path), sidecar_path(out_path))
+            except OSError as e:
+                print(f"WARNING: could not rename the timestamp track of {writer_state.file_name}: {e}")
+        # the catalog may be locked by a transfer, do not hold up capture for it
+        Thread(target=catalog_direct_slice, args=(catalog_path(config), record), daemon=True).start()
+        return
+
+    # persist the transfer first, so it is resumed if this process does not live to see it done
+    job_path = queue_transfer(
+        transfer_queue_dir(config),
+        temp_video_path,
+        out_path,
+        record,
+        catalog_path(config),
+    )
+    if deferred_transfers is not None:
+        # shedding load: stays queued until the camera server releases it
+        deferred_transfers.append(job_path)
+        return
     # spawn a separate process to move the closed tmp file to permanent location
     print(f"Cam_server: Starting transfer of file:{writer_state.file_name}") # {temp_video_path} to {out_path}")
-    p = Process(target=move_file, args=(temp_video_path, out_path))
+    start_transfer(job_path, file_transfer_processes, config)
+
+
+def start_transfer(job_path: str, file_transfer_processes: list[Process], config: Config):
+    p = Process(target=run_background_job, args=(job_path, config))
     p.start()
     # keep track of process to clean up later
     file_transfer_processes.append(p)
 
 
-def run(config: Config, device_id: int, stop_event: Event):
-    params = CameraParams(
-        name=config.cameras[device_id].name,
-        row=config.cameras[device_id].row,
-        width=(config.cameras[device_id].width or config.default_width),
-        height=(config.cameras[device_id].height or config.default_height),
-        fps=(config.cameras[device_id].fps or config.default_fps),
-        cam_exposure=(
-            config.cameras[device_id].exposure or config.default_cam_exposure
-        ),
+class StartupTimes(NamedTuple):
+    launched: float  # process started by the supervisor
+    entered: float  # process running, camera code imported
+    opened: float  # camera opened
+    probed: float  # video mode verified
+
+
+def report_startup(name: str, times: StartupTimes):
+    now = time.time()
+    print(
+        f"Cam_server: Camera {name} first frame written {now - times.launched:.2f} s after launch "
+        f"(process start {times.entered - times.launched:.2f} s, camera open {times.opened - times.entered:.2f} s, "
+        f"probe {times.probed - times.opened:.2f} s, first slice {now - times.probed:.2f} s)"
     )
+
+
+def run(
+    config: Config,
+    device_id: int,
+    stop_event: Event,
+    control: Connection | None = None,
+    device_key: str | None = None,
+    save_volume: str | None = None,
+    launched_at: float | None = None,
+) -> int:
+    # launch (time.time() in the supervisor) to first frame, reported once
+    entered = time.time()
+    launched_at = launched_at or entered
+    params = camera_params(config, device_id)
+    skipped = apply_policy(config, CAPTURE)
+    if skipped:
+        print(f"Cam_server: Camera {params.name} scheduling not applied: {', '.join(skipped)}")
+    # save drive this camera records to, when save_path lists several
+    save_volume = save_volume or save_volumes(config)[0]
     label: str = f"{config.study_label}_{params.name}"
+    preview_interval: int = config.preview_interval
+    # settings received from the supervisor that take effect at the next slice
+    pending_update: ControlMessage | None = None
     #ifi: float=1/params.fps #nominal interframe interval
 
     temp_dir = os.path.join(config.temp_path, label)
     if not ensure_dir_exists(temp_dir):
         print("ERROR: Temporary streaming folder does not exist and cannot be created")
-        return
+        return 0
 
     if not ensure_dir_exists(config.stills_path):
         print("ERROR: Still image folder does not existand cannot be created")
-        return
+        return 0
 
     # create full path filename for updating still images (used for GUI display)
     camera_still_path = still_path(config.stills_path, params.name)
 
     # try to connect to the camera
-    capture = cv2.VideoCapture(int(device_id))  # hardware address
+    capture = open_capture(device_id, params)
     start = time.time() # indicates time this videocapture was opened
 
-    _ = capture.set(cv2.CAP_PROP_FRAME_WIDTH, params.width)
-    _ = capture.set(cv2.CAP_PROP_FRAME_HEIGHT, params.height)
-    _ = capture.set(cv2.CAP_PROP_FPS, params.fps)
-    _ = capture.set(cv2.CAP_PROP_EXPOSURE, params.cam_exposure)
-
     if not capture.isOpened():
         print(f"Cam_server: Camera {params.name} Failed to open recording device {device_id}")
-        return
+        return 0
+
+    # verify the camera delivers the requested mode, otherwise the writer would get
+    # frames of the wrong size and produce corrupt files
+    probe = probe_camera(
+        capture,
+        device_key or f"device{device_id}",
+        params.width,
+        params.height,
+        params.fps,
+        probe_cache_dir(config),
+    )
+    if probe is None:
+        print(f"Cam_server: Camera {params.name} Failed to deliver frames while probing device {device_id}")
+        capture.release()
+        return 0
+    if not probe.mode_ok:
+        print(
+            f"ERROR: Camera {params.name} does not support {params.width}x{params.height} @ {params.fps}fps: "
+            f"it delivers {probe.width}x{probe.height} frames. Change the camera settings in the config file."
+        )
+        capture.release()
+        return EXIT_MODE_UNAVAILABLE
+    if probe.measured_fps < 0.9 * params.fps:
+        print(
+            f"WARNING: Camera {params.name} delivers only {probe.measured_fps:.1f}fps of the requested {params.fps}fps"
+        )
+    startup: StartupTimes | None = StartupTimes(launched_at, entered, start, time.time())
+    # load shedding level from the supervisor, None unless it runs the QoS controller
+    qos: QosLevel | None = None
+    meter = FrameMeter()
+    # share of the requested rate the camera delivers when the Mac is not loaded
+    delivery = min(1.0, probe.measured_fps / params.fps)
+    configured_fps = params.fps  # before any reduction for load
+    deferred_transfers: list[str] = []
+    last_release = 0.0  # time the last deferred transfer was started
+
+    frame_pool = FramePool(4, params.width, params.height)
+    reported_dry_count = 0
 
     count:int = 0  # tracks frames since last still image update
     filecount: int = 0
+    slice_frames: int = 0  # frames written to the current slice
+    last_frame_time: float = start  # time of the last frame captured
+    # record straight to the output drive while it keeps up, otherwise through temp_path
+    direct = config.direct_to_save_path
+    write_latency = WriteLatency()
+    roll_slice = False  # close the current slice early
     file_transfer_processes: list[Process] = []
     writer_state: WriterState | None = None
+    # per-frame timestamps on the clock of the TTL logger
+    frame_clock = FrameClock(config, params.name) if config.recording_ttl else None
+    # writes only some frames while nothing moves, see ratrix_idle
+    idle_gate = (
+        IdleGate(params.fps, config.idle_fps, config.idle_after, config.idle_threshold)
+        if config.idle_fps > 0
+        else None
+    )
 
     # this loop is executed once per video frame until camera is stcaopped
     while capture.isOpened() and not stop_event.is_set():
         current_time: float = time.time()
         current_datetime: datetime = datetime.fromtimestamp(timestamp=current_time)
 
+        # apply settings changed while running: exposure and preview rate right away,
+        # everything that changes the files at the next slice boundary
+        update, qos_update = receive_control(control)
+        if update is not None:
+            if update.params.cam_exposure != params.cam_exposure:
+                _ = capture.set(cv2.CAP_PROP_EXPOSURE, update.params.cam_exposure)
+                params.cam_exposure = update.params.cam_exposure
+            preview_interval = update.preview_interval
+            configured_fps = update.params.fps
+            if qos is not None and qos.reduce_fps:
+                update.params.fps = reduced_fps(configured_fps)
+            pending_update = update
+            print(f"Cam_server: Camera {params.name} received new settings")
+        if qos_update is not None:
+            target_fps = reduced_fps(configured_fps) if qos_update.reduce_fps else configured_fps
+            new_params = pending_update.params if pending_update is not None else params
+            if target_fps != new_params.fps:
+                # a slice has a single frame rate: start a new one at the new rate
+                pending_update = ControlMessage(
+                    params=new_params.model_copy(update={"fps": target_fps}),
+                    study_label=config.study_label,
+                    preview_interval=preview_interval,
+                )
+                roll_slice = True
+                print(f"Cam_server: Camera {params.name} recording at {target_fps}fps {'to reduce load' if qos_update.reduce_fps else 'again'}")
+            qos = qos_update
+        shedding = 0 if qos is None else qos.level
+        if deferred_transfers and shedding < DEFER_TRANSFERS and current_time - last_release >= 1:
+            # one per second, so the backlog does not bring the load straight back
+            print(f"Cam_server: Camera {params.name} starting a deferred transfer, {len(deferred_transfers) - 1} left")
+            start_transfer(deferred_transfers.pop(0), file_transfer_processes, config)
+            last_release = current_time
+
         # if not started yet, open first video file
         # or if video slice duration has been exceeded, close video file and initialize new one
-        if writer_state is None or current_time - start > config.time_slice:
+        if writer_state is None or current_time - start > config.time_slice or roll_slice:
+            roll_slice = False
             #timer = time.time_ns() 
             # check for unfinished file transfers
             # file_transfer_processes = [
@@ -224,29 +596,94 @@ def run(config: Config, device_id: int, stop_event: Event):
 
             # close the old writer
             if writer_state is not None:
-                close_writer(writer_state, file_transfer_processes)
+                close_writer(
+                    writer_state,
+                    file_transfer_processes,
+                    slice_frames,
+                    params,
+                    config,
+                    deferred_transfers if shedding >= DEFER_TRANSFERS else None,
+                    idle_gate,
+                )
+                if frame_pool.dry_count > reported_dry_count:
+                    print(
+                        f"Cam_server: Camera {params.name} frame pool ran dry {frame_pool.dry_count - reported_dry_count} times during the last slice"
+                    )
+                    reported_dry_count = frame_pool.dry_count
             filecount += 1
+            slice_frames = 0
 
-            # open a new writer
+            if pending_update is not None:
+                new_params = pending_update.params
+                if (new_params.width, new_params.height, new_params.fps) != (
+                    params.width,
+                    params.height,
+                    params.fps,
+                ):
+                    _ = capture.set(cv2.CAP_PROP_FRAME_WIDTH, new_params.width)
+                    _ = capture.set(cv2.CAP_PROP_FRAME_HEIGHT, new_params.height)
+                    _ = capture.set(cv2.CAP_PROP_FPS, new_params.fps)
+                    if negotiated_size(capture) == (new_params.width, new_params.height):
+                        print(
+                            f"Cam_server: Camera {params.name} now recording {new_params.width}x{new_params.height} @ {new_params.fps}fps"
+                        )
+                    else:
+                        print(
+                            f"ERROR: Camera {params.name} does not support {new_params.width}x{new_params.height}, keeping {params.width}x{params.height} @ {params.fps}fps"
+                        )
+                        _ = capture.set(cv2.CAP_PROP_FRAME_WIDTH, params.width)
+                        _ = capture.set(cv2.CAP_PROP_FRAME_HEIGHT, params.height)
+                        _ = capture.set(cv2.CAP_PROP_FPS, params.fps)
+                        new_params = new_params.model_copy(
+                            update={"width": params.width, "height": params.height, "fps": params.fps}
+                        )
+                params = new_params
+                frame_pool.resize(params.width, params.height)
+                config.study_label = pending_update.study_label
+                label = f"{config.study_label}_{params.name}"
+                temp_dir = os.path.join(config.temp_path, label)
+                _ = ensure_dir_exists(temp_dir)
+                camera_still_path = still_path(config.stills_path, params.name)
+                pending_update = None
+                if idle_gate is not None:
+                    idle_gate.set_fps(params.fps)
+
+            # open a new writer, on another save drive if this one is nearly full
+            next_volume = choose_volume(config, save_volume)
+            if next_volume != save_volume:
+                print(f"Cam_server: Camera {params.name} save drive {save_volume} is nearly full, switching to {next_volume}")
+                save_volume = next_volume
             current_save_dir = os.path.join(
-                config.save_path, f"{label}_{current_datetime.strftime('%Y%m%d')}"
+                save_volume, f"{label}_{current_datetime.strftime('%Y%m%d')}"
             )
             if not ensure_dir_exists(current_save_dir):
                 print(f"WARNING! Unable to create output path '{current_save_dir}'")
                 continue
             current_file_name = f"{params.name}_{str(current_datetime.strftime('%Y%m%d_%H-%M-%S'))}{config.video_ext}"
             # Create video writer
+            if direct:
+                writer_path = os.path.join(current_save_dir, recording_name(current_file_name))
+            else:
+                writer_path = os.path.join(temp_dir, current_file_name)
             writer_state = WriterState(
-                cv2.VideoWriter(
-                    os.path.join(temp_dir, current_file_name),
-                    video_codec,
-                    params.fps,
-                    (params.width, params.height),
-                ),
+                open_writer(writer_path, params, config),
                 current_save_dir,
                 temp_dir,
                 current_file_name,
+                current_time,
+                direct,
+                TimestampTrack(writer_path, params.fps) if config.timestamp_track else None,
             )
+            write_latency = WriteLatency()
+            if frame_clock is not None:
+                frame_clock.begin_slice(current_time)
+            if len(save_volumes(config)) > 1:
+                record_placement(
+                    save_volumes(config)[0],
+                    params.name,
+                    save_volume,
+                    os.path.join(current_save_dir, current_file_name),
+                )
             print(f"Cam_server: Camera {params.name} will now stream to {current_file_name}")
 
             #elapsed = time.time_ns() - timer
@@ -262,13 +699,58 @@ def run(config: Config, device_id: int, stop_event: Event):
         # NOTE maybe should try 2-3x before giving up?  
         full_label: str = label + ' frame ' + str(count) #include frame# in overlay text
         frame = save_frame_to_writer(
-            capture, writer_state.writer, params, current_datetime, label=full_label
+            capture,
+            writer_state.writer,
+            params,
+            current_datetime,
+            label=full_label,
+            pool=frame_pool,
+            latency=write_latency if direct else None,
+            clock=frame_clock,
+            burn_in=config.burn_in_timestamps,
+            track=writer_state.track,
+            simple_overlay=shedding >= SIMPLIFY_OVERLAYS,
+            idle=idle_gate,
         )
         if frame is None:
-            break #if you fail to capture, interpret that camera is down, fall out of loop
+            # try to get the camera back without leaving the process (and the current
+            # slice); if that fails, interpret that camera is down, fall out of loop
+            print(f"Cam_server: Camera {params.name} stopped delivering frames, reconnecting")
+            new_capture = reconnect_camera(capture, device_id, params, stop_event)
+            if new_capture is None:
+                break
+            capture = new_capture
+            gap = GapRecord(params.name, last_frame_time, time.time(), "reconnect")
+            print(
+                f"Cam_server: Camera {params.name} reconnected, recording gap of {gap.end_time - gap.start_time:.2f} s"
+            )
+            # the catalog may be locked by a transfer, do not hold up capture for it
+            Thread(target=record_gap, args=(catalog_path(config), gap), daemon=True).start()
+            meter = FrameMeter()  # the gap is not load
+            continue
+        if idle_gate is None or idle_gate.last_written:
+            slice_frames += 1
+        last_frame_time = current_time
+        if startup is not None:
+            report_startup(params.name, startup)
+            startup = None
+        if qos is not None and control is not None:
+            status = meter.status(params.fps * delivery)
+            if status is not None:
+                try:
+                    control.send(status)
+                except (BrokenPipeError, OSError):
+                    pass  # supervisor went away
+        if direct and slice_frames >= params.fps and write_latency.average_ms > config.direct_write_max_ms:
+            print(
+                f"WARNING: Camera {params.name} writes to {save_volume} take {write_latency.average_ms:.0f} ms per frame, "
+                f"recording through {config.temp_path} for the rest of this run"
+            )
+            direct = False
+            roll_slice = True
         
         # once per N sec, try to update the still image
-        if count % (config.preview_interval * params.fps) == 0:
+        if shedding < SKIP_PREVIEWS and count % (preview_interval * params.fps) == 0:
             # print('attempting to overwrite',camera_still_path)
             try:
                 result = cv2.imwrite(camera_still_path, frame)
@@ -279,6 +761,7 @@ def run(config: Config, device_id: int, stop_event: Event):
                 # print('image saved as',camera_still_path)
             except Exception as e:
                 print(type(e), e)
+        frame_pool.release(frame)  # writer and still are done with this buffer
         count += 1  # increment frame count whether that succeeds or fails
 
     # reach this line whenever camera fails to capture a frame (camera presumed offline)
@@ -288,25 +771,41 @@ def run(config: Config, device_id: int, stop_event: Event):
         # flush remaining frames 
         while (
             save_frame_to_writer(
-                capture, writer_state.writer, params, datetime.now(), label
+                capture,
+                writer_state.writer,
+                params,
+                datetime.now(),
+                label,
+                frame_pool,
+                burn_in=config.burn_in_timestamps,
+                track=writer_state.track,
             )
             is not None
         ):
-            pass
-        close_writer(writer_state, file_transfer_processes)
+            slice_frames += 1
+        close_writer(
+            writer_state, file_transfer_processes, slice_frames, params, config, idle=idle_gate
+        )
+    if frame_clock is not None:
+        frame_clock.close()
 
+    # do not wait for unfinished transfers: their jobs stay queued and are completed by
+    # the detached finisher, so the next session can start recording right away
     file_transfer_processes = [p for p in file_transfer_processes if p.is_alive()]
-    print(
-        f"Cam_server Waiting for {len(file_transfer_processes)} file transfer processes to finish"
-    )
+    if file_transfer_processes:
+        print(
+            f"Cam_server: Handing {len(file_transfer_processes)} unfinished file transfers to the transfer finisher"
+        )
     for process in file_transfer_processes:
-        process.join()  # this blocks until process is complete
+        process.kill()  # SIGTERM is ignored by processes started from the supervisor
+        process.join()
 
     # print(
     #     f"==== STOPPING CAMERA {str(device_id + 1).zfill(2)} at: {datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}",
     # )
     
     print(f"Ratrix Cam Server {device_id+1} Shutdown complete; saved {filecount} files during this run")
+    return 0
 
 
 def main():
@@ -337,7 +836,9 @@ def main():
         print("ERROR: Invalid device index. Must be a positive integer.")
         return
 
-    run(config, device_id, stop_event)
+    exit_code = run(config, device_id, stop_event)
+    _ = start_finisher(config)
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
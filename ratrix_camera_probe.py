@@ -0,0 +1,136 @@
+"""
+Verify the video mode a camera actually delivers.
+
+cv2.VideoCapture.set only requests a mode; a camera that does not support it silently
+falls back to another one. probe_camera reads back the negotiated mode, checks the size
+of a delivered frame, and measures the real frame rate over a short window. Results are
+cached per physical device and requested mode, so later restarts of the same camera only
+re-check the frame size instead of measuring again.
+"""
+
+import json
+import os
+import re
+import time
+
+import cv2
+from pydantic import BaseModel
+
+
+class ProbeResult(BaseModel):
+    device_key: str
+    requested_width: int
+    requested_height: int
+    requested_fps: int
+    width: int  # size of the frames actually delivered
+    height: int
+    reported_fps: float  # as reported by the driver
+    measured_fps: float  # as timed over the probe window
+    probed_at: float
+
+    @property
+    def mode_ok(self) -> bool:
+        return (self.width, self.height) == (self.requested_width, self.requested_height)
+
+
+def _cache_file(cache_dir: str, device_key: str) -> str:
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", device_key) + ".json")
+
+
+def load_cached(
+    cache_dir: str, device_key: str, width: int, height: int, fps: int
+) -> ProbeResult | None:
+    try:
+        with open(_cache_file(cache_dir, device_key), "r") as file:
+            results = [ProbeResult.model_validate(r) for r in json.load(file)]
+    except Exception:
+        return None
+    for result in results:
+        if (result.requested_width, result.requested_height, result.requested_fps) == (
+            width,
+            height,
+            fps,
+        ):
+            return result
+    return None
+
+
+def save_cached(cache_dir: str, result: ProbeResult):
+    # one file per device, so cameras probing at the same time never share a file
+    path = _cache_file(cache_dir, result.device_key)
+    try:
+        with open(path, "r") as file:
+            results = [ProbeResult.model_validate(r) for r in json.load(file)]
+    except Exception:
+        results = []
+    results = [
+        r
+        for r in results
+        if (r.requested_width, r.requested_height, r.requested_fps)
+        != (result.requested_width, result.requested_height, result.requested_fps)
+    ]
+    results.append(result)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump([r.model_dump() for r in results], file, indent=2)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"WARNING: could not save camera probe cache {path}: {e}")
+
+
+def negotiated_size(capture: cv2.VideoCapture) -> tuple[int, int]:
+    return (
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+
+
+def probe_camera(
+    capture: cv2.VideoCapture,
+    device_key: str,
+    width: int,
+    height: int,
+    fps: int,
+    cache_dir: str,
+    measure_seconds: float = 2.0,
+) -> ProbeResult | None:
+    """
+    Check the mode of an opened capture against the requested one. Returns None if no
+    frame could be read. The frame rate is only measured when this device and requested
+    mode are not in the cache, or the cached entry no longer matches what is delivered.
+    """
+    ret, frame = capture.read()
+    if not ret:
+        return None
+    frame_height, frame_width = frame.shape[:2]
+    reported_fps = capture.get(cv2.CAP_PROP_FPS)
+
+    cached = load_cached(cache_dir, device_key, width, height, fps)
+    if cached is not None and (cached.width, cached.height) == (frame_width, frame_height):
+        return cached
+
+    # time frames over a short window to find the rate the camera really delivers
+    n_frames = 0
+    first = time.perf_counter()
+    last = first
+    while last - first < measure_seconds:
+        ret, frame = capture.read()
+        if not ret:
+            return None
+        last = time.perf_counter()
+        n_frames += 1
+
+    result = ProbeResult(
+        device_key=device_key,
+        requested_width=width,
+        requested_height=height,
+        requested_fps=fps,
+        width=frame_width,
+        height=frame_height,
+        reported_fps=reported_fps,
+        measured_fps=n_frames / (last - first),
+        probed_at=time.time(),
+    )
+    save_cached(cache_dir, result)
+    return result
@@ -0,0 +1,424 @@
+"""
+SQLite catalog of recorded video slices.
+
+Every slice (one video file) gets one row, keyed by its full path, so questions like
+"all slices for camera X overlapping [t1, t2]" are answered from an index instead of
+walking the directory tree. The catalog is updated by the camera server when a slice is
+closed, by compress_drive when a slice is compressed, and can be (re)built from an
+existing folder tree with the `scan` command. Gaps in the recording of a camera that the
+camera server recovered from without ending the slice are listed in a separate table.
+When the rack records to several drives, a manifest (ratrix_manifest.jsonl) on the first
+drive lists where each slice went, so the other drives can be found from the first.
+
+This module only depends on the standard library so the video processing tools can use
+it on machines without the recording stack installed.
+
+Usage:
+    python ratrix_catalog.py scan /Volumes/data --db /Volumes/data/ratrix_catalog.sqlite
+    python ratrix_catalog.py query --db /Volumes/data/ratrix_catalog.sqlite \
+        --camera cam3 --start "2025-07-22 14:02" --end "2025-07-22 14:17"
+    python ratrix_catalog.py gaps --db /Volumes/data/ratrix_catalog.sqlite \
+        --start "2025-07-22" --end "2025-07-29"
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sqlite3
+import time
+from collections.abc import Iterator
+from datetime import datetime
+from typing import NamedTuple
+
+CATALOG_FILE_NAME = "ratrix_catalog.sqlite"
+MANIFEST_FILE_NAME = "ratrix_manifest.jsonl"
+SLICE_TIME_FORMAT = "%Y%m%d_%H-%M-%S"  # as written by ratrix_cam_server
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slices (
+    path TEXT PRIMARY KEY,
+    camera TEXT NOT NULL,
+    study_label TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    n_frames INTEGER,
+    n_bytes INTEGER,
+    codec TEXT,
+    location TEXT NOT NULL,
+    motion_perc REAL,
+    found_motion INTEGER,
+    fract_frames_exceeding REAL,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS slices_camera_start ON slices (camera, start_time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS gaps (
+    camera TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS gaps_camera_start ON gaps (camera, start_time);
+"""
+
+
+class SliceRecord(NamedTuple):
+    path: str
+    camera: str
+    study_label: str | None
+    start_time: float  # seconds since epoch, as time.time()
+    end_time: float
+    n_frames: int | None
+    n_bytes: int | None
+    codec: str | None
+    location: str  # "raw" for camera output, "compressed" for compress_drive output
+    motion_perc: float | None = None
+    found_motion: bool | None = None
+    fract_frames_exceeding: float | None = None
+    mtime: float | None = None
+
+
+class GapRecord(NamedTuple):
+    camera: str
+    start_time: float  # time of the last frame before the gap
+    end_time: float  # time of the first frame after it
+    reason: str | None
+
+
+def default_catalog_path(save_path: str) -> str:
+    return os.path.join(save_path, CATALOG_FILE_NAME)
+
+
+def record_placement(primary: str, camera: str, volume: str, path: str):
+    """
+    Note in the manifest on the primary save drive that a slice of camera is being
+    recorded to path on volume, so tools given only the primary drive find it.
+    Never raises, like record_slice.
+    """
+    line = json.dumps({"time": time.time(), "camera": camera, "volume": volume, "path": path})
+    try:
+        # a single short append is atomic, so cameras can share the file
+        with open(os.path.join(primary, MANIFEST_FILE_NAME), "a") as file:
+            _ = file.write(line + "\n")
+    except OSError as e:
+        print(f"WARNING: failed to update manifest on {primary} for {path}: {e}")
+
+
+def manifest_volumes(root: str) -> list[str]:
+    """The save drives listed in the manifest on root, if any, in order of first use."""
+    volumes: dict[str, None] = {}
+    try:
+        with open(os.path.join(root, MANIFEST_FILE_NAME), "r") as file:
+            for line in file:
+                try:
+                    volumes[json.loads(line)["volume"]] = None
+                except (ValueError, KeyError):
+                    continue  # torn last line
+    except OSError:
+        pass
+    return list(volumes)
+
+
+def parse_slice_file_name(file_name: str) -> tuple[str, datetime] | None:
+    """
+    Split a slice file name like cam1_20250722_09-41-55.mp4 into the camera name and the
+    start time. Camera names may themselves contain underscores. Returns None for names
+    that do not follow the convention.
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    parts = stem.rsplit("_", 2)
+    if len(parts) != 3 or not parts[0]:
+        return None
+    try:
+        start = datetime.strptime(f"{parts[1]}_{parts[2]}", SLICE_TIME_FORMAT)
+    except ValueError:
+        return None
+    return parts[0], start
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    # several camera processes and transfer processes may write concurrently, so wait
+    # for the lock rather than failing, and use WAL so readers never block writers
+    conn = sqlite3.connect(db_path, timeout=30)
+    _ = conn.execute("PRAGMA journal_mode=WAL")
+    _ = conn.execute("PRAGMA synchronous=NORMAL")
+    _ = conn.executescript(_SCHEMA)
+    return conn
+
+
+def _upsert(conn: sqlite3.Connection, records: list[SliceRecord]):
+    if not records:
+        return
+    _ = conn.executemany(
+        f"INSERT OR REPLACE INTO slices ({', '.join(SliceRecord._fields)}) "
+        f"VALUES ({', '.join('?' for _ in SliceRecord._fields)})",
+        records,
+    )
+    # the longest slice bounds how far before t1 an overlapping slice can start,
+    # which lets range queries use the (camera, start_time) index
+    longest = max(r.end_time - r.start_time for r in records)
+    _ = conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('max_duration', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)",
+        (longest,),
+    )
+
+
+def record_slices(db_path: str, records: list[SliceRecord]):
+    conn = connect(db_path)
+    try:
+        with conn:
+            _upsert(conn, records)
+    finally:
+        conn.close()
+
+
+def record_slice(db_path: str, record: SliceRecord) -> bool:
+    """
+    Add or update one slice. Never raises: a catalog failure must not interrupt
+    recording or compression, so errors are reported and False is returned.
+    """
+    try:
+        record_slices(db_path, [record])
+        return True
+    except Exception as e:
+        print(f"WARNING: failed to update catalog {db_path} for {record.path}: {e}")
+        return False
+
+
+def record_gap(db_path: str, gap: GapRecord) -> bool:
+    """Add a gap in the recording of one camera. Never raises, like record_slice."""
+    try:
+        conn = connect(db_path)
+        try:
+            with conn:
+                _ = conn.execute(
+                    f"INSERT INTO gaps ({', '.join(GapRecord._fields)}) VALUES (?, ?, ?, ?)",
+                    gap,
+                )
+        finally:
+            conn.close()
+        return True
+    except Exception as e:
+        print(f"WARNING: failed to record gap in catalog {db_path} for {gap.camera}: {e}")
+        return False
+
+
+def query_gaps(db_path: str, camera: str | None, t1: float, t2: float) -> list[GapRecord]:
+    """Return all gaps overlapping [t1, t2], ordered by camera and start time."""
+    conn = connect(db_path)
+    try:
+        clauses = ["start_time <= ?", "end_time >= ?"]
+        args: list[object] = [t2, t1]
+        if camera is not None:
+            clauses.append("camera = ?")
+            args.append(camera)
+        rows = conn.execute(
+            f"SELECT {', '.join(GapRecord._fields)} FROM gaps "
+            f"WHERE {' AND '.join(clauses)} ORDER BY camera, start_time",
+            args,
+        ).fetchall()
+    finally:
+        conn.close()
+    return [GapRecord(*r) for r in rows]
+
+
+def remove_slice(db_path: str, path: str):
+    conn = connect(db_path)
+    try:
+        with conn:
+            _ = conn.execute("DELETE FROM slices WHERE path = ?", (path,))
+    finally:
+        conn.close()
+
+
+def query_slices(
+    db_path: str,
+    camera: str | None,
+    t1: float,
+    t2: float,
+    location: str | None = None,
+) -> list[SliceRecord]:
+    """
+    Return all slices overlapping [t1, t2] (epoch seconds), ordered by camera and start
+    time. camera and location of None match everything.
+    """
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'max_duration'").fetchone()
+        max_duration = 0.0 if row is None else row[0]
+        clauses = ["start_time <= ?", "start_time >= ?", "end_time >= ?"]
+        args: list[object] = [t2, t1 - max_duration, t1]
+        if camera is not None:
+            clauses.append("camera = ?")
+            args.append(camera)
+        if location is not None:
+            clauses.append("location = ?")
+            args.append(location)
+        rows = conn.execute(
+            f"SELECT {', '.join(SliceRecord._fields)} FROM slices "
+            f"WHERE {' AND '.join(clauses)} ORDER BY camera, start_time",
+            args,
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        SliceRecord(*r[:10], None if r[10] is None else bool(r[10]), *r[11:])
+        for r in rows
+    ]
+
+
+def _walk_videos(root: str) -> Iterator[os.DirEntry[str]]:
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                        yield entry
+        except OSError as e:
+            print(f"WARNING: cannot scan {e.filename}: {e.strerror}")
+
+
+def _bounded_end(record: SliceRecord, next_start: float | None, time_slice: float | None) -> float:
+    # the mtime is when the file was last written, which for compressed or copied
+    # files can be days after recording: a slice ends no later than the next one of
+    # its camera starts, and lasts at most time_slice
+    end = record.end_time
+    if next_start is not None:
+        end = min(end, next_start)
+    if time_slice is not None:
+        end = min(end, record.start_time + time_slice)
+    return max(end, record.start_time)
+
+
+def scan_tree(
+    db_path: str, root: str, location: str = "raw", time_slice: float | None = None
+) -> tuple[int, int]:
+    """
+    Catalog every slice under root whose file name follows the ratrix_cam_server
+    convention. Files already cataloged with an unchanged mtime are skipped, so
+    repeated scans are incremental. Frame count and codec are left empty since they
+    require opening the video; the end time is taken from the file mtime, which is
+    when the slice was closed (shutil.copy2 preserves it on transfer), bounded by the
+    start of the next slice of the camera and by time_slice if given.
+    Returns (number of new or changed slices, number of files seen).
+    """
+    conn = connect(db_path)
+    try:
+        known = dict(conn.execute("SELECT path, mtime FROM slices").fetchall())
+        records: list[SliceRecord] = []
+        starts: dict[str, list[float]] = {}  # of every slice found, per camera
+        seen = 0
+        for entry in _walk_videos(os.path.abspath(root)):
+            parsed = parse_slice_file_name(entry.name)
+            if parsed is None:
+                continue
+            seen += 1
+            camera, start = parsed
+            starts.setdefault(camera, []).append(start.timestamp())
+            stat = entry.stat()
+            if known.get(entry.path) == stat.st_mtime:
+                continue
+            # folders are named <study_label>_<camera>_<date>
+            folder = os.path.basename(os.path.dirname(entry.path))
+            suffix = f"_{camera}_{start:%Y%m%d}"
+            study_label = folder[: -len(suffix)] if folder.endswith(suffix) else None
+            start_time = start.timestamp()
+            records.append(
+                SliceRecord(
+                    path=entry.path,
+                    camera=camera,
+                    study_label=study_label,
+                    start_time=start_time,
+                    end_time=max(stat.st_mtime, start_time),
+                    n_frames=None,
+                    n_bytes=stat.st_size,
+                    codec=None,
+                    location=location,
+                    mtime=stat.st_mtime,
+                )
+            )
+        for camera_starts in starts.values():
+            camera_starts.sort()
+        bounded = []
+        for r in records:
+            camera_starts = starts[r.camera]
+            i = bisect.bisect_right(camera_starts, r.start_time)
+            next_start = camera_starts[i] if i < len(camera_starts) else None
+            bounded.append(r._replace(end_time=_bounded_end(r, next_start, time_slice)))
+        records = bounded
+        with conn:
+            _upsert(conn, records)
+    finally:
+        conn.close()
+    return len(records), seen
+
+
+def _parse_time(text: str) -> float:
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", SLICE_TIME_FORMAT):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"cannot parse time '{text}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ratrix recording catalog")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="add the slices found under a folder")
+    _ = scan.add_argument("root", type=str, help="folder to scan, eg the save_path")
+    _ = scan.add_argument("--db", type=str, help="catalog file (default: <root>/" + CATALOG_FILE_NAME + ")")
+    _ = scan.add_argument("--location", default="raw", choices=["raw", "compressed"])
+    _ = scan.add_argument(
+        "--time_slice", type=float, default=None, help="slice duration in seconds (the config's time_slice), caps end times"
+    )
+
+    query = commands.add_parser("query", help="list slices overlapping a time range")
+    _ = query.add_argument("--db", type=str, required=True)
+    _ = query.add_argument("--camera", type=str, default=None)
+    _ = query.add_argument("--start", type=_parse_time, required=True, help="eg '2025-07-22 14:02'")
+    _ = query.add_argument("--end", type=_parse_time, required=True)
+    _ = query.add_argument("--location", default=None, choices=["raw", "compressed"])
+
+    gaps = commands.add_parser("gaps", help="list recording gaps overlapping a time range")
+    _ = gaps.add_argument("--db", type=str, required=True)
+    _ = gaps.add_argument("--camera", type=str, default=None)
+    _ = gaps.add_argument("--start", type=_parse_time, required=True, help="eg '2025-07-22 14:02'")
+    _ = gaps.add_argument("--end", type=_parse_time, required=True)
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        db_path = args.db or default_catalog_path(args.root)
+        start = time.perf_counter()
+        added, seen = scan_tree(db_path, args.root, args.location, args.time_slice)
+        print(f"Cataloged {added} new or changed slices of {seen} found in {time.perf_counter() - start:.1f} s")
+    elif args.command == "gaps":
+        for g in query_gaps(args.db, args.camera, args.start, args.end):
+            print(
+                f"{g.camera}\t{datetime.fromtimestamp(g.start_time):%Y-%m-%d %H:%M:%S.%f}"[:-4]
+                + f"\t{g.end_time - g.start_time:.2f} s\t{g.reason or ''}"
+            )
+    else:
+        start = time.perf_counter()
+        records = query_slices(args.db, args.camera, args.start, args.end, args.location)
+        elapsed = time.perf_counter() - start
+        for r in records:
+            print(
+                f"{r.camera}\t{datetime.fromtimestamp(r.start_time):%Y-%m-%d %H:%M:%S}\t"
+                f"{datetime.fromtimestamp(r.end_time):%H:%M:%S}\t{r.location}\t{r.path}"
+            )
+        print(f"{len(records)} slices ({elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Fragmented MP4 video writer.
+
+A cv2.VideoWriter mp4 only becomes readable when release() writes the index (moov atom)
+at the end, so a camera process killed mid-slice leaves an unusable file. This writer
+pipes frames to ffmpeg, which writes the header up front and then a self-contained
+fragment at every keyframe (one keyframe every `fragment_seconds`). A crash therefore
+loses at most the last fragment, and tools can read a slice while it is still growing.
+
+The writer has the same write/release/isOpened interface as cv2.VideoWriter and
+encodes with the same MPEG-4 Part 2 ("mp4v") codec.
+
+To measure the size and CPU overhead of different fragment intervals:
+    python ratrix_fmp4.py --benchmark
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from cv2.typing import MatLike
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+class FragmentedMp4Writer:
+    def __init__(
+        self,
+        path: str,
+        fps: float,
+        frame_size: tuple[int, int],
+        fragment_seconds: float = 2.0,
+        quality: int = 3,
+        fragmented: bool = True,  # False writes a regular mp4, for comparison
+    ):
+        width, height = frame_size
+        self.path = path
+        self.frame_bytes = width * height * 3
+        self.process: subprocess.Popen[bytes] | None = None
+        # a fragment is cut at every keyframe, so the GOP length sets the interval
+        gop = max(1, round(fps * fragment_seconds))
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-c:v", "mpeg4", "-tag:v", "mp4v", "-q:v", str(quality), "-g", str(gop),
+            "-f", "mp4", path,
+        ]  # fmt: skip
+        if fragmented:
+            command[-3:-3] = ["-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL
+            )
+        except OSError as e:
+            print(f"WARNING: could not start ffmpeg for {path}: {e}")
+
+    def isOpened(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame: MatLike):
+        if not self.isOpened() or frame.nbytes != self.frame_bytes:
+            return  # like cv2.VideoWriter, frames that do not fit are dropped
+        assert self.process is not None and self.process.stdin is not None
+        try:
+            _ = self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            print(f"WARNING: ffmpeg stopped writing {self.path}")
+
+    def release(self):
+        if self.process is None:
+            return
+        assert self.process.stdin is not None
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        # closing stdin makes ffmpeg flush the last fragment and exit
+        try:
+            _ = self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+
+def _synthetic_frames(n: int, width: int, height: int) -> list[np.ndarray]:
+    # static noisy background with a moving block, roughly like a home-cage view
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(n):
+        frame = background + rng.integers(0, 6, (height, width, 3), dtype=np.uint8)
+        x = (i * 4) % (width - 80)
+        frame[height // 3 : height // 3 + 80, x : x + 80] = 220
+        frames.append(frame)
+    return frames
+
+
+def _encode(
+    path: str, frames: list[np.ndarray], fps: int, writer_kind: str, interval: float
+) -> tuple[float, float]:
+    height, width = frames[0].shape[:2]
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    child_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if writer_kind == "cv2":
+        writer = cv2.VideoWriter(
+            path, cv2.VideoWriter.fourcc(*"mp4v"), fps, (width, height)
+        )
+    else:
+        writer = FragmentedMp4Writer(
+            path, fps, (width, height), interval, fragmented=writer_kind == "fragmented"
+        )
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    child_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(
+        getattr(end, field) - getattr(start, field)
+        for start, end in [(cpu_start, cpu_end), (child_start, child_end)]
+        for field in ["ru_utime", "ru_stime"]
+    )
+    return os.path.getsize(path) / 1e6, cpu
+
+
+def benchmark(
+    seconds: float, fps: int, width: int, height: int, intervals: list[float]
+):
+    """
+    Compare fragmented output at several fragment intervals with a regular mp4 encoded
+    with the same settings (so the difference is the cost of fragmenting), and with
+    cv2.VideoWriter for reference.
+    """
+    frames = _synthetic_frames(int(seconds * fps), width, height)
+    print(f"{len(frames)} frames of {width}x{height} @ {fps}fps")
+    print(
+        f"{'writer':>24} {'size MB':>8} {'CPU s':>6} {'size overhead':>14} {'CPU overhead':>13}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        size, cpu = _encode(os.path.join(tmp, "cv2.mp4"), frames, fps, "cv2", 0)
+        print(f"{'cv2.VideoWriter':>24} {size:8.2f} {cpu:6.2f}")
+        for interval in intervals:
+            plain_size, plain_cpu = _encode(
+                os.path.join(tmp, f"plain_{interval}.mp4"),
+                frames,
+                fps,
+                "plain",
+                interval,
+            )
+            frag_size, frag_cpu = _encode(
+                os.path.join(tmp, f"frag_{interval}.mp4"),
+                frames,
+                fps,
+                "fragmented",
+                interval,
+            )
+            print(
+                f"{f'regular, keyframe {interval:g} s':>24} {plain_size:8.2f} {plain_cpu:6.2f}"
+            )
+            print(
+                f"{f'fragmented {interval:g} s':>24} {frag_size:8.2f} {frag_cpu:6.2f} "
+                f"{100 * (frag_size / plain_size - 1):13.2f}% {100 * (frag_cpu / plain_cpu - 1):12.1f}%"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fragmented MP4 writer benchmark")
+    _ = parser.add_argument("--benchmark", action="store_true", required=True)
+    _ = parser.add_argument("--seconds", type=float, default=20)
+    _ = parser.add_argument("--fps", type=int, default=30)
+    _ = parser.add_argument("--width", type=int, default=640)
+    _ = parser.add_argument("--height", type=int, default=480)
+    _ = parser.add_argument("--intervals", type=float, nargs="+", default=[1, 2, 5, 10])
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        print("Cannot find ffmpeg!")
+        return
+    benchmark(args.seconds, args.fps, args.width, args.height, args.intervals)
+
+
+if __name__ == "__main__":
+    main()
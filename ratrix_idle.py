@@ -0,0 +1,127 @@
+"""
+Lower frame rate while nothing moves.
+
+With idle_fps set, the camera server keeps capturing every frame but scores each one
+against the one before: both are reduced to the mean colour of each 16x16 pixel block,
+estimated from every 4th pixel of every 4th row (about 0.1 ms for 640x480, under 1 ms
+for 1920x1080), and the largest change of any block is the score. After idle_after
+seconds in which no score exceeded idle_threshold, only every (fps / idle_fps)-th frame
+is written. The first frame whose score exceeds the threshold is written, and so is
+every frame after it, so recording is back at full rate with the frame that shows the
+change.
+
+Each written frame keeps its own capture time in the burned-in time stamp, in the
+timestamp track (timestamp_track, which Config requires with idle_fps) and in the TTL
+frame log. The video file itself has a constant frame rate, so it plays the idle
+stretches faster: the thumbnails, extract_clip and export_mosaic find frames by the
+times of the track, not by the position in the file. At the end of each slice the
+camera server prints how much of it was idle, how many frames were not written and
+about how much storage that saved, and how long it took to get back to full rate.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+from cv2.typing import MatLike
+
+BLOCK = 16  # pixels per side of the blocks compared
+STRIDE = 4  # pixels sampled per side of a block: 16 of its 256 pixels
+
+
+class IdleGate:
+    """Decides for every captured frame whether it is written."""
+
+    def __init__(self, fps: int, idle_fps: float, idle_after: float, threshold: float):
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.threshold = threshold
+        self.keep_every = 1
+        self.set_fps(fps)
+        self.previous: np.ndarray | None = None
+        self.last_change = time.monotonic()
+        self.idle = False
+        self.skipped_in_row = 0
+        self.last_written = True
+        self.returned_at: float | None = None  # change seen, frame not written yet
+        self._reset_slice()
+
+    def _reset_slice(self):
+        self.n_written = 0
+        self.n_skipped = 0
+        self.idle_frames = 0
+        self.return_ms: list[float] = []
+
+    def set_fps(self, fps: int):
+        self.keep_every = max(1, round(fps / self.idle_fps))
+
+    def score(self, frame: MatLike) -> float:
+        height, width = frame.shape[:2]
+        sampled = cv2.resize(
+            frame,
+            (max(1, width // STRIDE), max(1, height // STRIDE)),
+            interpolation=cv2.INTER_NEAREST,
+        )
+        small = cv2.resize(
+            sampled,
+            (max(1, width // BLOCK), max(1, height // BLOCK)),
+            interpolation=cv2.INTER_AREA,
+        )
+        previous, self.previous = self.previous, small
+        if previous is None or previous.shape != small.shape:
+            return float("inf")
+        return float(cv2.absdiff(small, previous).max())
+
+    def admit(self, frame: MatLike) -> bool:
+        """Score a captured frame; True if it should be written."""
+        now = time.monotonic()
+        if self.score(frame) > self.threshold:
+            self.last_change = now
+            if self.idle:
+                self.idle = False
+                self.returned_at = time.perf_counter()
+        elif not self.idle and now - self.last_change >= self.idle_after:
+            self.idle = True
+            self.skipped_in_row = self.keep_every - 1  # write the first idle frame
+        if self.idle:
+            self.idle_frames += 1
+            self.skipped_in_row += 1
+            self.last_written = self.skipped_in_row >= self.keep_every
+            if self.last_written:
+                self.skipped_in_row = 0
+        else:
+            self.last_written = True
+        if self.last_written:
+            self.n_written += 1
+        else:
+            self.n_skipped += 1
+        return self.last_written
+
+    def wrote(self):
+        """Called once an admitted frame is in the writer."""
+        if self.returned_at is not None:
+            self.return_ms.append(1000 * (time.perf_counter() - self.returned_at))
+            self.returned_at = None
+
+    def report_slice(self, camera: str, file_name: str, path: str):
+        """Print the savings of the slice just closed, then start counting anew."""
+        n_frames = self.n_written + self.n_skipped
+        if n_frames and self.idle_frames:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            # idle frames encode smaller than average, so this is an upper bound
+            saved_mb = size / max(1, self.n_written) * self.n_skipped / 1e6
+            returns = ""
+            if self.return_ms:
+                returns = (
+                    f"; back to full rate {len(self.return_ms)} time(s) with the frame "
+                    f"showing the change, written at most {max(self.return_ms):.1f} ms after capture"
+                )
+            print(
+                f"Cam_server: Camera {camera} idle {100 * self.idle_frames / n_frames:.0f}% of {file_name}: "
+                f"wrote {self.n_written} of {n_frames} frames, up to {saved_mb:.1f} MB saved{returns}"
+            )
+        self._reset_slice()
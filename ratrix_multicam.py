@@ -1,26 +1,49 @@
 import argparse
 import multiprocessing
-import shutil
+import multiprocessing.forkserver
+import os
 import signal
 import subprocess
+import sys
 import time
 from datetime import datetime
-from multiprocessing import Process
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
 from multiprocessing.synchronize import Event
 from threading import Thread
 from types import FrameType
 
 import ratrix_cam_server
+import ratrix_ttl
+from ratrix_preview_server import PreviewServer
+from ratrix_qos import (
+    DEFER_TRANSFERS,
+    CameraStatus,
+    QosController,
+    load_per_core,
+    receive_status,
+)
+from ratrix_salvage import start_salvage
+from ratrix_sched import SUPERVISOR, apply_policy, describe
+from ratrix_thumbs import ThumbnailIndexer
+from ratrix_transfer import start_finisher
 from ratrix_utils import (
+    CameraConfig,
     Config,
+    StartMethod,
     ensure_dir_exists,
     load_settings,
     reset_stills,
-    still_path,
+    save_volumes,
+    show_blank_still,
 )
+from ratrix_volumes import camera_volumes
 
 
-def count_video_devices():
+def list_video_devices() -> list[str]:
+    # identify each connected USB camera by its unique ID (used to cache the
+    # results of probing its video modes)
     try:
         result = subprocess.run(
             ["system_profiler", "SPCameraDataType"],
@@ -29,28 +52,180 @@ def count_video_devices():
             text=True,
         )
         output = result.stdout
-        video_device_count = 0
+        devices: list[str] = []
         for line in output.splitlines():
             if "USB Camera:" in line:
-                video_device_count += 1
+                devices.append(f"usb{len(devices)}")
+            elif "Unique ID:" in line and devices:
+                devices[-1] = line.split("Unique ID:", 1)[1].strip()
 
-        return video_device_count
+        return devices
 
     except Exception as e:
         print(f"Error detecting video devices: {e}")
-        return 0
-
-
-def run_without_handlers(config: Config, camera_idx: int, stop_event: Event):
+        return []
+
+
+def run_without_handlers(
+    config: Config,
+    camera_idx: int,
+    stop_event: Event,
+    control: Connection,
+    device_key: str | None,
+    save_volume: str,
+    launched_at: float | None = None,
+):
     _ = signal.signal(signal.SIGINT, signal.SIG_IGN)
     _ = signal.signal(signal.SIGTERM, signal.SIG_IGN)
-    ratrix_cam_server.run(config, camera_idx, stop_event)
+    sys.exit(
+        ratrix_cam_server.run(
+            config,
+            camera_idx,
+            stop_event,
+            control,
+            device_key,
+            save_volume,
+            launched_at,
+        )
+    )
+
+
+def process_context(config: Config) -> BaseContext:
+    """
+    Context the camera and TTL processes are started from; the stop event shared with
+    them must come from it too. With forkserver, a server process imports this module
+    (and with it cv2, numpy, pydantic and the camera server) once, and every camera
+    process is forked from it instead of importing them again.
+    """
+    if config.process_start_method is None:
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context(config.process_start_method)
+    if config.process_start_method == "forkserver":
+        context.set_forkserver_preload(["ratrix_multicam"])
+    return context
+
+
+def _startup_probe(launched_at: float, conn: Connection):
+    conn.send(time.time() - launched_at)
+
+
+def benchmark_startup(config: Config, restarts: int = 5):
+    """
+    Print the process overhead of starting a camera process with each start method:
+    the time from launch until the camera code is imported and ready to open the
+    camera, for the first launch and for restarts (as after a camera crash).
+    """
+    available = multiprocessing.get_all_start_methods()
+    methods: list[StartMethod] = [m for m in ("spawn", "forkserver") if m in available]
+    for method in methods:
+        config.process_start_method = method
+        context = process_context(config)
+        times: list[float] = []
+        for _ in range(restarts + 1):
+            conn, child_conn = Pipe(duplex=False)
+            process = context.Process(
+                target=_startup_probe, args=(time.time(), child_conn)
+            )
+            process.start()
+            times.append(conn.recv())
+            process.join()
+        print(
+            f"{method:>10}: first launch {times[0] * 1000:.0f} ms, "
+            f"restarts {sum(times[1:]) / restarts * 1000:.0f} ms average, "
+            f"{max(times[1:]) * 1000:.0f} ms max"
+        )
+
+
+# settings that can be changed in the config file while recording
+LIVE_SETTINGS = [
+    "study_label",
+    "default_fps",
+    "default_width",
+    "default_height",
+    "default_cam_exposure",
+    "preview_interval",
+]
+LIVE_CAMERA_SETTINGS = ["name", "row", "col", "fps", "width", "height", "exposure", "low_priority"]
+SALVAGE_STOP_SECONDS = 5  # for a remux to be cancelled at shutdown
+
+
+def apply_live_settings(
+    config: Config, new_config: Config, controls: list[Connection | None]
+) -> list[int]:
+    """
+    Copy the settings that can change during a run from new_config into config and
+    send each running camera whose effective settings changed its new settings.
+    Cameras whose settings did not change are not contacted.
+    Returns the indices of the cameras whose settings changed.
+    """
+    if len(new_config.cameras) != len(config.cameras):
+        print("WARNING: Number of cameras changed in config file; restart to apply")
+        return []
+    ignored = [
+        field
+        for field in Config.model_fields
+        if field not in LIVE_SETTINGS
+        and field != "cameras"
+        and getattr(config, field) != getattr(new_config, field)
+    ]
+    ignored += [
+        f"{camera.name}.{field}"
+        for camera, new_camera in zip(config.cameras, new_config.cameras)
+        for field in CameraConfig.model_fields
+        if field not in LIVE_CAMERA_SETTINGS
+        and getattr(camera, field) != getattr(new_camera, field)
+    ]
+    if ignored:
+        print(f"WARNING: Changes to {', '.join(ignored)} take effect after restart")
+
+    before = [
+        ratrix_cam_server.control_message(config, idx)
+        for idx in range(len(config.cameras))
+    ]
+    for field in LIVE_SETTINGS:
+        setattr(config, field, getattr(new_config, field))
+    for camera, new_camera in zip(config.cameras, new_config.cameras):
+        for field in LIVE_CAMERA_SETTINGS:
+            setattr(camera, field, getattr(new_camera, field))
+
+    changed: list[int] = []
+    for idx, (camera, control) in enumerate(zip(config.cameras, controls)):
+        message = ratrix_cam_server.control_message(config, idx)
+        if message == before[idx]:
+            continue
+        changed.append(idx)
+        print(f"Multicam: Sending new settings to camera {camera.name}")
+        if control is None:
+            continue  # not running, will start with the new settings
+        try:
+            control.send(message)
+        except (BrokenPipeError, OSError):
+            pass  # camera process exited, it will restart with the new settings
+    return changed
+
+
+def send_qos(qos: QosController, controls: list[Connection | None]):
+    # a camera ignores a level it already has, so sending to all of them is harmless
+    for idx, control in enumerate(controls):
+        if control is None:
+            continue
+        try:
+            control.send(qos.message(idx))
+        except (BrokenPipeError, OSError):
+            pass  # camera process exited, it restarts at the current level
 
 
 # Main loop: check every second and restart any cameras or processes that are not running
-def run(config: Config, stop_event: Event):
+def run(config: Config, stop_event: Event, config_path: str | None = None):
     print(f"Settings for '{config.study_label}' successfully loaded")
 
+    if config.scheduling:
+        # the camera and transfer processes place themselves when they start
+        skipped = apply_policy(config, SUPERVISOR)
+        print(f"Multicam: Scheduling {describe(config)}")
+        if skipped:
+            print(f"Multicam: Not supported on this Mac: {', '.join(skipped)}")
+
     if not ensure_dir_exists(config.stills_path):
         print("ERROR: Stills folder does not exist and could not be created")
         return
@@ -64,15 +239,40 @@ def run(config: Config, stop_event: Event):
     else:
         print(f"Temp streaming folder: {config.temp_path}")
 
-    if not ensure_dir_exists(config.save_path):
-        print("ERROR: Recording folder does not exist and could not be created")
-        return
-    else:
-        print(f"Recording folder: {config.save_path}")
+    for volume in save_volumes(config):
+        if not ensure_dir_exists(volume):
+            print("ERROR: Recording folder does not exist and could not be created")
+            return
+        else:
+            print(f"Recording folder: {volume}")
 
     print("Removing any old still images")
     reset_stills(config)
 
+    # transfers left queued by an earlier session are resumed by a detached finisher;
+    # other files it left in the temp folder are listed before any camera starts, and
+    # recovered in the background while the cameras come up
+    _ = start_finisher(config)
+    salvage_thread = start_salvage(config, stop_event)
+
+    # spread the cameras over the save drives
+    volume_plan = camera_volumes(config)
+
+    context = process_context(config)
+    if context.get_start_method() == "forkserver":
+        # import the camera code in the fork server now, not at the first camera launch
+        multiprocessing.forkserver.ensure_running()
+
+    # thumbnails for browsing are extracted from the slices as they are catalogued
+    thumbnail_indexer: ThumbnailIndexer | None = None
+    if config.thumbnail_interval > 0:
+        thumbnail_indexer = ThumbnailIndexer(config)
+        thumbnail_indexer.start()
+
+    # optional work is shed when cameras cannot keep up, see ratrix_qos
+    qos = QosController(config) if config.qos else None
+    camera_status: dict[int, CameraStatus] = {}
+
     print("Multicam: Starting cameras...")
 
     num_cameras = len(config.cameras)
@@ -80,12 +280,45 @@ def run(config: Config, stop_event: Event):
 
     camera_processes: list[Process | None] = [None for _ in range(num_cameras)]
     camera_state: list[bool] = [False for _ in range(num_cameras)]
+    # supervisor ends of the control pipes of the camera processes
+    camera_controls: list[Connection | None] = [None for _ in range(num_cameras)]
+    config_mtime = None if config_path is None else os.path.getmtime(config_path)
+    # cameras that cannot deliver their configured video mode are not relaunched
+    # until their settings are changed
+    camera_mode_unavailable: list[bool] = [False for _ in range(num_cameras)]
     p_TTL: Process | None = None
+    TTL_started = 0.0  # time of the last TTL logger launch
+
+    preview_server: PreviewServer | None = None
+    if config.preview_http_port is not None:
+        try:
+            preview_server = PreviewServer(config, lambda: camera_state)
+            preview_server.start()
+        except OSError as e:
+            print(f"WARNING: could not start preview server: {e}")
 
     devices = 0
     while not stop_event.is_set():
+        # apply changes made to the config file while running
+        if config_path is not None:
+            try:
+                mtime = os.path.getmtime(config_path)
+            except OSError:
+                mtime = config_mtime
+            if mtime != config_mtime:
+                config_mtime = mtime
+                new_config = load_settings(config_path)
+                if new_config is not None:
+                    for idx in apply_live_settings(config, new_config, camera_controls):
+                        camera_mode_unavailable[idx] = False
+                    if qos is not None:
+                        # low_priority may have changed, which the settings sent do not carry
+                        _ = qos.settings_changed()
+                        send_qos(qos, camera_controls)
+
         prev_devices = devices
-        devices = count_video_devices()
+        device_keys = list_video_devices()
+        devices = len(device_keys)
         if devices < num_cameras:#only report if not enough cameras to launch
             print('seeing ',devices,'devices; was expecting',num_cameras)
         
@@ -104,48 +337,96 @@ def run(config: Config, stop_event: Event):
             if camera_state[idx]: #still running
                 continue
             elif cam_up_prev:# not running, but was previously: indicate offline in GUI and terminal
-                _ = shutil.copyfile(
-                    config.blank_image,
-                    still_path(config.stills_path, camera_config.name),
-                )
+                show_blank_still(config, camera_config.name)
                 print(
                     f"Camera {camera_config.name} went offline at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}."
                 )
-            if not have_all_cameras:
+            if (
+                process is not None
+                and process.exitcode == ratrix_cam_server.EXIT_MODE_UNAVAILABLE
+                and not camera_mode_unavailable[idx]
+            ):
+                camera_mode_unavailable[idx] = True
+                print(
+                    f"Multicam: Camera {camera_config.name} will not be restarted until its settings are changed"
+                )
+            if not have_all_cameras or camera_mode_unavailable[idx]:
                 continue
             # only when all devices are detected, try to re-launch the ones that went offline
             try: 
                 if just_started_a_cam: # if another camera was already launched within this loop,
                     time.sleep(5)  # wait a bit before trying to launch another one (640x480 0.5 is suffic)
-                cam_proc = Process(
+                control, child_control = Pipe()
+                cam_proc = context.Process(
                     target=run_without_handlers,
-                    args=(config, idx, stop_event),
+                    args=(
+                        config,
+                        idx,
+                        stop_event,
+                        child_control,
+                        device_keys[idx],
+                        volume_plan[idx],
+                        time.time(),
+                    ),
                 )
                 cam_proc.start()
+                child_control.close()
                 camera_processes[idx] = cam_proc
+                if camera_controls[idx] is not None:
+                    camera_controls[idx].close()
+                camera_controls[idx] = control
+                _ = camera_status.pop(idx, None)
+                if qos is not None:
+                    control.send(qos.message(idx))
                 just_started_a_cam=True
                 print(f"Multicam: Started camera {camera_config.name}")
                 
             except Exception as e:
                 print(f"Multicam: error starting camera {camera_config.name}:", e)
 
-        # check the TTL process and restart if applicable
-        if config.recording_ttl:
-            raise Exception("TTL server not implemented")
-            if p_TTL is not None and p_TTL.is_alive():
-                continue
+        # check the TTL process and restart if applicable (at most every 10 s, the
+        # device may be unplugged)
+        if (
+            config.recording_ttl
+            and (p_TTL is None or not p_TTL.is_alive())
+            and time.monotonic() - TTL_started > 10
+        ):
             # if not running, try to relaunch
             try:
-                # p_TTL = Process(target=ttl.run, args=(...))
-                print("TTL logging restarted")
+                p_TTL = context.Process(
+                    target=ratrix_ttl.run_without_handlers, args=(config, stop_event)
+                )
+                p_TTL.start()
+                TTL_started = time.monotonic()
+                print("TTL logging started")
             except Exception as e:
                 print(type(e), e)
                 print("Cannot restart TTL logging")
+
+        if qos is not None:
+            for idx, (process, control) in enumerate(
+                zip(camera_processes, camera_controls)
+            ):
+                status = receive_status(control)
+                if status is not None:
+                    camera_status[idx] = status
+                if process is None or not process.is_alive():
+                    _ = camera_status.pop(idx, None)
+            if qos.update(camera_status, load_per_core(), time.monotonic()):
+                send_qos(qos, camera_controls)
+                if thumbnail_indexer is not None:
+                    thumbnail_indexer.paused = qos.level >= DEFER_TRANSFERS
         _ = stop_event.wait(1)
 
     print("Multicam attempting to shut down nicely")
-
-    timeout = 600 #changed from 10 to allow time for transcoding to complete 250716
+    shutdown_start = time.perf_counter()
+    if preview_server is not None:
+        preview_server.stop()
+    if thumbnail_indexer is not None:
+        thumbnail_indexer.stop_event.set()  # slices left over are indexed next session
+
+    # cameras no longer wait for their file transfers, those are left to the finisher
+    timeout = 60
     print("Waiting for child processes to terminate...")
     for _ in range(int(timeout / 0.1)):
         all_cameras_terminated = all(
@@ -167,11 +448,34 @@ def run(config: Config, stop_event: Event):
             print("TTL logging failed to terminate, killing process")
             p_TTL.kill()
 
-    print("Ratrix Multicam: Shutdown complete")
+    _ = start_finisher(config)
+
+    if salvage_thread is not None and salvage_thread.is_alive():
+        # stop_event cancels it; what is left is salvaged at the next start
+        salvage_thread.join(timeout=SALVAGE_STOP_SECONDS)
+
+    print(
+        f"Ratrix Multicam: Shutdown complete in {time.perf_counter() - shutdown_start:.1f} s"
+    )
 
 
 def main():
-    stop_event = multiprocessing.Event()
+    parser = argparse.ArgumentParser(
+        description="Ratrix Multi-Camera Setup", add_help=False
+    )
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    _ = parser.add_argument("--benchmark_startup", action="store_true")
+    args = vars(parser.parse_args())
+
+    print("Accessing settings file...")  # get settings from the json file
+    config = load_settings(args["config"])
+    if config is None:
+        return
+    if args["benchmark_startup"]:
+        benchmark_startup(config)
+        return
+
+    stop_event = process_context(config).Event()
 
     def stop():
         # Thread is needed to prevent dead lock with stop_event.wait
@@ -187,18 +491,7 @@ def main():
     _ = signal.signal(signal.SIGINT, int_handler)
     _ = signal.signal(signal.SIGTERM, lambda sig, frame: stop())
 
-    parser = argparse.ArgumentParser(
-        description="Ratrix Multi-Camera Setup", add_help=False
-    )
-    _ = parser.add_argument("-c", "--config", type=str, required=True)
-    args = vars(parser.parse_args())
-
-    print("Accessing settings file...")  # get settings from the json file
-    config = load_settings(args["config"])
-    if config is None:
-        return
-
-    run(config, stop_event)
+    run(config, stop_event, args["config"])
 
 
 # If in recording mode, initialize the cameras and any other processes on entry
@@ -0,0 +1,290 @@
+"""
+Headless HTTP preview server for remote monitoring of the rack.
+
+Serves, for each camera, the latest still as a single JPEG (/cam/<name>.jpg) and as an
+MJPEG stream (/cam/<name>.mjpg), plus a status summary (/status.json) and a simple page
+showing all cameras (/). The stills written by the camera servers are picked up by one
+encoder thread at the preview interval; each still is encoded at most once and the same
+bytes are fanned out to every connected client, so extra viewers cost no encoding.
+
+It runs as a thread inside ratrix_multicam when `preview_http_port` is set in the
+config, or standalone next to a running rack:
+    python ratrix_preview_server.py -c config.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Callable
+from html import escape
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import cv2
+import numpy as np
+
+from ratrix_utils import Config, load_settings, save_volumes, still_path
+
+BOUNDARY = "ratrixframe"
+JPEG_MAGIC = b"\xff\xd8"
+
+
+class PreviewHub:
+    """Latest JPEG per camera, with a condition clients wait on for the next one."""
+
+    def __init__(self, camera_names: list[str]):
+        self.condition = threading.Condition()
+        self.frames: dict[str, tuple[int, bytes, float]] = {
+            name: (0, b"", 0.0) for name in camera_names
+        }
+
+    def publish(self, name: str, jpeg: bytes):
+        with self.condition:
+            seq = self.frames[name][0] + 1
+            self.frames[name] = (seq, jpeg, time.time())
+            self.condition.notify_all()
+
+    def latest(self, name: str) -> tuple[int, bytes, float]:
+        with self.condition:
+            return self.frames[name]
+
+    def wait_newer(self, name: str, seq: int, timeout: float) -> tuple[int, bytes, float]:
+        with self.condition:
+            _ = self.condition.wait_for(
+                lambda: self.frames[name][0] != seq, timeout=timeout
+            )
+            return self.frames[name]
+
+
+class PreviewEncoder(threading.Thread):
+    """Publishes each camera's still to the hub whenever the file changes."""
+
+    def __init__(self, config: Config, hub: PreviewHub, quality: int = 80):
+        super().__init__(daemon=True)
+        self.config = config
+        self.hub = hub
+        self.quality = quality
+        self.stop_event = threading.Event()
+        self.mtimes: dict[str, float] = {}
+        self.encodes = 0  # stills that had to be re-encoded (not already JPEG)
+        self.cpu_time = 0.0
+
+    def _read(self, path: str) -> bytes | None:
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        if data.startswith(JPEG_MAGIC) and data.endswith(b"\xff\xd9"):
+            return data  # complete JPEG, pass through as is
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None  # truncated while being written, retry next time
+        ok, jpeg = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        )
+        self.encodes += 1
+        return jpeg.tobytes() if ok else None
+
+    def update(self):
+        for camera in self.config.cameras:
+            path = still_path(self.config.stills_path, camera.name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if self.mtimes.get(camera.name) == mtime:
+                continue
+            jpeg = self._read(path)
+            if jpeg is None:
+                continue
+            self.mtimes[camera.name] = mtime
+            self.hub.publish(camera.name, jpeg)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            cpu_start = time.thread_time()
+            self.update()
+            self.cpu_time += time.thread_time() - cpu_start
+            _ = self.stop_event.wait(min(self.config.preview_interval, 1))
+
+
+class PreviewServer:
+    def __init__(
+        self,
+        config: Config,
+        camera_state: Callable[[], list[bool]] | None = None,
+    ):
+        self.config = config
+        self.camera_state = camera_state
+        self.started = time.time()
+        self.hub = PreviewHub([camera.name for camera in config.cameras])
+        self.encoder = PreviewEncoder(config, self.hub)
+        self.httpd = ThreadingHTTPServer(
+            (config.preview_http_host, config.preview_http_port or 0),
+            _make_handler(self),
+        )
+        self.httpd.daemon_threads = True
+        self.clients = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.encoder.start()
+        self.thread.start()
+        print(f"Preview server: listening on http://{self.config.preview_http_host}:{self.port}/")
+
+    def stop(self):
+        self.encoder.stop_event.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def status(self) -> dict[str, object]:
+        now = time.time()
+        states = self.camera_state() if self.camera_state is not None else None
+        cameras = []
+        for idx, camera in enumerate(self.config.cameras):
+            seq, _, published = self.hub.latest(camera.name)
+            cameras.append(
+                {
+                    "name": camera.name,
+                    "online": None if states is None else states[idx],
+                    "preview_age_s": None if seq == 0 else round(now - published, 1),
+                }
+            )
+        disks = []
+        for volume in save_volumes(self.config):
+            try:
+                total, used, free = shutil.disk_usage(volume)
+                disks.append({"path": volume, "total": total, "used": used, "free": free})
+            except OSError:
+                disks.append({"path": volume, "total": None, "used": None, "free": None})
+        return {
+            "rack_name": self.config.rack_name,
+            "study_label": self.config.study_label,
+            "time": now,
+            "uptime_s": round(now - self.started, 1),
+            "cameras": cameras,
+            "save_path_disk": disks,
+            "clients": self.clients,
+            "encoder_cpu_s": round(self.encoder.cpu_time, 3),
+        }
+
+
+def _index_page(server: PreviewServer) -> bytes:
+    tiles = "".join(
+        f'<figure><img src="/cam/{quote(camera.name)}.mjpg" width="320">'
+        f"<figcaption>{escape(camera.name)}</figcaption></figure>"
+        for camera in server.config.cameras
+    )
+    return (
+        "<!doctype html><html><head><title>"
+        f"{escape(server.config.rack_name)}</title>"
+        "<style>body{background:#3b0a0a;color:#fff;font-family:sans-serif}"
+        "figure{display:inline-block;margin:4px}</style></head><body>"
+        f"<h3>{escape(server.config.rack_name)}: {escape(server.config.study_label)}</h3>"
+        f"{tiles}"
+        '<p><a href="/status.json" style="color:#fff">status</a></p></body></html>'
+    ).encode()
+
+
+def _make_handler(server: PreviewServer) -> type[BaseHTTPRequestHandler]:
+    names = {camera.name for camera in server.config.cameras}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: object):
+            pass  # keep the terminal for recording messages
+
+        def _send(self, body: bytes, content_type: str):
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            _ = self.wfile.write(body)
+
+        def do_GET(self):
+            path = unquote(self.path.split("?", 1)[0])
+            if path == "/":
+                self._send(_index_page(server), "text/html")
+            elif path == "/status.json":
+                self._send(json.dumps(server.status()).encode(), "application/json")
+            elif path.startswith("/cam/") and path[5:-4] in names and path.endswith(".jpg"):
+                seq, jpeg, _ = server.hub.latest(path[5:-4])
+                if seq == 0:
+                    self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "no preview yet")
+                else:
+                    self._send(jpeg, "image/jpeg")
+            elif path.startswith("/cam/") and path[5:-5] in names and path.endswith(".mjpg"):
+                self._stream(path[5:-5])
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+
+        def _stream(self, name: str):
+            self.send_response(HTTPStatus.OK)
+            self.send_header(
+                "Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+            )
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            with server.hub.condition:
+                server.clients += 1
+            try:
+                seq = 0
+                while not server.encoder.stop_event.is_set():
+                    # re-send the last frame now and then so idle streams stay open
+                    new_seq, jpeg, _ = server.hub.wait_newer(name, seq, timeout=10)
+                    if not jpeg:
+                        continue
+                    seq = new_seq
+                    _ = self.wfile.write(
+                        f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                        f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                        + jpeg
+                        + b"\r\n"
+                    )
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client went away
+            finally:
+                with server.hub.condition:
+                    server.clients -= 1
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ratrix preview server", add_help=False)
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    _ = parser.add_argument("-p", "--port", type=int, default=None)
+    args = vars(parser.parse_args())
+
+    config = load_settings(args["config"])
+    if config is None:
+        print("ERROR: Cannot load settings")
+        return
+    if args["port"] is not None:
+        config.preview_http_port = args["port"]
+    if config.preview_http_port is None:
+        config.preview_http_port = 8080
+
+    server = PreviewServer(config)
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    print("Preview server: stopped")
+
+
+if __name__ == "__main__":
+    main()
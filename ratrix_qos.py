@@ -0,0 +1,191 @@
+"""
+Load shedding when the Mac cannot keep up with the cameras.
+
+With qos set, every camera server reports to ratrix_multicam once per second how many
+frames it captured, against the rate its camera delivered when it was probed. When any
+camera misses more than qos_max_frame_loss of its frames, or the load average per core
+exceeds qos_max_load, for ESCALATE_SECONDS, the supervisor raises the shedding level by
+one; after RECOVER_SECONDS of comfortable margins it lowers it by one again:
+
+    1  no preview stills
+    2  burned-in overlay reduced to the time, drawn without anti-aliasing
+    3  transfers to the save drive (they stay queued, and are released one per second
+       once the level drops) and thumbnail indexing deferred
+    4  cameras marked low_priority record at half their frame rate, from a new slice
+
+Each level includes the ones below it. Level 4 is only used while a camera is marked
+low_priority; a mark changed while recording applies once the config is reloaded. Every change is printed and appended, with its reason, to
+ratrix_qos.jsonl on the first save drive, so the recordings it affected can be found.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from multiprocessing.connection import Connection
+
+from pydantic import BaseModel
+
+from ratrix_utils import Config, save_volumes
+
+SKIP_PREVIEWS = 1
+SIMPLIFY_OVERLAYS = 2
+DEFER_TRANSFERS = 3
+LOWER_FPS = 4
+LEVEL_NAMES = [
+    "normal",
+    "skip previews",
+    "simplify overlays",
+    "defer transfers",
+    "lower fps of low-priority cameras",
+]
+ESCALATE_SECONDS = 5  # overload lasting this long sheds the next kind of work
+RECOVER_SECONDS = 30  # without overload this long, the last kind shed is restored
+STATUS_INTERVAL = 1.0
+QOS_LOG = "ratrix_qos.jsonl"
+
+
+class QosLevel(BaseModel):
+    """Sent by the supervisor to a camera server."""
+
+    level: int
+    reduce_fps: bool = False  # record at reduced_fps of the configured rate
+
+
+class CameraStatus(BaseModel):
+    """Sent by a camera server to the supervisor."""
+
+    captured_fps: float
+    expected_fps: float  # rate the camera delivers without load
+
+    @property
+    def frame_loss(self) -> float:
+        return max(0.0, 1 - self.captured_fps / self.expected_fps)
+
+
+def reduced_fps(fps: int) -> int:
+    return max(1, fps // 2)
+
+
+class FrameMeter:
+    """Counts the frames of a camera server between status reports."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.frames = 0
+
+    def status(self, expected_fps: float) -> CameraStatus | None:
+        """Count a frame; once per STATUS_INTERVAL, return the rate since the last report."""
+        self.frames += 1
+        elapsed = time.monotonic() - self.start
+        if elapsed < STATUS_INTERVAL:
+            return None
+        status = CameraStatus(
+            captured_fps=self.frames / elapsed, expected_fps=expected_fps
+        )
+        self.__init__()
+        return status
+
+
+def receive_status(control: Connection | None) -> CameraStatus | None:
+    # only the most recent report matters
+    status = None
+    try:
+        while control is not None and control.poll():
+            message = control.recv()
+            if isinstance(message, CameraStatus):
+                status = message
+    except (EOFError, OSError):
+        pass  # camera process exited, the supervisor restarts it
+    return status
+
+
+def load_per_core() -> float:
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+class QosController:
+    def __init__(self, config: Config):
+        self.config = config
+        self.level = 0
+        self.log_path = os.path.join(save_volumes(config)[0], QOS_LOG)
+        self.overloaded_since: float | None = None
+        self.recovered_since: float | None = None
+
+    @property
+    def max_level(self) -> int:
+        # from the current config: low_priority can be changed while recording
+        if any(camera.low_priority for camera in self.config.cameras):
+            return LOWER_FPS
+        return DEFER_TRANSFERS
+
+    def settings_changed(self) -> bool:
+        """Call after a live config change; returns True if the level had to come down."""
+        if self.level <= self.max_level:
+            return False
+        self.level = self.max_level
+        self.overloaded_since = self.recovered_since = None
+        self._log({}, load_per_core())
+        return True
+
+    def message(self, camera_idx: int) -> QosLevel:
+        return QosLevel(
+            level=self.level,
+            reduce_fps=self.level >= LOWER_FPS
+            and self.config.cameras[camera_idx].low_priority,
+        )
+
+    def update(
+        self, statuses: dict[int, CameraStatus], load: float, now: float
+    ) -> bool:
+        """Track the latest camera reports and load; returns True if the level changed."""
+        losses = {
+            self.config.cameras[idx].name: status.frame_loss
+            for idx, status in statuses.items()
+        }
+        worst = max(losses.values(), default=0.0)
+        max_loss, max_load = self.config.qos_max_frame_loss, self.config.qos_max_load
+        if worst > max_loss or load > max_load:
+            self.recovered_since = None
+            if self.overloaded_since is None:
+                self.overloaded_since = now
+            if (
+                now - self.overloaded_since < ESCALATE_SECONDS
+                or self.level >= self.max_level
+            ):
+                return False
+            self.overloaded_since = now  # give the new level time to take effect
+            self.level += 1
+        elif worst < max_loss / 2 and load < 0.75 * max_load:
+            self.overloaded_since = None
+            if self.recovered_since is None:
+                self.recovered_since = now
+            if now - self.recovered_since < RECOVER_SECONDS or self.level == 0:
+                return False
+            self.recovered_since = now
+            self.level -= 1
+        else:  # in between: hold the current level
+            self.overloaded_since = self.recovered_since = None
+            return False
+        self._log(losses, load)
+        return True
+
+    def _log(self, losses: dict[str, float], load: float):
+        lossy = {name: round(loss, 3) for name, loss in losses.items() if loss > 0}
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "level": self.level,
+            "action": LEVEL_NAMES[self.level],
+            "frame_loss": lossy,
+            "load_per_core": round(load, 2),
+        }
+        reason = ", ".join(f"{name} {100 * loss:.0f}%" for name, loss in lossy.items())
+        print(
+            f"QoS {entry['time']}: level {self.level} ({LEVEL_NAMES[self.level]}); "
+            f"frames missed: {reason or 'none'}, load per core {load:.2f}"
+        )
+        try:
+            with open(self.log_path, "a") as file:
+                _ = file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"WARNING: could not write the QoS log {self.log_path}: {e}")
@@ -0,0 +1,298 @@
+"""
+Recover video slices left unfinished by an earlier session.
+
+If the rack loses power or a camera process is killed, the slice being recorded stays in
+temp_path/<study_label>_<camera>/ and is never moved (slices that were waiting for
+transfer are left to the transfer finisher, see ratrix_transfer), or, when recording
+directly to save_path, keeps its ".recording" suffix there. At startup,
+ratrix_multicam lists these orphans before any camera starts, so files of the new session
+are never touched, and salvages them on a pool of background threads while the cameras
+come up: each file is remuxed with ffmpeg into the date folder it would have been
+transferred to, which rebuilds the index of a fragmented or cleanly closed file, and added
+to the slice catalog. Files that cannot be read are moved to temp_path/unrecoverable/ for
+manual inspection, so they are not retried every startup. Salvage does not hold up
+shutdown: when the cameras stop, running remuxes are cancelled, and the files left are
+salvaged at the next start (a remux goes to a .part file that is only renamed once
+complete, and the orphan is only removed once the slice is catalogued).
+
+To salvage without starting the cameras:
+    python ratrix_salvage.py -c config.json
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.synchronize import Event
+from threading import Thread
+from typing import NamedTuple
+
+import cv2
+
+from ratrix_catalog import SliceRecord, parse_slice_file_name, record_slice
+from ratrix_fmp4 import ffmpeg_available
+from ratrix_timestamps import move_sidecar
+from ratrix_transfer import TRANSFER_QUEUE_DIR, pending_temp_files, transfer_queue_dir
+from ratrix_utils import (
+    RECORDING_SUFFIX,
+    Config,
+    catalog_path,
+    finished_name,
+    load_settings,
+    save_volumes,
+)
+from ratrix_volumes import choose_volume
+
+UNRECOVERABLE_DIR = "unrecoverable"
+# folders in temp_path that do not hold camera slices
+NON_SLICE_DIRS = {"camera_probe", TRANSFER_QUEUE_DIR, UNRECOVERABLE_DIR}
+
+
+class Orphan(NamedTuple):
+    path: str
+    label: str  # <study_label>_<camera>, the name of the temp folder
+    volume: str | None = None  # save drive the file is on, None if in the temp folder
+
+
+class SalvageResult(NamedTuple):
+    path: str
+    out_path: str | None  # None if the file could not be recovered
+    n_frames: int
+
+
+def find_orphans(config: Config) -> list[Orphan]:
+    # files with a queued transfer are left to the transfer finisher
+    queued = pending_temp_files(transfer_queue_dir(config))
+    orphans: list[Orphan] = []
+    try:
+        folders = [
+            entry
+            for entry in os.scandir(config.temp_path)
+            if entry.is_dir() and entry.name not in NON_SLICE_DIRS
+        ]
+    except OSError:
+        return []
+    for folder in folders:
+        for entry in os.scandir(folder.path):
+            if (
+                entry.is_file()
+                and entry.name.endswith(config.video_ext)
+                and entry.path not in queued
+            ):
+                orphans.append(Orphan(entry.path, folder.name))
+
+    # slices recorded directly to save_path that were never finished keep their
+    # in-progress suffix, in folders named <study_label>_<camera>_<YYYYmmdd>
+    for volume in save_volumes(config):
+        try:
+            folders = [entry for entry in os.scandir(volume) if entry.is_dir()]
+        except OSError:
+            continue
+        for folder in folders:
+            try:
+                entries = list(os.scandir(folder.path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(RECORDING_SUFFIX + config.video_ext):
+                    label = folder.name.rsplit("_", 1)[0]
+                    orphans.append(Orphan(entry.path, label, volume))
+    return sorted(orphans)
+
+
+def _count_frames(path: str) -> int:
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        return 0
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return max(n_frames, 0)
+
+
+class SalvageStopped(Exception):
+    pass
+
+
+def _remux(path: str, out_path: str, stop: Event | None = None) -> bool:
+    # stream copy into a regular mp4; writes a fresh index, never re-encodes
+    process = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+         "-map", "0:v:0", "-c", "copy", "-f", "mp4", out_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )  # fmt: skip
+    while True:
+        try:
+            returncode = process.wait(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if stop is not None and stop.is_set():
+                process.kill()
+                _ = process.wait()
+                raise SalvageStopped()
+    return returncode == 0 and os.path.isfile(out_path)
+
+
+def _set_aside(config: Config, orphan: Orphan):
+    folder = os.path.join(config.temp_path, UNRECOVERABLE_DIR, orphan.label)
+    try:
+        os.makedirs(folder, exist_ok=True)
+        os.replace(orphan.path, os.path.join(folder, os.path.basename(orphan.path)))
+        print(
+            f"Salvage: {os.path.basename(orphan.path)} could not be recovered, moved to {folder}"
+        )
+    except OSError as e:
+        print(f"WARNING: could not move unrecoverable file {orphan.path}: {e}")
+
+
+def salvage_file(
+    config: Config, orphan: Orphan, use_ffmpeg: bool, stop: Event | None = None
+) -> SalvageResult:
+    name = finished_name(os.path.basename(orphan.path))
+    parsed = parse_slice_file_name(name)
+    try:
+        stat = os.stat(orphan.path)
+    except FileNotFoundError:
+        return SalvageResult(orphan.path, None, 0)  # transferred in the meantime
+    if parsed is None or stat.st_size == 0:
+        _set_aside(config, orphan)
+        return SalvageResult(orphan.path, None, 0)
+    camera, start = parsed
+    save_dir = os.path.join(
+        orphan.volume or choose_volume(config, save_volumes(config)[0]),
+        f"{orphan.label}_{start.strftime('%Y%m%d')}",
+    )
+    out_path = os.path.join(save_dir, name)
+    os.makedirs(save_dir, exist_ok=True)
+
+    # the session may have ended after the copy finished but before the temp file was
+    # removed; the complete copy is then already in place
+    if os.path.isfile(out_path) and os.path.getsize(out_path) == stat.st_size:
+        n_frames = _count_frames(out_path)
+    else:
+        part_path = out_path + ".part"
+        if use_ffmpeg:
+            try:
+                recovered = _remux(orphan.path, part_path, stop)
+            except SalvageStopped:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+        else:
+            # without ffmpeg only files cv2 can open are kept, copied as they are
+            recovered = _count_frames(orphan.path) > 0
+            if recovered:
+                _ = shutil.copy2(orphan.path, part_path)
+        n_frames = _count_frames(part_path) if recovered else 0
+        if n_frames == 0:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            _set_aside(config, orphan)
+            return SalvageResult(orphan.path, None, 0)
+        os.replace(part_path, out_path)
+
+    _ = record_slice(
+        catalog_path(config),
+        SliceRecord(
+            path=out_path,
+            camera=camera,
+            study_label=orphan.label.removesuffix(f"_{camera}"),
+            start_time=start.timestamp(),
+            end_time=stat.st_mtime,  # last write before the session ended
+            n_frames=n_frames,
+            n_bytes=os.path.getsize(out_path),
+            codec="mp4v",
+            location="raw",
+            mtime=os.path.getmtime(out_path),
+        ),
+    )
+    os.remove(orphan.path)
+    move_sidecar(orphan.path, out_path)
+    return SalvageResult(orphan.path, out_path, n_frames)
+
+
+def salvage(
+    config: Config,
+    orphans: list[Orphan],
+    n_workers: int = 4,
+    stop: Event | None = None,
+):
+    """
+    Salvage the given files concurrently and report what was recovered. Once stop is
+    set, the files not done yet are left for the next start.
+    """
+    if not orphans:
+        return
+    timer = time.perf_counter()
+    use_ffmpeg = ffmpeg_available()
+    if not use_ffmpeg:
+        print("WARNING: ffmpeg not found, salvage can only copy files that are intact")
+
+    def salvage_one(orphan: Orphan) -> SalvageResult | None:
+        if stop is not None and stop.is_set():
+            return None
+        try:
+            return salvage_file(config, orphan, use_ffmpeg, stop)
+        except SalvageStopped:
+            return None
+        except Exception as e:
+            print(f"WARNING: failed to salvage {orphan.path}: {e}")
+            return SalvageResult(orphan.path, None, 0)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        outcomes = list(pool.map(salvage_one, orphans))
+    results = [r for r in outcomes if r is not None]
+    if len(results) < len(outcomes):
+        print(
+            f"Salvage: stopped, {len(outcomes) - len(results)} files are left for the next start"
+        )
+    if not results:
+        return
+    recovered = [r for r in results if r.out_path is not None]
+    print(
+        f"Salvage: recovered {sum(r.n_frames for r in recovered)} frames from "
+        f"{len(recovered)}/{len(results)} orphaned files in {time.perf_counter() - timer:.1f} s"
+    )
+
+
+def start_salvage(config: Config, stop: Event) -> Thread | None:
+    """
+    List the orphaned temp files now and salvage them in a background thread, until
+    stop is set. Must be called before any camera of this session starts writing to
+    temp_path.
+    """
+    orphans = find_orphans(config)
+    if not orphans:
+        return None
+    print(
+        f"Salvage: found {len(orphans)} unfinished video files from an earlier session"
+    )
+    thread = Thread(
+        target=salvage, args=(config, orphans, 4, stop), name="salvage", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ratrix temp file salvage", add_help=False
+    )
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    args = vars(parser.parse_args())
+
+    config = load_settings(args["config"])
+    if config is None:
+        print("ERROR: Cannot load settings")
+        return
+    orphans = find_orphans(config)
+    print(
+        f"Salvage: found {len(orphans)} unfinished video files from an earlier session"
+    )
+    salvage(config, orphans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+CPU and I/O scheduling policy for the processes of the rack.
+
+Capture processes, the per-slice transfer processes, the GUI and (on the compression
+machine) the ffmpeg transcodes otherwise all compete for the processor and the drives
+as equals. With scheduling set, each process places itself by its role:
+
+    capture     camera servers and the TTL logger: pinned to capture_cpus, at
+                capture_nice (a higher priority, which needs root; left at 0 otherwise)
+    supervisor  ratrix_multicam and the GUI, with their helper threads: kept off
+                capture_cpus
+    background  transfers, the transfer finisher and compress_drive with its ffmpeg
+                children: kept off capture_cpus, at background_nice and a low I/O
+                priority
+
+Whatever the system does not support is skipped: macOS has no core pinning, so there
+only the priorities apply. The low I/O priority uses setiopolicy_np on macOS and the
+ionice command on Linux.
+
+To measure the frame drop rate of simulated cameras under synthetic load, with and
+without the policy:
+    python ratrix_sched.py benchmark --cameras 4 --seconds 20
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import shutil
+import subprocess
+import sys
+import time
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+from ratrix_utils import Config
+
+CAPTURE = "capture"
+SUPERVISOR = "supervisor"
+BACKGROUND = "background"
+
+# sys/resource.h on macOS
+IOPOL_TYPE_DISK = 0
+IOPOL_SCOPE_PROCESS = 0
+IOPOL_UTILITY = 4  # throttled behind normal I/O, but not starved like IOPOL_THROTTLE
+
+
+def all_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin(cpus: list[int]) -> bool:
+    if not hasattr(os, "sched_setaffinity") or not cpus:
+        return False
+    try:
+        os.sched_setaffinity(0, cpus)
+        return True
+    except OSError:
+        return False  # eg cores that do not exist on this machine
+
+
+def set_nice(nice: int) -> bool:
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, nice)
+        return True
+    except (OSError, AttributeError):
+        return False  # raising the priority needs root
+
+
+def lower_io_priority() -> bool:
+    if sys.platform == "darwin":
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            setiopolicy_np = libc.setiopolicy_np
+        except AttributeError:
+            return False
+        return setiopolicy_np(IOPOL_TYPE_DISK, IOPOL_SCOPE_PROCESS, IOPOL_UTILITY) == 0
+    if shutil.which("ionice") is None:
+        return False
+    # best effort class at its lowest level: behind capture, but never starved by it
+    result = subprocess.run(
+        ["ionice", "-c", "2", "-n", "7", "-p", str(os.getpid())],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def apply_role(
+    role: str, capture_cpus: list[int] | None, capture_nice: int, background_nice: int
+) -> list[str]:
+    """Place the calling process (and its future children); returns what was skipped."""
+    skipped: list[str] = []
+    if capture_cpus:
+        cpus = (
+            capture_cpus
+            if role == CAPTURE
+            else [cpu for cpu in all_cpus() if cpu not in capture_cpus]
+        )
+        if not pin(cpus):
+            skipped.append("core pinning")
+    if role == CAPTURE and not set_nice(capture_nice):
+        skipped.append(f"nice {capture_nice}")
+    if role == BACKGROUND:
+        if not set_nice(background_nice):
+            skipped.append(f"nice {background_nice}")
+        if not lower_io_priority():
+            skipped.append("low I/O priority")
+    return skipped
+
+
+def apply_policy(config: Config, role: str) -> list[str]:
+    """apply_role with the settings of config; does nothing unless scheduling is set."""
+    if not config.scheduling:
+        return []
+    return apply_role(
+        role, config.capture_cpus, config.capture_nice, config.background_nice
+    )
+
+
+def describe(config: Config) -> str:
+    capture = f"capture at nice {config.capture_nice}"
+    if config.capture_cpus:
+        capture += f" on cores {', '.join(map(str, config.capture_cpus))}"
+    return (
+        f"{capture}; transfers at nice {config.background_nice} with low I/O priority"
+    )
+
+
+# ---------------------------------------------------------------------------------
+# benchmark
+
+
+def _simulated_camera(
+    fps: int, seconds: float, start: float, policy: tuple | None, results: Queue
+):
+    """
+    Handles a frame every 1/fps s (overlay and JPEG encode of a 640x480 frame, like a
+    camera server writing a still). A camera keeps only a couple of frames buffered,
+    so when the loop falls further behind, the frames in excess are lost.
+    """
+    import cv2
+
+    if policy is not None:
+        _ = apply_role(CAPTURE, *policy)
+    buffer = 2
+    frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    interval = 1 / fps
+    n_expected = int(seconds * fps)
+    time.sleep(max(0.0, start - time.time()))
+    t0 = time.monotonic()
+    handled, dropped = 0, 0
+    next_frame = 0
+    while next_frame < n_expected:
+        due = t0 + next_frame * interval
+        now = time.monotonic()
+        if now < due:
+            time.sleep(due - now)
+            now = time.monotonic()
+        available = min(n_expected, int((now - t0) / interval) + 1)
+        if available - next_frame > buffer:
+            dropped += available - next_frame - buffer  # overwritten in the camera
+            next_frame = available - buffer
+        _ = cv2.putText(frame, str(next_frame), (10, 470), 0, 1, (255, 255, 255))
+        _ = cv2.imencode(".jpg", frame)
+        handled += 1
+        next_frame += 1
+    results.put((handled, dropped))
+
+
+def _load(kind: str, seconds: float, start: float, policy: tuple | None, folder: str):
+    if policy is not None:
+        _ = apply_role(BACKGROUND, *policy)
+    time.sleep(max(0.0, start - time.time()))
+    end = time.monotonic() + seconds
+    if kind == "cpu":
+        a = np.random.default_rng(1).random((300, 300))
+        while time.monotonic() < end:
+            a = np.sin(a) @ a / 300
+        return
+    data = os.urandom(16 << 20)
+    path = os.path.join(folder, f"load_{os.getpid()}.bin")
+    while time.monotonic() < end:
+        with open(path, "wb") as file:
+            _ = file.write(data)
+            os.fsync(file.fileno())
+    os.remove(path)
+
+
+def _run(
+    cameras: int,
+    fps: int,
+    seconds: float,
+    cpu_load: int,
+    io_load: int,
+    policy: tuple | None,
+    folder: str,
+) -> tuple[int, int]:
+    results: Queue = Queue()
+    start = time.time() + 1  # once every process is up
+    processes = [
+        Process(target=_simulated_camera, args=(fps, seconds, start, policy, results))
+        for _ in range(cameras)
+    ]
+    processes += [
+        Process(target=_load, args=(kind, seconds, start, policy, folder))
+        for kind in ["cpu"] * cpu_load + ["io"] * io_load
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in range(cameras)]
+    for process in processes:
+        process.join()
+    return sum(h for h, _ in totals), sum(d for _, d in totals)
+
+
+def benchmark(
+    cameras: int,
+    fps: int,
+    seconds: float,
+    cpu_load: int,
+    io_load: int,
+    capture_cpus: list[int] | None,
+    folder: str,
+):
+    print(
+        f"{cameras} simulated cameras at {fps}fps for {seconds:g} s, {cpu_load} CPU and "
+        f"{io_load} disk load processes, {len(all_cpus())} cores"
+    )
+    policy = (capture_cpus, -5, 10)
+    skipped = apply_role(SUPERVISOR, capture_cpus, -5, 10)
+    if skipped:
+        print(f"not supported here: {', '.join(skipped)}")
+    for label, run_policy in [("without policy", None), ("with policy", policy)]:
+        handled, dropped = _run(
+            cameras, fps, seconds, cpu_load, io_load, run_policy, folder
+        )
+        print(
+            f"{label:>15}: {dropped} of {handled + dropped} frames dropped "
+            f"({100 * dropped / max(1, handled + dropped):.2f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ratrix scheduling policy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("benchmark")
+    _ = bench.add_argument("--cameras", type=int, default=4)
+    _ = bench.add_argument("--fps", type=int, default=30)
+    _ = bench.add_argument("--seconds", type=float, default=20)
+    _ = bench.add_argument("--cpu_load", type=int, default=2 * (os.cpu_count() or 1))
+    _ = bench.add_argument("--io_load", type=int, default=1)
+    _ = bench.add_argument("--capture_cpus", type=int, nargs="*", default=None)
+    _ = bench.add_argument("--folder", type=str, default=".")
+    args = parser.parse_args()
+
+    benchmark(
+        args.cameras,
+        args.fps,
+        args.seconds,
+        args.cpu_load,
+        args.io_load,
+        args.capture_cpus,
+        args.folder,
+    )
+
+
+if __name__ == "__main__":
+    main()
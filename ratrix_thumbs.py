@@ -0,0 +1,312 @@
+"""
+Thumbnail index for browsing the recordings without decoding video.
+
+When thumbnail_interval is set, a background thread of ratrix_multicam picks up every
+slice entered in the catalog and extracts one small frame (thumbnail_width pixels wide)
+every thumbnail_interval seconds of it. Between samples, frames are grabbed without
+conversion, or skipped by seeking when the samples are far apart.
+
+The thumbnails of one camera and day are appended to a single file of raw uint8 pixels,
+read back as a memory-mapped (n, height, width, 3) array, with a parallel file of
+float64 wall-clock times:
+    <first save drive>/thumbnails/<camera>/<YYYYmmdd>.thumbs
+    <first save drive>/thumbnails/<camera>/<YYYYmmdd>.times
+    <first save drive>/thumbnails/<camera>/<YYYYmmdd>.json   (frame size, slices done)
+videoproc/contact_sheet.py renders them for any camera and time range.
+
+To index slices already recorded (eg with the cameras off):
+    python ratrix_thumbs.py -c config.json --start "2025-07-22" --end "2025-07-23"
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+import cv2
+import numpy as np
+
+from ratrix_catalog import SliceRecord, query_slices
+from ratrix_timestamps import read_timestamps
+from ratrix_utils import Config, catalog_path, load_settings, save_volumes
+
+THUMBNAIL_DIR = "thumbnails"
+DAY_FORMAT = "%Y%m%d"
+SEEK_FRAMES = 90  # further apart than this, seeking is cheaper than grabbing
+
+
+def thumbnail_root(config: Config) -> str:
+    return os.path.join(save_volumes(config)[0], THUMBNAIL_DIR)
+
+
+def _day_paths(root: str, camera: str, day: str) -> tuple[str, str, str]:
+    base = os.path.join(root, camera, day)
+    return base + ".thumbs", base + ".times", base + ".json"
+
+
+def _samples(
+    record: SliceRecord,
+    interval: float,
+    fps: float,
+    n_frames: int,
+    frame_times: np.ndarray | None,
+) -> list[tuple[int, float]]:
+    """Index and wall-clock time of the frames to extract."""
+    if frame_times is not None and len(frame_times) >= n_frames > 0:
+        # exact capture times (timestamp track): also right when idle_fps left gaps
+        frame_times = frame_times[:n_frames]
+        wanted = np.arange(frame_times[0], frame_times[-1] + 1e-6, interval)
+        # nearest frame to each wanted time: the capture times are increasing
+        after = np.searchsorted(frame_times, wanted)
+        before = np.clip(after - 1, 0, n_frames - 1)
+        after = np.clip(after, 0, n_frames - 1)
+        nearer_after = np.abs(frame_times[after] - wanted) < np.abs(frame_times[before] - wanted)
+        idx = np.unique(np.where(nearer_after, after, before))
+        return [(int(i), float(frame_times[i])) for i in idx]
+    # the cameras run at only approximately the nominal fps: stretch media time onto
+    # the recorded wall time
+    scale = 1.0
+    if n_frames:
+        scale = max(record.end_time - record.start_time, 0) / (n_frames / fps) or 1.0
+    samples = []
+    for k in range(int(n_frames / fps * scale / interval) + 1):
+        target = round(k * interval / scale * fps)
+        if target >= n_frames:
+            break
+        samples.append((target, record.start_time + target / fps * scale))
+    return samples
+
+
+def extract_thumbnails(
+    record: SliceRecord, interval: float, width: int, exact_times: bool = False
+) -> tuple[list[float], list[np.ndarray]]:
+    """
+    Wall-clock times and BGR thumbnails every interval seconds of a slice. With
+    exact_times, the frames are picked by the times of its timestamp track, if it has one.
+    """
+    capture = cv2.VideoCapture(record.path)
+    if not capture.isOpened():
+        return [], []
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or record.n_frames or 0
+    frame_times = read_timestamps(record.path) if exact_times else None
+
+    times, frames = [], []
+    position = 0  # index of the next frame read
+    for target, frame_time in _samples(record, interval, fps, n_frames, frame_times):
+        if target - position > SEEK_FRAMES:
+            _ = capture.set(cv2.CAP_PROP_POS_FRAMES, target)
+            position = target
+        while position < target and capture.grab():
+            position += 1
+        ok, frame = capture.read()
+        position += 1
+        if not ok:
+            break
+        height = round(frame.shape[0] * width / frame.shape[1])
+        frames.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+        times.append(frame_time)
+    capture.release()
+    return times, frames
+
+
+def _append_day(
+    root: str,
+    camera: str,
+    day: str,
+    times: list[float],
+    frames: list[np.ndarray],
+    slice_path: str,
+):
+    thumbs_path, times_path, header_path = _day_paths(root, camera, day)
+    os.makedirs(os.path.dirname(header_path), exist_ok=True)
+    with open(header_path, "a+") as header_file:
+        # several indexers (or the backfill command) may work on the same day
+        fcntl.flock(header_file, fcntl.LOCK_EX)
+        _ = header_file.seek(0)
+        text = header_file.read()
+        header = json.loads(text) if text else {"slices": []}
+        if slice_path in header["slices"]:
+            return
+        if frames:
+            # the first slice of the day sets the frame size of the day file
+            height = header.setdefault("height", frames[0].shape[0])
+            width = header.setdefault("width", frames[0].shape[1])
+            frame_bytes = height * width * 3
+            # drop a partial write left by a crash, so frames and times stay aligned
+            n = min(_size(thumbs_path) // frame_bytes, _size(times_path) // 8)
+            with open(thumbs_path, "ab") as file:
+                _ = file.truncate(n * frame_bytes)
+                for frame in frames:
+                    if frame.shape[:2] != (height, width):
+                        frame = cv2.resize(
+                            frame, (width, height), interpolation=cv2.INTER_AREA
+                        )
+                    _ = file.write(np.ascontiguousarray(frame).tobytes())
+            with open(times_path, "ab") as file:
+                _ = file.truncate(n * 8)
+                _ = file.write(np.asarray(times, dtype=np.float64).tobytes())
+        header["slices"].append(slice_path)
+        _ = header_file.seek(0)
+        _ = header_file.truncate()
+        _ = header_file.write(json.dumps(header))
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def indexed_slices(root: str, camera: str, day: str) -> set[str]:
+    try:
+        with open(_day_paths(root, camera, day)[2], "r") as file:
+            return set(json.load(file)["slices"])
+    except (OSError, ValueError, KeyError):
+        return set()
+
+
+def index_slice(
+    root: str,
+    record: SliceRecord,
+    interval: float,
+    width: int,
+    exact_times: bool = False,
+) -> int:
+    """Add the thumbnails of a slice to the day files of its camera. Returns their number."""
+    times, frames = extract_thumbnails(record, interval, width, exact_times)
+    by_day: dict[str, list[int]] = {}
+    for i, t in enumerate(times):
+        by_day.setdefault(datetime.fromtimestamp(t).strftime(DAY_FORMAT), []).append(i)
+    if not by_day:  # unreadable or empty: still mark it as done
+        by_day[datetime.fromtimestamp(record.start_time).strftime(DAY_FORMAT)] = []
+    for day, idx in by_day.items():
+        _append_day(
+            root,
+            record.camera,
+            day,
+            [times[i] for i in idx],
+            [frames[i] for i in idx],
+            record.path,
+        )
+    return len(times)
+
+
+def load_day(root: str, camera: str, day: str) -> tuple[np.ndarray, np.ndarray]:
+    """Times and memory-mapped (n, height, width, 3) thumbnails of one camera and day."""
+    thumbs_path, times_path, header_path = _day_paths(root, camera, day)
+    try:
+        with open(header_path, "r") as file:
+            header = json.load(file)
+        height, width = header["height"], header["width"]
+    except (OSError, ValueError, KeyError):
+        return np.empty(0), np.empty((0, 0, 0, 3), np.uint8)
+    n = min(_size(thumbs_path) // (height * width * 3), _size(times_path) // 8)
+    if n == 0:
+        return np.empty(0), np.empty((0, height, width, 3), np.uint8)
+    times = np.fromfile(times_path, dtype=np.float64, count=n)
+    frames = np.memmap(
+        thumbs_path, dtype=np.uint8, mode="r", shape=(n, height, width, 3)
+    )
+    return times, frames
+
+
+def query_thumbnails(
+    root: str, camera: str, t1: float, t2: float
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """Times and thumbnails of a camera in [t1, t2], in time order."""
+    all_times, all_frames = [], []
+    day = datetime.fromtimestamp(t1).date()
+    while day <= datetime.fromtimestamp(t2).date():
+        times, frames = load_day(root, camera, day.strftime(DAY_FORMAT))
+        for i in np.flatnonzero((times >= t1) & (times <= t2)):
+            all_times.append(times[i])
+            all_frames.append(frames[i])
+        day += timedelta(days=1)
+    order = np.argsort(all_times, kind="stable")
+    return np.asarray(all_times)[order], [all_frames[i] for i in order]
+
+
+def index_range(config: Config, t1: float, t2: float, stop: Event | None = None) -> int:
+    """Index the raw slices of the catalog in [t1, t2] that are not indexed yet."""
+    root = thumbnail_root(config)
+    n_slices = 0
+    done: dict[tuple[str, str], set[str]] = {}
+    for record in query_slices(catalog_path(config), None, t1, t2, "raw"):
+        if stop is not None and stop.is_set():
+            break
+        day = datetime.fromtimestamp(record.start_time).strftime(DAY_FORMAT)
+        if (record.camera, day) not in done:
+            done[(record.camera, day)] = indexed_slices(root, record.camera, day)
+        if record.path in done[(record.camera, day)] or not os.path.isfile(record.path):
+            continue
+        try:
+            _ = index_slice(
+                root,
+                record,
+                config.thumbnail_interval,
+                config.thumbnail_width,
+                config.timestamp_track,
+            )
+            n_slices += 1
+        except Exception as e:
+            print(f"WARNING: failed to index thumbnails of {record.path}: {e}")
+    return n_slices
+
+
+class ThumbnailIndexer(Thread):
+    """Indexes newly catalogued slices once a minute, starting with the last two days."""
+
+    def __init__(self, config: Config, period: float = 60, lookback: float = 2 * 86400):
+        super().__init__(name="thumbnails", daemon=True)
+        self.config = config
+        self.period = period
+        self.since = time.time() - lookback
+        self.stop_event = Event()
+        self.paused = False  # set while the cameras need the CPU (see ratrix_qos)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.paused:
+                _ = self.stop_event.wait(self.period)
+                continue
+            now = time.time()
+            try:
+                _ = index_range(self.config, self.since, now, self.stop_event)
+            except Exception as e:
+                print(f"WARNING: thumbnail indexing failed: {e}")
+            # slices are catalogued once transferred, which can take a while
+            self.since = max(self.since, now - max(3600, 3 * self.config.time_slice))
+            _ = self.stop_event.wait(self.period)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ratrix thumbnail indexer", add_help=False
+    )
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    _ = parser.add_argument("--start", type=str, required=True)
+    _ = parser.add_argument("--end", type=str, required=True)
+    args = vars(parser.parse_args())
+
+    config = load_settings(args["config"])
+    if config is None:
+        print("ERROR: Cannot load settings")
+        return
+    if config.thumbnail_interval <= 0:
+        config.thumbnail_interval = 10
+    timer = time.perf_counter()
+    t1 = datetime.fromisoformat(args["start"]).timestamp()
+    t2 = datetime.fromisoformat(args["end"]).timestamp()
+    n_slices = index_range(config, t1, t2)
+    print(
+        f"Thumbnails: indexed {n_slices} slices in {time.perf_counter() - timer:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
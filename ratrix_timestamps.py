@@ -0,0 +1,310 @@
+"""
+Per-frame timestamps as a subtitle track of the video slices.
+
+The label, date and time that save_frame_to_writer draws into each frame are also what
+identifies the frame later. With timestamp_track set, the camera server writes them as
+one subtitle cue per frame to a sidecar file next to the slice while it is recorded
+(<slice>.srt, a few bytes per frame). The cue of frame n spans the media time of that
+frame, n/fps to (n+1)/fps, and holds its capture time to the millisecond, so a player
+shows it as an overlay on the right frame. When the slice is transferred to the save
+drive, the sidecar is muxed into the mp4 as a mov_text track (a stream copy, no
+re-encoding); where that is not possible (no ffmpeg, slices recorded directly to the
+save drive, containers without text tracks) the .srt is kept next to the video.
+
+With burn_in_timestamps off, the pixels are left untouched and the track is the only
+timing record, so turn timestamp_track on too.
+
+To list the capture time of every frame of a slice without decoding its video:
+    python ratrix_timestamps.py read /Volumes/data/.../cam3_20250722_14-00-00.mp4 -o times.csv
+To measure the cost of burn-in and the track in the camera servers' encoder path:
+    python ratrix_timestamps.py benchmark
+"""
+
+import argparse
+import csv
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+SIDECAR_EXT = ".srt"
+TEXT_CONTAINERS = (".mp4", ".mov", ".m4v")  # containers that take a mov_text track
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def sidecar_path(video_path: str) -> str:
+    return os.path.splitext(video_path)[0] + SIDECAR_EXT
+
+
+def _cue_time(ms: int) -> str:
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+class TimestampTrack:
+    """Subtitle cues of the frames of one slice, written as the frames are."""
+
+    def __init__(self, video_path: str, fps: float):
+        self.path = sidecar_path(video_path)
+        self.fps = fps
+        self.file = open(self.path, "w")
+        self.frame = 0
+
+    def add(self, label: str, frame_time: datetime):
+        start = round(self.frame * 1000 / self.fps)
+        end = round((self.frame + 1) * 1000 / self.fps)
+        self.frame += 1
+        _ = self.file.write(
+            f"{self.frame}\n{_cue_time(start)} --> {_cue_time(end)}\n"
+            f"{label}\n{frame_time.strftime(TIME_FORMAT)[:-3]}\n\n"
+        )
+
+    def close(self):
+        self.file.close()
+
+
+def mux_timestamps(video_path: str, out_path: str) -> bool:
+    """
+    Write video_path to out_path with its sidecar as a subtitle track, without
+    re-encoding. Returns False (and writes nothing) if that is not possible.
+    """
+    ext = os.path.splitext(out_path)[1].lower()
+    sidecar = sidecar_path(video_path)
+    if ext not in TEXT_CONTAINERS or not os.path.isfile(sidecar):
+        return False
+    if shutil.which("ffmpeg") is None:
+        return False
+    part_path = out_path + ".part"
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+         "-i", video_path, "-i", sidecar,
+         "-map", "0", "-map", "1", "-c", "copy", "-c:s", "mov_text",
+         "-metadata:s:s:0", "title=timestamps", "-f", ext[1:], part_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )  # fmt: skip
+    if result.returncode != 0 or not os.path.isfile(part_path):
+        print(
+            f"WARNING: could not add the timestamp track to {out_path}: {result.stderr.strip()}"
+        )
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return False
+    os.replace(part_path, out_path)
+    return True
+
+
+def move_sidecar(video_path: str, out_path: str):
+    """Keep the sidecar of a slice with the slice, after it was moved to out_path."""
+    sidecar = sidecar_path(video_path)
+    if os.path.isfile(sidecar):
+        _ = shutil.move(sidecar, sidecar_path(out_path))
+
+
+def parse_cues(text: str) -> np.ndarray:
+    """Capture times (as time.time()) of the frames, from the text of a track."""
+    times = []
+    for cue in text.replace("\r\n", "\n").strip().split("\n\n"):
+        lines = cue.strip().split("\n")
+        if len(lines) < 3:
+            continue
+        try:
+            times.append(datetime.strptime(lines[-1], TIME_FORMAT).timestamp())
+        except ValueError:
+            continue
+    return np.asarray(times, dtype=np.float64)
+
+
+def read_timestamps(video_path: str) -> np.ndarray | None:
+    """
+    Capture time of every frame of a slice, from its sidecar or its subtitle track.
+    None if it has neither.
+    """
+    sidecar = sidecar_path(video_path)
+    if os.path.isfile(sidecar):
+        with open(sidecar, "r") as file:
+            return parse_cues(file.read())
+    if shutil.which("ffmpeg") is None:
+        return None
+    # demuxes only the text track, the video is not decoded
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", video_path,
+         "-map", "0:s:0", "-f", "srt", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )  # fmt: skip
+    if result.returncode != 0:
+        return None
+    return parse_cues(result.stdout)
+
+
+class _Replay:
+    """Stands in for a camera: hands out prepared frames like cv2.VideoCapture.read."""
+
+    def __init__(self, frames: list[np.ndarray]):
+        self.frames = frames
+        self.index = 0
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray]:
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        if image is None:
+            return True, frame.copy()
+        np.copyto(image, frame)
+        return True, image
+
+
+class _NullWriter:
+    def write(self, frame: np.ndarray):
+        pass
+
+    def release(self):
+        pass
+
+
+def _run_encoder_path(
+    path: str,
+    frames: list[np.ndarray],
+    n_frames: int,
+    fps: int,
+    burn_in: bool,
+    with_track: bool,
+    encode: bool,
+) -> tuple[float, float]:
+    """Milliseconds and CPU milliseconds per frame in save_frame_to_writer."""
+    # the camera server imports this module
+    from ratrix_cam_server import CameraParams, FramePool, save_frame_to_writer
+
+    height, width = frames[0].shape[:2]
+    params = CameraParams(
+        name="bench", row=0, fps=fps, width=width, height=height, cam_exposure=-8
+    )
+    writer = (
+        cv2.VideoWriter(path, cv2.VideoWriter.fourcc(*"mp4v"), fps, (width, height))
+        if encode
+        else _NullWriter()
+    )
+    track = TimestampTrack(path, fps) if with_track else None
+    capture = _Replay(frames)
+    pool = FramePool(4, width, height)
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    timer = time.perf_counter()
+    for i in range(n_frames):
+        frame = save_frame_to_writer(
+            capture,  # type: ignore[arg-type]
+            writer,  # type: ignore[arg-type]
+            params,
+            datetime.now(),
+            f"study_bench frame {i}",
+            pool,
+            burn_in=burn_in,
+            track=track,
+        )
+        if frame is not None:
+            pool.release(frame)
+    writer.release()
+    if track is not None:
+        track.close()
+    elapsed = time.perf_counter() - timer
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (cpu_end.ru_utime - cpu_start.ru_utime) + (
+        cpu_end.ru_stime - cpu_start.ru_stime
+    )
+    return 1000 * elapsed / n_frames, 1000 * cpu / n_frames
+
+
+def benchmark(seconds: float, fps: int, width: int, height: int):
+    """
+    Per-frame cost of save_frame_to_writer with burn-in and the track on and off: once
+    without encoding, which isolates their own cost, and once writing to
+    cv2.VideoWriter like the camera servers. Then times muxing the track.
+    """
+    from ratrix_fmp4 import _synthetic_frames
+
+    frames = _synthetic_frames(min(int(seconds * fps), 300), width, height)
+    n_frames = int(seconds * fps)
+    print(f"{n_frames} frames of {width}x{height} @ {fps}fps")
+    print(
+        f"{'writer':>15} {'burn-in':>8} {'track':>6} {'ms/frame':>9} {'CPU ms/frame':>13}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.mp4")
+        _ = _run_encoder_path(path, frames, fps, fps, True, True, False)  # warm up
+        for encode in [False, True]:
+            for burn_in, with_track in [
+                (True, False),
+                (True, True),
+                (False, True),
+                (False, False),
+            ]:
+                ms, cpu_ms = _run_encoder_path(
+                    path, frames, n_frames, fps, burn_in, with_track, encode
+                )
+                print(
+                    f"{'cv2.VideoWriter' if encode else 'none':>15} {'on' if burn_in else 'off':>8} "
+                    f"{'on' if with_track else 'off':>6} {ms:9.3f} {cpu_ms:13.3f}"
+                )
+        if shutil.which("ffmpeg") is not None:
+            _ = _run_encoder_path(path, frames, n_frames, fps, False, True, True)
+            muxed = os.path.join(tmp, "muxed.mp4")
+            timer = time.perf_counter()
+            ok = mux_timestamps(path, muxed)
+            elapsed = time.perf_counter() - timer
+            times = read_timestamps(muxed) if ok else None
+            print(
+                f"muxing the track into the {os.path.getsize(path) / 1e6:.1f} MB file took {elapsed:.2f} s, "
+                f"read back {0 if times is None else len(times)} frame times"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ratrix frame timestamps", add_help=False
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    read = commands.add_parser("read")
+    _ = read.add_argument("video", type=str)
+    _ = read.add_argument("-o", "--output", type=str, default=None)
+    bench = commands.add_parser("benchmark")
+    _ = bench.add_argument("--seconds", type=float, default=20)
+    _ = bench.add_argument("--fps", type=int, default=30)
+    _ = bench.add_argument("--width", type=int, default=640)
+    _ = bench.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        benchmark(args.seconds, args.fps, args.width, args.height)
+        return
+
+    times = read_timestamps(args.video)
+    if times is None:
+        print(f"{args.video} has no timestamp track")
+        return
+    output = args.output or os.path.splitext(args.video)[0] + "_times.csv"
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["frame", "time", "interval_ms"])
+        intervals = np.diff(times, prepend=times[:1]) * 1000
+        for i, (t, interval) in enumerate(zip(times.tolist(), intervals.tolist())):
+            writer.writerow(
+                [
+                    i,
+                    datetime.fromtimestamp(t).isoformat(timespec="milliseconds"),
+                    round(interval, 1),
+                ]
+            )
+    print(f"{len(times)} frame times written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Transfer of closed video slices from the temp folder to the output drive.
+
+Every transfer is first written as a job file to temp_path/transfers/ and then carried
+out by a short-lived process started by the camera server. The job file is removed once
+the slice is in place and catalogued, so the queue always lists exactly the transfers
+that have not finished. A worker holds an exclusive lock on the job file while it copies,
+so a job is never carried out twice at the same time.
+
+When recording stops, the camera servers do not wait for their transfers: the transfer
+processes are killed, and a single detached finisher process (which keeps running after
+the rack software exits) works through the queue. The finisher is also started when the
+next session starts, to resume transfers interrupted by a power loss or a forced quit.
+Its messages go to temp_path/transfers/finisher.log.
+
+To finish the queued transfers by hand:
+    python ratrix_transfer.py -c config.json
+"""
+
+import argparse
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+from pydantic import BaseModel
+
+from ratrix_catalog import SliceRecord, record_slice
+from ratrix_sched import BACKGROUND, apply_policy, apply_role
+from ratrix_timestamps import mux_timestamps, sidecar_path
+from ratrix_utils import Config, load_settings
+
+TRANSFER_QUEUE_DIR = "transfers"
+FINISHER_LOG = "finisher.log"
+FINISHER_LOCK = "finisher.lock"
+
+
+def transfer_queue_dir(config: Config) -> str:
+    return os.path.join(config.temp_path, TRANSFER_QUEUE_DIR)
+
+
+# function to move video file from temporary to permanent location
+# NOTE TRY MODIFYING THIS FUNCTION TO TEST TRANSCODING INSTEAD OF COPYING?
+def move_file(
+    temp_file: str,
+    out_file: str,
+    record: SliceRecord | None = None,
+    db_path: str | None = None,
+    delay: float = 3,
+):
+    """
+    Utility function for moving video file from temporary to permanent location copy
+    the file from the temporary location to the permanent one
+    Args:
+        temp_file:
+        out_file:
+        record: catalog entry for the slice, added to the catalog at db_path once
+            the file has been transferred
+        db_path:
+        delay: pause before the first attempt, for files that were just closed
+    """
+    xfer_mode = "copy"  # hardwire until compression fully supported
+    timeout: float = (
+        3  # hand tuned to be sufficient to prevent race condition failures (fragile)
+    )
+
+    if not os.path.exists(temp_file):
+        print(f"WARNING: the temp file '{temp_file}' was not found!")
+        return
+
+    time.sleep(delay)  # pause before first attempt reduces failures
+    # the timestamp track is added while copying, or kept as a sidecar if that fails
+    sidecar = sidecar_path(temp_file)
+    has_track = os.path.isfile(sidecar)
+    while True:
+        try:
+            if xfer_mode == "copy":
+                if not (has_track and mux_timestamps(temp_file, out_file)):
+                    _ = shutil.copy2(temp_file, out_file)
+                    if has_track:
+                        _ = shutil.copy2(sidecar, sidecar_path(out_file))
+            else:
+                # The following works with timeout=3 but only for 640x480 on most cameras;can handle 2 780p cams
+                conversion_failed: int = os.system(
+                    command=f"ffmpeg -i {temp_file} -c:v hevc_videotoolbox -q:v 65 -tag:v hvc1 -loglevel error {out_file}"
+                )
+                if conversion_failed:  # returns 0 for success, other outcomes
+                    print(
+                        f"fmpeg conversion of {temp_file} failed with exit code {conversion_failed}"
+                    )
+
+            # verify existence of the copied or transcoded output file
+            if os.path.exists(out_file) and os.path.isfile(out_file):
+                break
+        except Exception as e:
+            print(
+                f"WARNING: Failed to copy {temp_file} to {out_file}, retrying in {timeout} seconds",
+                e,
+            )
+        time.sleep(timeout)
+
+    if record is not None and db_path is not None:
+        stat = os.stat(out_file)
+        _ = record_slice(
+            db_path, record._replace(n_bytes=stat.st_size, mtime=stat.st_mtime)
+        )
+
+    os.remove(temp_file)
+    if has_track:
+        os.remove(sidecar)
+    if os.path.exists(temp_file):
+        print("WARNING: failed to clean up ", temp_file)
+
+
+class TransferJob(BaseModel):
+    temp_file: str
+    out_file: str
+    record: SliceRecord | None
+    db_path: str | None
+    queued_at: float
+
+
+def queue_transfer(
+    queue_dir: str,
+    temp_file: str,
+    out_file: str,
+    record: SliceRecord | None,
+    db_path: str | None,
+) -> str:
+    """Persist a transfer job and return the path of its job file."""
+    job = TransferJob(
+        temp_file=temp_file,
+        out_file=out_file,
+        record=record,
+        db_path=db_path,
+        queued_at=time.time(),
+    )
+    os.makedirs(queue_dir, exist_ok=True)
+    job_path = os.path.join(queue_dir, f"{uuid.uuid4().hex}.json")
+    with open(job_path + ".tmp", "w") as file:
+        _ = file.write(job.model_dump_json())
+    os.replace(job_path + ".tmp", job_path)  # never leave a half-written job
+    return job_path
+
+
+def pending_jobs(queue_dir: str) -> list[str]:
+    try:
+        names = os.listdir(queue_dir)
+    except OSError:
+        return []
+    return sorted(os.path.join(queue_dir, n) for n in names if n.endswith(".json"))
+
+
+def pending_temp_files(queue_dir: str) -> set[str]:
+    temp_files: set[str] = set()
+    for job_path in pending_jobs(queue_dir):
+        try:
+            with open(job_path, "r") as file:
+                temp_files.add(TransferJob.model_validate_json(file.read()).temp_file)
+        except (OSError, ValueError):
+            pass
+    return temp_files
+
+
+def run_job(job_path: str, delay: float = 3) -> bool:
+    """
+    Carry out a queued transfer, unless another worker holds it. Returns True if the
+    job is done (or was already done by another worker).
+    """
+    try:
+        file = open(job_path, "r")
+    except FileNotFoundError:
+        return True
+    with file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        if not os.path.exists(job_path):
+            return True  # finished by the worker that held the lock before
+        try:
+            job = TransferJob.model_validate_json(file.read())
+        except ValueError as e:
+            print(f"WARNING: discarding unreadable transfer job {job_path}: {e}")
+            os.remove(job_path)
+            return True
+        if os.path.exists(job.temp_file):
+            move_file(job.temp_file, job.out_file, job.record, job.db_path, delay)
+        os.remove(job_path)  # still holding the lock
+    return True
+
+
+def run_background_job(job_path: str, config: Config):
+    # target of the transfer processes of the camera servers
+    _ = apply_policy(config, BACKGROUND)
+    _ = run_job(job_path)
+
+
+def finish_queue(queue_dir: str):
+    """
+    Work through the jobs queued before this finisher started, until none are left.
+    Jobs queued later belong to a recording session, whose own transfer processes
+    carry them out. Finishers started while another one runs wait for it to exit.
+    """
+    started = time.time()
+    os.makedirs(queue_dir, exist_ok=True)
+    with open(os.path.join(queue_dir, FINISHER_LOCK), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        timer = time.perf_counter()
+        n_done = 0
+        while True:
+            jobs = []
+            for job_path in pending_jobs(queue_dir):
+                try:
+                    if os.path.getmtime(job_path) <= started:
+                        jobs.append(job_path)
+                except OSError:
+                    pass  # done in the meantime
+            if not jobs:
+                break
+            progress = False
+            for job_path in jobs:
+                if run_job(job_path, delay=0):
+                    n_done += 1
+                    progress = True
+            if not progress:
+                time.sleep(1)  # the remaining jobs are held by other workers
+        print(
+            f"Transfer finisher: completed {n_done} transfers in {time.perf_counter() - timer:.1f} s"
+        )
+
+
+def start_finisher(config: Config) -> bool:
+    """Launch a detached finisher if transfers are queued. Returns True if launched."""
+    queue_dir = transfer_queue_dir(config)
+    n_jobs = len(pending_jobs(queue_dir))
+    if n_jobs == 0:
+        return False
+    log_path = os.path.join(queue_dir, FINISHER_LOG)
+    command = [sys.executable, "-u", os.path.abspath(__file__), "--queue", queue_dir]
+    if config.scheduling:
+        command += ["--nice", str(config.background_nice)]
+    with open(log_path, "a") as log:
+        _ = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # not stopped with the rack software or its terminal
+        )
+    print(
+        f"Transfer finisher: {n_jobs} transfers pending, completing them in the background (log: {log_path})"
+    )
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ratrix transfer finisher", add_help=False
+    )
+    group = parser.add_mutually_exclusive_group(required=True)
+    _ = group.add_argument("-c", "--config", type=str)
+    _ = group.add_argument("--queue", type=str)
+    _ = parser.add_argument("--nice", type=int, default=None)
+    args = vars(parser.parse_args())
+
+    queue_dir = args["queue"]
+    if args["config"] is not None:
+        config = load_settings(args["config"])
+        if config is None:
+            print("ERROR: Cannot load settings")
+            return
+        queue_dir = transfer_queue_dir(config)
+        _ = apply_policy(config, BACKGROUND)
+    if args["nice"] is not None:
+        _ = apply_role(BACKGROUND, None, 0, args["nice"])
+    print(f"Transfer finisher: started at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    finish_queue(queue_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+TTL event logging, aligned to the video frames.
+
+With recording_ttl set, ratrix_multicam runs a logger process that reads the digital
+lines from a serial device (ttl_device, eg an Arduino forwarding its input pins): the
+device sends one byte holding the state of up to 8 lines whenever one of them changes.
+Every change of a line is timestamped with time.monotonic_ns(), the clock the camera
+servers use to stamp each frame they capture, and appended to a binary log. Bytes
+arriving together are dated back by their transmission time at ttl_baud, so events at
+kHz rates keep sub-millisecond spacing. The logger is a separate process that only waits
+on the device, so capture is not affected.
+
+Logs are written to <first save drive>/ttl/:
+    events_<YYYYmmdd_HH-MM-SS>.bin            one record per line change
+    frames_<camera>_<YYYYmmdd_HH-MM-SS>.bin   one record per captured frame
+Both start with a header holding the wall clock and monotonic clock at creation, so
+logs from the same boot of the Mac can be aligned and converted to wall-clock time.
+
+To list, for each event, the nearest frame of every camera:
+    python ratrix_ttl.py align /Volumes/data/ttl/events_20250722_09-00-00.bin -o events.csv
+To log without recording video:
+    python ratrix_ttl.py listen -c config.json
+"""
+
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import select
+import signal
+import struct
+import sys
+import termios
+import time
+import tty
+from datetime import datetime
+from multiprocessing.synchronize import Event
+from typing import NamedTuple
+
+import numpy as np
+
+from ratrix_catalog import SLICE_TIME_FORMAT
+from ratrix_sched import CAPTURE, apply_policy
+from ratrix_utils import Config, load_settings, save_volumes
+
+TTL_DIR = "ttl"
+EVENTS_MAGIC = b"RTTLEV01"
+FRAMES_MAGIC = b"RTTLFR01"
+HEADER = struct.Struct("<8sqq")  # magic, time.time_ns(), time.monotonic_ns()
+EVENT_DTYPE = np.dtype([("t_ns", "<i8"), ("line", "u1"), ("level", "u1")])
+FRAME_DTYPE = np.dtype([("t_ns", "<i8"), ("slice_start_ns", "<i8"), ("frame", "<u4")])
+FRAME_RECORD = struct.Struct("<qqI")  # same layout as FRAME_DTYPE
+FLUSH_INTERVAL = 0.25  # seconds between writes of buffered events and frames
+SAME_BOOT_TOLERANCE_NS = 2_000_000_000  # wall minus monotonic clock of logs to align
+
+
+def ttl_dir(config: Config) -> str:
+    return os.path.join(save_volumes(config)[0], TTL_DIR)
+
+
+def _session_time() -> str:
+    return datetime.now().strftime("%Y%m%d_%H-%M-%S")
+
+
+def _open_log(path: str, magic: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file = open(path, "ab")
+    if file.tell() == 0:
+        _ = file.write(HEADER.pack(magic, time.time_ns(), time.monotonic_ns()))
+    return file
+
+
+class Log(NamedTuple):
+    anchor_ns: int  # wall clock minus monotonic clock, both ns
+    records: np.ndarray
+
+
+def read_log(path: str, magic: bytes, dtype: np.dtype) -> Log | None:
+    """Records of a log; a record cut short by a crash is left out."""
+    try:
+        with open(path, "rb") as file:
+            head = file.read(HEADER.size)
+            if len(head) < HEADER.size:
+                return None
+            file_magic, wall_ns, mono_ns = HEADER.unpack(head)
+            if file_magic != magic:
+                return None
+            data = file.read()
+    except OSError:
+        return None
+    n = len(data) // dtype.itemsize
+    return Log(wall_ns - mono_ns, np.frombuffer(data[: n * dtype.itemsize], dtype))
+
+
+class FrameClock:
+    """Per-frame monotonic timestamps of one camera server, written as frames arrive."""
+
+    def __init__(self, config: Config, camera: str):
+        self.path = os.path.join(
+            ttl_dir(config), f"frames_{camera}_{_session_time()}.bin"
+        )
+        self.file = _open_log(self.path, FRAMES_MAGIC)
+        self.slice_start_ns = 0
+        self.frame = 0
+        self.last_flush_ns = time.monotonic_ns()
+
+    def begin_slice(self, start_time: float):
+        """start_time: time.time() of the first frame, as used for the slice file name."""
+        self.file.flush()
+        self.slice_start_ns = int(start_time * 1e9)
+        self.frame = 0
+
+    def stamp(self):
+        # 20 bytes into a buffered file, well under a microsecond
+        now_ns = time.monotonic_ns()
+        _ = self.file.write(FRAME_RECORD.pack(now_ns, self.slice_start_ns, self.frame))
+        self.frame += 1
+        # written out as often as the events, so both logs are current while recording
+        if now_ns - self.last_flush_ns >= FLUSH_INTERVAL * 1e9:
+            self.file.flush()
+            self.last_flush_ns = now_ns
+
+    def close(self):
+        self.file.close()
+
+
+def decode_states(
+    data: bytes, previous: int, read_ns: int, byte_ns: int
+) -> tuple[np.ndarray, int]:
+    """
+    Events for the line changes in a run of state bytes that was read at read_ns. The
+    last byte arrived at read_ns, each one before it byte_ns earlier. Returns the events
+    and the state after the last byte.
+    """
+    states = np.frombuffer(data, np.uint8)
+    before = np.concatenate(([previous], states[:-1])).astype(np.uint8)
+    changed = np.unpackbits((states ^ before)[:, None], axis=1, bitorder="little")
+    index, line = np.nonzero(changed)
+    events = np.empty(len(index), EVENT_DTYPE)
+    events["t_ns"] = read_ns - (len(states) - 1 - index) * byte_ns
+    events["line"] = line
+    events["level"] = (states[index] >> line) & 1
+    return events, int(states[-1])
+
+
+def open_device(path: str, baud: int) -> int:
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    attributes = termios.tcgetattr(fd)
+    speed = getattr(termios, f"B{baud}", None)
+    if speed is not None:  # a pseudo-terminal has no speed, other devices may not
+        attributes[4] = attributes[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return fd
+
+
+def run(config: Config, stop_event: Event) -> int:
+    """Log TTL events until stop_event is set or the device fails; returns an exit code."""
+    if config.ttl_device is None:
+        print("ERROR: no ttl_device is configured")
+        return 1
+    try:
+        fd = open_device(config.ttl_device, config.ttl_baud)
+    except OSError as e:
+        print(f"ERROR: cannot open TTL device {config.ttl_device}: {e}")
+        return 1
+    path = os.path.join(ttl_dir(config), f"events_{_session_time()}.bin")
+    log = _open_log(path, EVENTS_MAGIC)
+    print(f"TTL logger: reading {config.ttl_device}, logging to {path}")
+
+    byte_ns = 10 * 1_000_000_000 // config.ttl_baud  # start, 8 data and stop bits
+    state = 0
+    pending: list[bytes] = []
+    n_events = 0
+    last_flush = time.monotonic()
+    exit_code = 0
+    try:
+        while not stop_event.is_set():
+            ready, _, _ = select.select([fd], [], [], FLUSH_INTERVAL)
+            if ready:
+                try:
+                    data = os.read(fd, 4096)
+                except BlockingIOError:
+                    continue
+                read_ns = time.monotonic_ns()
+                if not data:
+                    print(f"ERROR: TTL device {config.ttl_device} was disconnected")
+                    exit_code = 1
+                    break
+                events, state = decode_states(data, state, read_ns, byte_ns)
+                pending.append(events.tobytes())
+                n_events += len(events)
+            if pending and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                _ = log.write(b"".join(pending))
+                log.flush()
+                pending.clear()
+                last_flush = time.monotonic()
+    except OSError as e:
+        print(f"ERROR: reading TTL device {config.ttl_device} failed: {e}")
+        exit_code = 1
+    finally:
+        _ = log.write(b"".join(pending))
+        log.close()
+        os.close(fd)
+    print(f"TTL logger: stopped after {n_events} events")
+    return exit_code
+
+
+def run_without_handlers(config: Config, stop_event: Event):
+    # stopped through stop_event by the supervisor, like the camera servers
+    _ = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _ = signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _ = apply_policy(config, CAPTURE)  # event times are only as good as its wakeups
+    sys.exit(run(config, stop_event))
+
+
+def _frame_logs(folder: str, anchor_ns: int) -> dict[str, np.ndarray]:
+    """Frame records per camera from all frame logs of the same boot, in time order."""
+    by_camera: dict[str, list[np.ndarray]] = {}
+    for path in sorted(glob.glob(os.path.join(folder, "frames_*.bin"))):
+        log = read_log(path, FRAMES_MAGIC, FRAME_DTYPE)
+        if log is None or abs(log.anchor_ns - anchor_ns) > SAME_BOOT_TOLERANCE_NS:
+            continue  # monotonic clock restarted: recorded before a reboot
+        camera = os.path.basename(path)[len("frames_") :].rsplit("_", 2)[0]
+        by_camera.setdefault(camera, []).append(log.records)
+    return {
+        camera: np.sort(np.concatenate(parts), order="t_ns")
+        for camera, parts in by_camera.items()
+    }
+
+
+def align(
+    events_path: str, max_offset_ms: float = 1000
+) -> tuple[list[str], list[list]]:
+    """
+    Table of the events of a log with, for each camera, the slice and frame index of the
+    frame captured nearest in time and the event time minus the frame time.
+    """
+    log = read_log(events_path, EVENTS_MAGIC, EVENT_DTYPE)
+    if log is None:
+        raise ValueError(f"{events_path} is not a TTL event log")
+    events = log.records
+    cameras = _frame_logs(os.path.dirname(events_path), log.anchor_ns)
+
+    columns = ["event", "time", "line", "level"]
+    table = [
+        [
+            i,
+            datetime.fromtimestamp((t + log.anchor_ns) / 1e9).isoformat(
+                timespec="microseconds"
+            ),
+            int(line),
+            int(level),
+        ]
+        for i, (t, line, level) in enumerate(events.tolist())
+    ]
+    for camera, frames in sorted(cameras.items()):
+        if len(frames) == 0:
+            continue
+        columns += [f"{camera}_slice", f"{camera}_frame", f"{camera}_offset_ms"]
+        # nearest of the frames just before and just after each event
+        after = np.clip(
+            np.searchsorted(frames["t_ns"], events["t_ns"]), 1, len(frames) - 1
+        )
+        before = after - 1
+        if len(frames) == 1:
+            after = before = np.zeros(len(events), int)
+        nearest = np.where(
+            np.abs(frames["t_ns"][after] - events["t_ns"])
+            < np.abs(events["t_ns"] - frames["t_ns"][before]),
+            after,
+            before,
+        )
+        offset_ms = (events["t_ns"] - frames["t_ns"][nearest]) / 1e6
+        for row, idx, offset in zip(table, nearest, offset_ms):
+            if abs(offset) > max_offset_ms:
+                row += ["", "", ""]  # camera was not recording
+                continue
+            start = datetime.fromtimestamp(frames["slice_start_ns"][idx] / 1e9)
+            row += [
+                f"{camera}_{start.strftime(SLICE_TIME_FORMAT)}",
+                int(frames["frame"][idx]),
+                round(float(offset), 3),
+            ]
+    return columns, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ratrix TTL logger", add_help=False)
+    commands = parser.add_subparsers(dest="command", required=True)
+    listen = commands.add_parser("listen")
+    _ = listen.add_argument("-c", "--config", type=str, required=True)
+    align_parser = commands.add_parser("align")
+    _ = align_parser.add_argument("events", type=str)
+    _ = align_parser.add_argument("-o", "--output", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.command == "align":
+        columns, table = align(args.events)
+        output = args.output or os.path.splitext(args.events)[0] + ".csv"
+        with open(output, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows(table)
+        print(
+            f"{len(table)} events aligned to {(len(columns) - 4) // 3} cameras, written to {output}"
+        )
+        return
+
+    config = load_settings(args.config)
+    if config is None:
+        print("ERROR: Cannot load settings")
+        return
+    stop_event = multiprocessing.Event()
+    _ = signal.signal(signal.SIGINT, lambda sig, frame: stop_event.set())
+    sys.exit(run(config, stop_event))
+
+
+if __name__ == "__main__":
+    main()
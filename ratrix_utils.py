@@ -1,7 +1,15 @@
 import os
 import shutil
+from functools import lru_cache
+from typing import Literal
 
-from pydantic import BaseModel, ConfigDict, ValidationError
+import cv2
+
+from pydantic import BaseModel, ConfigDict, ValidationError, model_validator
+
+from ratrix_catalog import default_catalog_path
+
+StartMethod = Literal["spawn", "fork", "forkserver"]  # of multiprocessing
 
 
 class CameraConfig(BaseModel):
@@ -14,6 +22,7 @@ class CameraConfig(BaseModel):
     width: int | None = None
     height: int | None = None
     exposure: float | None = None  # LUT code for camera exposure setting, eg -8
+    low_priority: bool = False  # first to lose frame rate under load (see ratrix_qos)
 
 
 class Config(BaseModel):
@@ -30,12 +39,62 @@ class Config(BaseModel):
     preview_interval: int
     codec: str  # cv2 video codec, eg MJPG
     video_ext: str  # extension for video files eg .mp4
-    save_path: str  # final destination folder for video files
+    save_path: str | list[str]  # final destination folder(s) for video files, one per drive
     temp_path: str  # temporary folder for video files while streaming
     blank_image: str  # full path to image to display when cameras offline
     stills_path: str  # folder containing most recent grabbed frames
     recording_audio: bool  # not currently supported
-    recording_ttl: bool  # not currently supported
+    recording_ttl: bool  # log TTL events from ttl_device (see ratrix_ttl)
+    catalog_path: str | None = None  # slice catalog, default <save_path>/ratrix_catalog.sqlite
+    preview_http_port: int | None = None  # serve previews over HTTP on this port
+    preview_http_host: str = "127.0.0.1"  # use 0.0.0.0 to allow other machines
+    fragmented_mp4: bool = False  # crash-safe fragmented mp4 output (needs ffmpeg)
+    fragment_seconds: float = 2.0  # interval between fragments (and keyframes)
+    direct_to_save_path: bool = False  # record straight into save_path, no temp copy
+    direct_write_max_ms: float = 100  # slower average frame writes fall back to temp_path
+    volume_min_free_gb: float = 50  # with several save drives, move cameras off fuller ones
+    thumbnail_interval: float = 0  # seconds between browsing thumbnails, 0 disables
+    thumbnail_width: int = 160  # pixels
+    ttl_device: str | None = None  # serial device sending TTL line states, eg /dev/cu.usbmodem1101
+    ttl_baud: int = 115200
+    # "forkserver" starts camera processes from a server that has cv2 and the camera
+    # code imported already; None uses the platform default (spawn on macOS)
+    process_start_method: StartMethod | None = None
+    burn_in_timestamps: bool = True  # draw label, date and time into every frame
+    timestamp_track: bool = False  # also store them as a subtitle track (ratrix_timestamps)
+    qos: bool = False  # shed optional work when cameras drop frames (see ratrix_qos)
+    qos_max_frame_loss: float = 0.05  # fraction of frames a camera may miss
+    qos_max_load: float = 1.0  # 1-minute load average per core
+    scheduling: bool = False  # apply the process priorities of ratrix_sched
+    capture_cpus: list[int] | None = None  # cores for the cameras only (not on macOS)
+    capture_nice: int = -5  # priority of the cameras, below 0 needs root
+    background_nice: int = 10  # priority of transfers and compression
+    idle_fps: float = 0  # frames per second written while nothing moves, 0 writes all
+    idle_after: float = 60  # seconds without change before dropping to idle_fps
+    idle_threshold: float = 8  # brightness change of a 16x16 block that counts as movement
+
+    @model_validator(mode="after")
+    def _idle_needs_track(self) -> "Config":
+        # with frames left out the position in the file is no longer a time
+        if self.idle_fps > 0 and not self.timestamp_track:
+            raise ValueError("idle_fps needs timestamp_track, the only exact record of the frame times")
+        return self
+
+    @model_validator(mode="after")
+    def _ttl_needs_device(self) -> "Config":
+        # caught here rather than by the TTL logger, which would fail on every relaunch
+        if self.recording_ttl and self.ttl_device is None:
+            raise ValueError("recording_ttl needs ttl_device, the serial device to read the TTL lines from")
+        return self
+
+
+def grid_positions(cameras: list[CameraConfig]) -> tuple[int, int, list[tuple[int, int]]]:
+    # map the configured row/col of each camera onto a compact grid, dropping empty
+    # rows and columns the same way tkinter's grid layout does
+    rows = sorted({camera.row for camera in cameras})
+    cols = sorted({camera.col for camera in cameras})
+    positions = [(rows.index(camera.row), cols.index(camera.col)) for camera in cameras]
+    return len(rows), len(cols), positions
 
 
 def ensure_dir_exists(path: str) -> bool:
@@ -70,8 +129,34 @@ def ensure_config_file_exists(config_file: str):
             return
 
 
+def save_volumes(config: Config) -> list[str]:
+    # the first drive holds the catalog and the placement manifest
+    if isinstance(config.save_path, str):
+        return [config.save_path]
+    return config.save_path
+
+
+def catalog_path(config: Config) -> str:
+    return config.catalog_path or default_catalog_path(save_volumes(config)[0])
+
+
+# marks a slice that is still being recorded directly in its final folder
+RECORDING_SUFFIX = ".recording"
+
+
+def recording_name(file_name: str) -> str:
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}{RECORDING_SUFFIX}{ext}"  # keep the extension, it sets the container
+
+
+def finished_name(file_name: str) -> str:
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem.removesuffix(RECORDING_SUFFIX)}{ext}"
+
+
 def still_path(stills_path: str, camera_name: str) -> str:
-    return os.path.join(stills_path, f"cam_{camera_name}_status.png")
+    # JPEG so the stills can be served as previews without re-encoding
+    return os.path.join(stills_path, f"cam_{camera_name}_status.jpg")
 
 
 def reset_stills(config: Config):
@@ -83,9 +168,29 @@ def reset_stills(config: Config):
             except Exception as e:
                 print(f"Error deleting file {file_path}: {e}")
 
-    # copy stills blank image to stills folder
+    # blank image in place of the stills until the cameras write theirs
     for camera in config.cameras:
-        _ = shutil.copy(config.blank_image, still_path(config.stills_path, camera.name))
+        show_blank_still(config, camera.name)
+
+
+@lru_cache(maxsize=None)
+def _blank_jpeg(blank_image: str) -> bytes | None:
+    # converted once: blank_image may be any format, the stills are always JPEG
+    image = cv2.imread(blank_image)
+    if image is None:
+        return None
+    ok, data = cv2.imencode(".jpg", image)
+    return data.tobytes() if ok else None
+
+
+def show_blank_still(config: Config, camera_name: str):
+    """Replace the still of a camera with blank_image, eg when it goes offline."""
+    data = _blank_jpeg(config.blank_image)
+    if data is None:
+        print(f"WARNING: cannot read blank_image {config.blank_image}")
+        return
+    with open(still_path(config.stills_path, camera_name), "wb") as file:
+        _ = file.write(data)
 
 
 # -----------------------------------------------------------
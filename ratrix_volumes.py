@@ -0,0 +1,146 @@
+"""
+Placement of cameras on several save drives.
+
+When save_path lists more than one folder (typically one per external SSD), the
+supervisor measures the sequential write throughput of each drive at startup and assigns
+each camera a drive, spreading cameras in proportion to throughput and free space so no
+drive has to take more than its share of the video. During the run each camera checks
+the free space on its drive at every slice boundary and moves to the drive with the most
+free space once its own falls below volume_min_free_gb.
+
+Every slice placed on a drive is listed in the manifest on the first drive (see
+ratrix_catalog.record_placement), so tools given only the first drive can find all of
+them.
+
+To measure the drives without recording:
+    python ratrix_volumes.py -c config.json
+"""
+
+import argparse
+import os
+import shutil
+import time
+from typing import NamedTuple
+
+from ratrix_utils import Config, load_settings, save_volumes
+
+GB = 2**30
+
+
+class VolumeInfo(NamedTuple):
+    path: str
+    free_bytes: int
+    throughput: float  # MB/s of sequential writes, 0 if the drive could not be written
+
+
+def measure_write_throughput(path: str, n_bytes: int = 64 * 2**20) -> float:
+    """Write and fsync a scratch file on the drive; returns MB/s, 0 on failure."""
+    scratch = os.path.join(path, ".ratrix_write_test")
+    block = os.urandom(4 * 2**20)  # incompressible, like video
+    try:
+        start = time.perf_counter()
+        fd = os.open(scratch, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            for _ in range(n_bytes // len(block)):
+                _ = os.write(fd, block)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        elapsed = time.perf_counter() - start
+        os.remove(scratch)
+    except OSError as e:
+        print(f"WARNING: cannot write to save drive {path}: {e}")
+        return 0.0
+    return n_bytes / 2**20 / elapsed
+
+
+def free_bytes(path: str) -> int:
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+
+def measure_volumes(config: Config) -> list[VolumeInfo]:
+    # one drive at a time, so drives sharing a hub do not slow each other's measurement
+    return [
+        VolumeInfo(path, free_bytes(path), measure_write_throughput(path))
+        for path in save_volumes(config)
+    ]
+
+
+def plan_volumes(
+    volumes: list[VolumeInfo], n_cameras: int, min_free: float
+) -> list[str]:
+    """
+    Assign a drive to each camera: each camera in turn goes to the usable drive that
+    would then carry the fewest cameras per unit of capacity, where capacity is the
+    write throughput weighted by the share of free space.
+    """
+    usable = [v for v in volumes if v.throughput > 0 and v.free_bytes > min_free]
+    if not usable:
+        # all drives are nearly full: use the one with the most room left
+        usable = [max(volumes, key=lambda v: v.free_bytes)]
+    most_free = max(v.free_bytes for v in usable) or 1
+    capacity = [max(v.throughput, 1e-3) * v.free_bytes / most_free for v in usable]
+    load = [0 for _ in usable]
+    plan: list[str] = []
+    for _ in range(n_cameras):
+        best = min(
+            range(len(usable)), key=lambda i: (load[i] + 1) / max(capacity[i], 1e-9)
+        )
+        load[best] += 1
+        plan.append(usable[best].path)
+    return plan
+
+
+def camera_volumes(config: Config) -> list[str]:
+    """Measure the save drives and return the drive for each camera in the config."""
+    volumes = save_volumes(config)
+    if len(volumes) == 1:
+        return [volumes[0] for _ in config.cameras]
+    infos = measure_volumes(config)
+    plan = plan_volumes(infos, len(config.cameras), config.volume_min_free_gb * GB)
+    for info in infos:
+        cameras = [c.name for c, path in zip(config.cameras, plan) if path == info.path]
+        print(
+            f"Save drive {info.path}: {info.throughput:.0f} MB/s, "
+            f"{info.free_bytes / GB:.0f} GB free, cameras {', '.join(cameras) or 'none'}"
+        )
+    return plan
+
+
+def choose_volume(config: Config, current: str) -> str:
+    """The drive to record the next slice to: current, unless it is nearly full."""
+    volumes = save_volumes(config)
+    min_free = config.volume_min_free_gb * GB
+    if len(volumes) == 1 or free_bytes(current) > min_free:
+        return current
+    roomiest = max(volumes, key=free_bytes)
+    if roomiest == current or free_bytes(roomiest) <= free_bytes(current):
+        return current
+    return roomiest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ratrix save drive planner", add_help=False
+    )
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    args = vars(parser.parse_args())
+
+    config = load_settings(args["config"])
+    if config is None:
+        print("ERROR: Cannot load settings")
+        return
+    if len(save_volumes(config)) == 1:
+        info = measure_volumes(config)[0]
+        print(
+            f"Save drive {info.path}: {info.throughput:.0f} MB/s, {info.free_bytes / GB:.0f} GB free"
+        )
+        return
+    _ = camera_volumes(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,78 @@
 import argparse
 import datetime as dt
-import multiprocessing
 import os
 import shutil
 import signal
 import sys
+import threading
 import time
-import tkinter as tk
-import tkinter.font as font
 from multiprocessing import Process
 from multiprocessing.synchronize import Event
-from tkinter import messagebox, ttk
 from types import FrameType
+from typing import TYPE_CHECKING
 
-import PIL
-import PIL.ImageTk
-from PIL import Image, ImageTk
+import numpy as np
 
 import ratrix_multicam
+from ratrix_sched import SUPERVISOR, apply_policy
 from ratrix_utils import (
     Config,
     ensure_config_file_exists,
     ensure_dir_exists,
+    grid_positions,
     load_settings,
     reset_stills,
+    save_volumes,
     still_path,
 )
 
+if TYPE_CHECKING:
+    # imported where they are used: the recording process started from the GUI
+    # imports this script again, but only runs ratrix_multicam
+    import tkinter as tk
+    from tkinter import ttk
+
+    from PIL import Image
+
 
 class State:
     def __init__(self):
         self.camera_process: Process | None = None
-        self.current_window: tk.Tk | None = None
+        self.current_window: "tk.Tk | None" = None
 
 
-def run_without_handlers(config: Config, stop_event: Event):
+def run_without_handlers(config: Config, stop_event: Event, config_path: str):
     _ = signal.signal(signal.SIGINT, signal.SIG_IGN)
     _ = signal.signal(signal.SIGTERM, signal.SIG_IGN)
-    ratrix_multicam.run(config, stop_event)
+    ratrix_multicam.run(config, stop_event, config_path)
+
+
+def disk_usage(paths: list[str]) -> tuple[int, int]:
+    # total and used space summed over the save drives, counting each drive once
+    devices: dict[int, tuple[int, int]] = {}
+    for path in paths:
+        usage = shutil.disk_usage(path)
+        devices[os.stat(path).st_dev] = (usage.total, usage.used)
+    return sum(t for t, _ in devices.values()), sum(u for _, u in devices.values())
 
 
 def hdd_status_update_loop(
-    window: tk.Tk, hdd_used: tk.Label, hdd_status: ttk.Progressbar, out_path: str
+    window: "tk.Tk", hdd_used: "tk.Label", hdd_status: "ttk.Progressbar", out_paths: list[str]
 ):
-    total, used, _free = shutil.disk_usage(out_path)
+    total, used = disk_usage(out_paths)
     hdd_space_used = 100 * used / total  # local scope
     hdd_status.step(hdd_space_used)
     _ = hdd_used.config(text=f"SSD Space Used: {round(hdd_space_used)}%")
     _ = window.after(
-        5000, hdd_status_update_loop, window, hdd_used, hdd_status, out_path
+        5000, hdd_status_update_loop, window, hdd_used, hdd_status, out_paths
     )
 
 
 def time_recorded_update_loop(
-    window: tk.Tk,
-    time_label: tk.Label,
-    date_label: tk.Label,
-    recorded_label: tk.Label,
+    window: "tk.Tk",
+    time_label: "tk.Label",
+    date_label: "tk.Label",
+    recorded_label: "tk.Label",
     start_recording_date: dt.datetime,
 ):
     date_now = dt.datetime.now()
@@ -89,64 +105,153 @@ def update_config_file(
         _ = file.truncate()
 
 
-def get_camera_still_from_file(
-    stills_folder: str, camera_name: str, cam_x: int, cam_y: int
-) -> Image.Image | None:
-    still = still_path(stills_folder, camera_name)
-    if not os.path.exists(still):
-        return
+class PreviewLoader(threading.Thread):
+    """
+    Loads the camera stills off the Tk main thread. Each refresh it checks the
+    mtime of every still, decodes only the ones that changed (JPEG stills are
+    decoded directly at reduced size), writes them into one mosaic array laid out
+    like the camera grid, and publishes a single image for the GUI to display.
+    A still caught mid-write is simply retried on the next refresh.
+    """
+
+    def __init__(self, config: Config, tile_size: tuple[int, int], refresh: float):
+        from PIL import Image
+
+        super().__init__(daemon=True)
+        self.config = config
+        self.tile_size = tile_size
+        self.refresh = refresh
+        self.stop_event = threading.Event()
+
+        n_rows, n_cols, self.positions = grid_positions(config.cameras)
+        cam_x, cam_y = tile_size
+        self.mosaic = np.zeros((n_rows * cam_y, n_cols * cam_x, 3), dtype=np.uint8)
+        blank = Image.open(config.blank_image).convert("RGB")
+        self.blank_tile = np.asarray(blank.resize(tile_size, resample=2))
+        for row, col in self.positions:
+            self._tile(row, col)[:] = self.blank_tile
+        self.mtimes: list[float | None] = [None for _ in config.cameras]
+
+        self.lock = threading.Lock()
+        self.image = Image.fromarray(self.mosaic)
+        self.version = 0  # incremented whenever a new image is published
+
+        # statistics, reported by the GUI
+        self.decodes = 0
+        self.cpu_time = 0.0  # thread CPU time spent loading and compositing
+
+    def _tile(self, row: int, col: int) -> np.ndarray:
+        cam_x, cam_y = self.tile_size
+        return self.mosaic[row * cam_y : (row + 1) * cam_y, col * cam_x : (col + 1) * cam_x]
+
+    def _load(self, path: str) -> np.ndarray | None:
+        from PIL import Image
 
-    # file is frequently updated, so could be truncated if mid-write
-    for _ in range(10):  # try for one sec
         try:
-            img = Image.open(still, mode="r")
-            img = img.resize((cam_x, cam_y), resample=2)
-            return img
-        except Exception as _:
-            # If the error message indicates a truncated file, wait and retry.
-            # print(f"Attempt {attempt+1} to load {stillname} failed: {e}")
-            time.sleep(0.1)
-
-
-global_images = []
+            img = Image.open(path, mode="r")
+            if img.format == "JPEG":
+                img.draft("RGB", self.tile_size)  # decode at 1/2, 1/4 or 1/8 scale
+            img = img.convert("RGB").resize(self.tile_size, resample=2)
+            return np.asarray(img)
+        except Exception:
+            return None  # truncated while being written, retry next refresh
+
+    def update(self) -> bool:
+        from PIL import Image
+
+        changed = False
+        for idx, (camera, (row, col)) in enumerate(
+            zip(self.config.cameras, self.positions)
+        ):
+            path = still_path(self.config.stills_path, camera.name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self.mtimes[idx]:
+                continue
+            tile = self.blank_tile if mtime is None else self._load(path)
+            if tile is None:
+                continue
+            self._tile(row, col)[:] = tile
+            self.mtimes[idx] = mtime
+            self.decodes += 1
+            changed = True
+        if changed:
+            image = Image.fromarray(self.mosaic.copy())
+            with self.lock:
+                self.image = image
+                self.version += 1
+        return changed
+
+    def latest(self) -> tuple[int, "Image.Image"]:
+        with self.lock:
+            return self.version, self.image
+
+    def run(self):
+        while not self.stop_event.is_set():
+            cpu_start = time.thread_time()
+            _ = self.update()
+            self.cpu_time += time.thread_time() - cpu_start
+            _ = self.stop_event.wait(self.refresh)
+
+
+class PreviewStats:
+    def __init__(self):
+        self.refreshes = 0
+        self.redraws = 0
+        self.main_thread_time = 0.0  # seconds spent on the Tk main thread
+        self.started = time.perf_counter()
 
 
 def camera_image_update_loop(
-    window: tk.Tk,
+    window: "tk.Tk",
     cam_refresh: int,
-    default_img: PIL.ImageTk.PhotoImage,
-    cam_image: tk.Label,
-    stills_path: str,
-    cam_name: str,
-    cam_x: int,
-    cam_y: int,
+    cam_image: "tk.Label",
+    loader: PreviewLoader,
+    stats: PreviewStats,
+    shown_version: int,
 ):
-    new_image = get_camera_still_from_file(stills_path, cam_name, cam_x, cam_y)
-    if new_image is None:
-        photo_img = default_img
-    else:
-        photo_img = ImageTk.PhotoImage(new_image)
-
-    _ = cam_image.config(image=photo_img)
-    cam_image.image = photo_img
+    from PIL import ImageTk
+
+    start = time.perf_counter()
+    version, image = loader.latest()
+    if version != shown_version:
+        photo_img = ImageTk.PhotoImage(image)
+        _ = cam_image.config(image=photo_img)
+        cam_image.image = photo_img
+        stats.redraws += 1
+    stats.main_thread_time += time.perf_counter() - start
+    stats.refreshes += 1
+
+    # report preview overhead every 10 minutes
+    if stats.refreshes % (600000 // cam_refresh) == 0:
+        elapsed = time.perf_counter() - stats.started
+        print(
+            f"Ratrix IO preview: {stats.redraws}/{stats.refreshes} refreshes redrawn, "
+            f"{loader.decodes} stills decoded, "
+            f"main thread {1000 * stats.main_thread_time / stats.refreshes:.2f} ms/refresh, "
+            f"loader CPU {100 * loader.cpu_time / elapsed:.2f}%"
+        )
 
     _ = window.after(
         cam_refresh,
         camera_image_update_loop,
         window,
         cam_refresh,
-        default_img,
         cam_image,
-        stills_path,
-        cam_name,
-        cam_x,
-        cam_y,
+        loader,
+        stats,
+        version,
     )
 
 
 def create_config_editor(
     state: State, bgcolor: str, config: Config, config_path: str, stop_event: Event
-) -> tk.Tk:
+) -> "tk.Tk":
+    import tkinter as tk
+    import tkinter.font as font
+
     window = tk.Tk()
     _ = window.configure(background=bgcolor)
     window.geometry("1024x600")
@@ -231,7 +336,7 @@ def create_config_editor(
 
     def start_recording():
         state.camera_process = Process(
-            target=run_without_handlers, args=(config, stop_event)
+            target=run_without_handlers, args=(config, stop_event, config_path)
         )
         state.camera_process.start()
         window.destroy()
@@ -251,7 +356,13 @@ def create_config_editor(
     return window
 
 
-def create_recording_window(state: State, bgcolor: str, config: Config) -> tk.Tk:
+def create_recording_window(state: State, bgcolor: str, config: Config) -> "tk.Tk":
+    import tkinter as tk
+    import tkinter.font as font
+    from tkinter import messagebox, ttk
+
+    from PIL import ImageTk
+
     window = tk.Tk()
     _ = window.configure(background=bgcolor)
     window.geometry("1424x1200")
@@ -289,7 +400,7 @@ def create_recording_window(state: State, bgcolor: str, config: Config) -> tk.Tk
     time_label.place(x=right_row + 165, y=10)
 
     # HDD status progressbar
-    total, used, _free = shutil.disk_usage(config.save_path)
+    total, used = disk_usage(save_volumes(config))
     hdd_used_label = tk.Label(
         window,
         text=f"SSD Drive Space Used: {round(100 * used / total, 1)}%",
@@ -323,7 +434,7 @@ def create_recording_window(state: State, bgcolor: str, config: Config) -> tk.Tk
         window,
         hdd_used_label,
         hdd_status_progress_bar,
-        config.save_path,
+        save_volumes(config),
     )
 
     # Showing recording duration
@@ -388,25 +499,20 @@ def create_recording_window(state: State, bgcolor: str, config: Config) -> tk.Tk
     ).place(x=right_row, y=330)
 
     # Set up camera display
-    # initialize to blank images
-    no_signal = Image.open(config.blank_image)
-    no_signal_r = no_signal.resize((cam_x, cam_y), resample=2)
-    resized_no_signal = ImageTk.PhotoImage(no_signal_r)
-
-    for camera in config.cameras:
-        image_label = tk.Label(window, image=resized_no_signal)
-        image_label.image = resized_no_signal
-        image_label.grid(row=camera.row, column=camera.col)
-        camera_image_update_loop(
-            window,
-            cam_refresh,
-            resized_no_signal,
-            image_label,
-            config.stills_path,
-            camera.name,
-            cam_x,
-            cam_y,
-        )
+    # stills are loaded and tiled into one image by a background thread,
+    # the main thread only swaps in the composed image when it changes
+    loader = PreviewLoader(config, (cam_x, cam_y), cam_refresh / 1000)
+    loader.start()
+    _ = window.bind("<Destroy>", lambda _event: loader.stop_event.set(), add="+")
+
+    _, initial_image = loader.latest()
+    initial_photo = ImageTk.PhotoImage(initial_image)
+    image_label = tk.Label(window, image=initial_photo, borderwidth=0, bg=bgcolor)
+    image_label.image = initial_photo
+    image_label.grid(row=1, column=1)
+    camera_image_update_loop(
+        window, cam_refresh, image_label, loader, PreviewStats(), 0
+    )
 
     def stop_recording():
         if state.camera_process is None or not state.camera_process.is_alive():
@@ -455,10 +561,12 @@ def graceful_shutdown(state: State, stop_event: Event):
         return
 
     print("Ratrix IO attempting graceful shutdown...")
+    shutdown_start = time.perf_counter()
     stop_event.set()
 
-    timeout = 600 #transcoding takes ~50% video duration, so wait 10min before killing unfinished processes
-                  #would be better to set this based on the slice duration but this is not available info
+    # unfinished file transfers are handed to a detached finisher, so the cameras stop
+    # within seconds; allow for the multicam timeout before killing
+    timeout = 90
     print("Waiting for child processes to terminate...")
     for _ in range(int(timeout / 0.1)):
         if not state.camera_process.is_alive():
@@ -467,7 +575,9 @@ def graceful_shutdown(state: State, stop_event: Event):
     else:
         print("RatrixCam: Timed out waiting for child processes to terminate, killing")
         state.camera_process.kill()
-    print("Ratrix Cam GUI: Shutdown complete")
+    print(
+        f"Ratrix Cam GUI: Shutdown complete in {time.perf_counter() - shutdown_start:.1f} s"
+    )
 
     sys.exit(0)
 
@@ -475,7 +585,22 @@ def graceful_shutdown(state: State, stop_event: Event):
 # END FUNCTION DEFS
 # ------------------------------------------------------------------------
 def main():
-    stop_event = multiprocessing.Event()
+    parser = argparse.ArgumentParser(description="Ratrix Camera Setup", add_help=False)
+    _ = parser.add_argument("-c", "--config", type=str, required=True)
+    args = vars(parser.parse_args())
+    config_path: str = args["config"]
+
+    state = State()
+    ensure_config_file_exists(config_path)
+
+    config = load_settings(config_path)
+    if config is None:
+        return
+
+    _ = apply_policy(config, SUPERVISOR)  # keeps the GUI off the capture cores
+
+    # shared with the camera processes, so from the context they are started from
+    stop_event = ratrix_multicam.process_context(config).Event()
 
     def int_handler(_sig: int, _frame: FrameType | None):
         print(
@@ -490,18 +615,6 @@ def main():
         lambda sig, frame: graceful_shutdown(state, stop_event),
     )
 
-    parser = argparse.ArgumentParser(description="Ratrix Camera Setup", add_help=False)
-    _ = parser.add_argument("-c", "--config", type=str, required=True)
-    args = vars(parser.parse_args())
-    config_path: str = args["config"]
-
-    state = State()
-    ensure_config_file_exists(config_path)
-
-    config = load_settings(config_path)
-    if config is None:
-        return
-
     # GUI
     bgcolor = "#3b0a0a"
     if os.environ.get("DISPLAY", "") == "":
@@ -524,11 +637,12 @@ def main():
         print("Session Ended, cameras not started")
         return
 
-    if not ensure_dir_exists(config.save_path):
-        print("ERROR: Recording folder does not exist and could not be created")
-        return
-    else:
-        print(f"Recording folder: {config.save_path}")
+    for volume in save_volumes(config):
+        if not ensure_dir_exists(volume):
+            print("ERROR: Recording folder does not exist and could not be created")
+            return
+        else:
+            print(f"Recording folder: {volume}")
 
     if not ensure_dir_exists(config.stills_path):
         print("ERROR: Stills folder does not exist and could not be created")
@@ -543,11 +657,12 @@ def main():
     else:
         print(f"Temp streaming folder: {config.temp_path}")
 
-    if not ensure_dir_exists(config.save_path):
-        print("ERROR: Recording folder does not exist and could not be created")
-        return
-    else:
-        print(f"Recording folder: {config.save_path}")
+    for volume in save_volumes(config):
+        if not ensure_dir_exists(volume):
+            print("ERROR: Recording folder does not exist and could not be created")
+            return
+        else:
+            print(f"Recording folder: {volume}")
 
     # get rid of any old still images
     print("Removing any old still images")
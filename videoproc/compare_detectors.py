@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Compare the motion detectors of detect_motion on the same files.
+
+Every detector is run on every file, and the time taken and the motion decision (percentile of the
+per-frame motion >= threshold, as in compress_drive) are recorded. The report lists, per detector,
+the seconds of video processed per second, and how often its decision agrees with MOG2's: at the
+given threshold, and at the threshold that would agree best on these files (the detectors measure
+motion on different scales, so the best threshold is the one to pass to compress_drive).
+
+Usage:
+    python compare_detectors.py /Volumes/data --n_files 20
+"""
+
+import argparse
+import random
+import time
+from pathlib import Path
+
+import cv2 as cv
+import detect_motion
+import numpy as np
+
+
+def video_seconds(path: Path) -> float:
+    cap = cv.VideoCapture(str(path))
+    n_frames, fps = cap.get(cv.CAP_PROP_FRAME_COUNT), cap.get(cv.CAP_PROP_FPS)
+    cap.release()
+    return n_frames / fps if fps > 0 else 0.0
+
+
+def best_threshold(scores: np.ndarray, reference: np.ndarray) -> tuple[float, float]:
+    """Threshold on the scores that best reproduces the reference decisions, and the agreement reached."""
+    values = np.unique(scores)
+    candidates = np.concatenate([[0.0], (values[:-1] + values[1:]) / 2, [np.inf]])  # midway between the scores
+    agreement = [np.mean((scores >= t) == reference) for t in candidates]
+    best = int(np.argmax(agreement))
+    return float(candidates[best]), float(agreement[best])
+
+
+def main(input: Path, pattern: str, n_files: int, motion_percentile: float, motion_threshold: float):
+    """run every detector on every file -> speed and agreement with mog2."""
+    paths = sorted(input.glob(pattern))
+    if not paths:
+        print(f"no video files found in {input.resolve()} matching pattern '{pattern}'")
+        return
+    paths = random.Random(0).sample(paths, min(n_files, len(paths)))
+    seconds = sum(video_seconds(p) for p in paths)
+
+    scores = {name: [] for name in detect_motion.DETECTORS}
+    elapsed = {name: 0.0 for name in detect_motion.DETECTORS}
+    for path in paths:
+        print(f"{path.name}:", end="")
+        for name in detect_motion.DETECTORS:
+            start = time.perf_counter()
+            motion_by_frame = detect_motion.main(path, play_video=False, detector=name)
+            elapsed[name] += time.perf_counter() - start
+            score = np.percentile(motion_by_frame, motion_percentile) if motion_by_frame.size else 0.0
+            scores[name].append(score)
+            print(f" {name} {score:.5f}", end="")
+        print()
+
+    reference = np.asarray(scores["mog2"]) >= motion_threshold
+    print(f"\n{len(paths)} files, {seconds:.0f} s of video, {reference.sum()} with motion according to mog2")
+    print(f"{'detector':>16} {'x realtime':>10} {'speedup':>7} {'agree':>6} {'best threshold':>14} {'agree':>6}")
+    for name in detect_motion.DETECTORS:
+        values = np.asarray(scores[name])
+        agree = np.mean((values >= motion_threshold) == reference)
+        threshold, best_agree = best_threshold(values, reference)
+        print(
+            f"{name:>16} {seconds / elapsed[name]:>10.1f} {elapsed['mog2'] / elapsed[name]:>7.1f} "
+            f"{agree:>6.0%} {threshold:>14.5f} {best_agree:>6.0%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compare motion detectors", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("input", type=Path, help="folder with raw slices, eg a recording drive")
+    parser.add_argument("--pattern", default="**/*.mp4", type=str, help="pattern to match")
+    parser.add_argument("--n_files", default=20, type=int, help="number of files to sample")
+    parser.add_argument("--motion_percentile", default=99.9, type=float, help="as compress_drive --motion_percentile")
+    parser.add_argument("--motion_threshold", default=0.001, type=float, help="as compress_drive --motion_threshold")
+    kwargs = vars(parser.parse_args())
+
+    if not kwargs["input"].is_dir():
+        raise NotADirectoryError(f"{kwargs['input']} is not a valid directory")
+
+    main(**kwargs)
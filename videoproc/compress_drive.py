@@ -5,14 +5,25 @@ import csv
 import json
 import shutil
 import subprocess
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from pprint import pprint
 
 import cv2
-import detect_motion
+import detect_motion as motion
 import numpy as np
+import scan_drive
+import tune_encoder
+
+# shared modules from the recording stack live one folder up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ratrix_catalog import CATALOG_FILE_NAME, SliceRecord, parse_slice_file_name, record_slice  # noqa: E402
+from ratrix_sched import BACKGROUND, apply_role  # noqa: E402
 
 
 class Logger:
@@ -34,14 +45,17 @@ class Logger:
         "error",
     ]
 
-    def __init__(self, log_path: Path):
+    lock = threading.Lock()  # rows of files compressed concurrently go to the same CSV
+
+    def __init__(self, log_path: Path, write_header: bool = True):
         """Initialize logger"""
         self.log_path = log_path
         self.log_path.parent.mkdir(parents=True, exist_ok=True)
         self.reset()
 
-        with open(self.log_path, mode="w", newline="") as log_file:  # write mode
-            csv.writer(log_file).writerow(self.LOG_FIELDS)
+        if write_header:
+            with open(self.log_path, mode="w", newline="") as log_file:  # write mode
+                csv.writer(log_file).writerow(self.LOG_FIELDS)
 
     def reset(self) -> None:
         """Reset all log fields to None"""
@@ -55,7 +69,7 @@ class Logger:
         values = [getattr(self, field) for field in self.LOG_FIELDS]
         row = ["" if v is None else str(v) for v in values]
 
-        with open(self.log_path, mode="a", newline="") as log_file:  # append mode
+        with self.lock, open(self.log_path, mode="a", newline="") as log_file:  # append mode
             csv.writer(log_file).writerow(row)
 
 
@@ -88,6 +102,7 @@ def default_resident(station_ID: str) -> str:
     return rat_ID
 
 
+@lru_cache(maxsize=None)  # parsed for the whole volume first, then again per file
 def parse_filenames(video_fname: Path) -> tuple[str, str, str, str]:
     parse_fname: list[str] = video_fname.stem.split(sep="_")
 
@@ -142,6 +157,52 @@ def get_codec_nframes(path: Path):
     return codec, n_frames
 
 
+def get_fps(path: Path) -> float | None:
+    """Get the nominal frame rate of a video, or None if it cannot be opened."""
+    cap = cv2.VideoCapture(str(path))
+    fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else None
+    cap.release()
+    return fps or None
+
+
+def catalog_output(
+    catalog: Path,
+    output_path: Path,
+    rat_ID: str,
+    motion_perc,
+    found_motion,
+    fract_frames_exceeding,
+) -> None:
+    """Add a transferred output file to the slice catalog, if its name carries a start time."""
+    # keyed like the raw slices of the same camera, eg rat558_buddy
+    parsed = parse_slice_file_name(output_path.name)
+    if parsed is None:
+        return
+    camera, start_datetime = parsed
+    start = start_datetime.timestamp()
+    codec, n_frames = get_codec_nframes(output_path)
+    fps = get_fps(output_path)
+    stat = output_path.stat()
+    record_slice(
+        str(catalog),
+        SliceRecord(
+            path=str(output_path),
+            camera=camera,
+            study_label=rat_ID,
+            start_time=start,
+            end_time=start + (n_frames / fps if n_frames and fps else 0),
+            n_frames=n_frames,
+            n_bytes=stat.st_size,
+            codec=codec,
+            location="compressed",
+            motion_perc=None if motion_perc is None else float(motion_perc),
+            found_motion=None if found_motion is None else bool(found_motion),
+            fract_frames_exceeding=None if fract_frames_exceeding is None else float(fract_frames_exceeding),
+            mtime=stat.st_mtime,
+        ),
+    )
+
+
 def copy_file(in_file: Path, out_file: Path, max_retries: int = 5) -> None:
     """
     Copy a file, retrying up to max_retries times if it fails.
@@ -163,11 +224,17 @@ def copy_file(in_file: Path, out_file: Path, max_retries: int = 5) -> None:
     raise RuntimeError(f"Failed to copy {in_file} to {out_file} after {max_retries} attempts")
 
 
-def detect_motion(input_path: Path, motion_percentile: float, motion_threshold: float):
+def detect_motion(
+    input_path: Path,
+    motion_percentile: float,
+    motion_threshold: float,
+    detector: str = "mog2",
+    trace_cache: Path | None = None,
+):
     """Perform motion detection and return results"""
     try:
         start = time.time()
-        motion_by_frame = detect_motion.main(input_path, play_video=False)
+        motion_by_frame = motion.cached_main(input_path, detector, trace_cache)
         motion_perc = np.percentile(motion_by_frame, motion_percentile)
         found_motion = motion_perc >= motion_threshold
         detection_time = time.time() - start
@@ -228,20 +295,171 @@ def compress_video(
         return False, e.stderr.decode("utf-8"), compression_time
 
 
+def process_file(
+    raw_input_path: Path,
+    output: Path,
+    log_path: Path,
+    catalog: Path,
+    motion_percentile: float,
+    motion_threshold: float,
+    n_threads: int,
+    taskcam_crf: int,
+    compress_spd: str,
+    recompress: bool,
+    detector: str = "mog2",
+    trace_cache: Path | None = None,
+):
+    """Compress or copy one input file and log the outcome."""
+    logger = Logger(log_path, write_header=False)
+    input_path = Path(raw_input_path)
+    logger.start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logger.input_path = input_path
+    print(f"processing {input_path.name} at {logger.start_time}.")
+
+    try:
+
+        # (1) parse input path
+        rat_ID, view, recording_date, recording_time = parse_filenames(input_path)
+
+        # (2) create output path
+        # output_path = output / input_path.name[:6] / f"LS_{rat}_{view}_{date}" / input_path.name
+        new_filename: str = f"{rat_ID}_{view}_{recording_date}_{recording_time}.mp4"
+        output_path = output / rat_ID / f"LS_{rat_ID}_{view}_{recording_date}" / new_filename
+        logger.output_path = output_path
+
+        # (3) get input + output conditions
+        input_codec, input_n_frames = get_codec_nframes(path=input_path)
+        input_is_valid = input_codec is not None
+        input_is_cam_codec = input_codec == "FMP4"
+        input_recompress = recompress
+
+        output_exists = output_path.is_file()
+        output_codec, output_n_frames = get_codec_nframes(output_path) if output_exists else (None, None)
+        output_is_valid = output_codec is not None and output_n_frames == input_n_frames
+
+        # (4) decision tree: skip/copy vs compress
+
+        # 4A what if output file exists?
+        if output_exists:
+            if output_is_valid:  # if output is valid, refuse to overwrite it
+                raise SkipFile("valid output exists, not overwriting")
+            else:  # even if it's invalid, if input also invalid, don't overwrite it
+                if not input_is_valid:
+                    raise SkipFile("invalid output exists, input also invalid, not overwriting")
+                # otherwise, if input is valid, treat the invalid output as if it does not exist
+
+        # if we reach here we are no longer concerned about existing outputs (if they exist, overwrite)
+
+        # 4B what if input file is invalid? just copy it over
+        if not input_is_valid:
+            copy_file(input_path, output_path)
+            raise SkipFile("invalid input copied to output")
+
+        # if we reach here the input is valid
+
+        # 4C what if the input file was already previously compressed?
+        if not input_is_cam_codec:
+            if not input_recompress:  # if we aren't in recompress mode, just copy it
+                copy_file(input_path, output_path)
+                catalog_output(catalog, output_path, rat_ID, None, None, None)
+                raise SkipFile("compressed input copied to output")
+            # otherwise, treat exactly as if it were not previously compressed
+
+        # If we reach here, the video file should be compressed and transferred
+
+        # (5) make output directory
+        print(f"    will attempt to save as {output_path.name}.")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # (6) motion detection (whether the input was previously compressed or not)
+        motion_perc, found_motion, detection_time, fract_frames_exceeding = detect_motion(
+            input_path, motion_percentile, motion_threshold, detector, trace_cache
+        )
+        logger.motion_detection_time = detection_time
+        logger.motion_perc = motion_perc
+        logger.found_motion = found_motion
+        logger.fract_frames_exceeding = fract_frames_exceeding
+
+        # (7) video compression using parameters determined by motion detection and view
+        success, err_msg, compression_time = compress_video(
+            input_path, output_path, found_motion, view, n_threads, taskcam_crf, compress_spd
+        )
+        logger.compression_time = compression_time
+        logger.compression_success = success
+
+        if err_msg:
+            logger.error = err_msg
+
+        # (8) check output exists, has non-zero size, and frame count matches
+        output_codec, output_n_frames = get_codec_nframes(output_path)
+        if (not output_path.exists()) or (output_path.stat().st_size == 0) or (input_n_frames != output_n_frames):
+            raise SkipFile("compressed output invalid")
+
+        logger.compression_ratio = input_path.stat().st_size / output_path.stat().st_size
+        logger.valid_output = input_n_frames == output_n_frames
+
+        if input_n_frames != output_n_frames:
+            raise SkipFile("compressed output invalid")
+
+        # (9) record the output and its motion summary in the slice catalog
+        catalog_output(
+            catalog,
+            output_path,
+            rat_ID,
+            motion_perc,
+            found_motion,
+            fract_frames_exceeding,
+        )
+
+    # log skips and exceptions
+    except SkipFile as s:
+        logger.skipped_reason = str(s)
+        print(f"    SKIPPED {input_path.resolve()}: {s}")
+    except Exception as e:
+        logger.error = str(e)
+        print(f"    ERROR {input_path.resolve()}: {e}")
+
+    # append a log row for this file (success, skip, or error)
+    finally:
+        try:
+            logger.append()
+        except Exception as e:
+            print(f"CRITICAL: Failed to write log row for {input_path.resolve()}: {e}")
+
+
 def main(
     input: Path,
     output: Path,
     pattern: str,
     motion_percentile: float,
     motion_threshold: float,
-    n_threads: int,
+    n_threads: int | None,
     taskcam_crf: int,
-    compress_spd: str,
+    compress_spd: str | None,
     recompress: bool,
+    catalog: Path | None = None,
+    n_jobs: int | None = None,
+    detector: str = "mog2",
+    trace_cache: Path | None = None,
+    nice: int = 10,
+    capture_cpus: list[int] | None = None,
 ):
     """motion detection -> compression."""
 
-    kwargs = locals()
+    # settings not given are taken from this host's tune_encoder profile
+    profile = tune_encoder.load_profile() or {}
+    n_threads = n_threads or profile.get("n_threads", 4)
+    compress_spd = compress_spd or profile.get("compress_spd", "veryfast")
+    n_jobs = n_jobs or profile.get("n_jobs", 1)
+    if profile:
+        print(f"using encoder profile {tune_encoder.profile_path()} from {profile.get('created')}")
+
+    kwargs = {k: v for k, v in locals().items() if k != "profile"}
+
+    # below recording and interactive work; the ffmpeg processes inherit this
+    skipped = apply_role(BACKGROUND, capture_cpus, 0, nice)
+    if skipped:
+        print(f"not supported on this machine: {', '.join(skipped)}")
 
     # make sure ffmpeg exists as a shell command
     ffmpeg_cmd = shutil.which("ffmpeg")
@@ -251,7 +469,7 @@ def main(
     else:
         print(f"ffmpeg found at {ffmpeg_cmd}")
 
-    input_paths: list[Path] = sorted(input.glob(pattern))
+    input_paths: list[Path] = scan_drive.scan(input, pattern)
     if not input_paths:  # check if input_paths is empty
         print(f"no video files found in {input.resolve()} matching pattern '{pattern}'. Exiting.")
         return
@@ -278,113 +496,37 @@ def main(
         / f"{datetime.now():%Y%m%d_%H-%M-%S}.csv"
     )
 
-    logger = Logger(log_path)
-
-    for raw_input_path in input_paths:
-        input_path = Path(raw_input_path)
-        logger.reset()
-        logger.start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        logger.input_path = input_path
-        print(f"processing {input_path.name} at {logger.start_time}.")
-
-        try:
-
-            # (1) parse input path
-            rat_ID, view, recording_date, recording_time = parse_filenames(input_path)
-
-            # (2) create output path
-            # output_path = output / input_path.name[:6] / f"LS_{rat}_{view}_{date}" / input_path.name
-            new_filename: str = f"{rat_ID}_{view}_{recording_date}_{recording_time}.mp4"
-            output_path = output / rat_ID / f"LS_{rat_ID}_{view}_{recording_date}" / new_filename
-            logger.output_path = output_path
-
-            # (3) get input + output conditions
-            input_codec, input_n_frames = get_codec_nframes(path=input_path)
-            input_is_valid = input_codec is not None
-            input_is_cam_codec = input_codec == "FMP4"
-            input_recompress = recompress
-
-            output_exists = output_path.is_file()
-            output_codec, output_n_frames = get_codec_nframes(output_path) if output_exists else (None, None)
-            output_is_valid = output_codec is not None and output_n_frames == input_n_frames
-
-            # (4) decision tree: skip/copy vs compress
-
-            # 4A what if output file exists?
-            if output_exists:
-                if output_is_valid:  # if output is valid, refuse to overwrite it
-                    raise SkipFile("valid output exists, not overwriting")
-                else:  # even if it's invalid, if input also invalid, don't overwrite it
-                    if not input_is_valid:
-                        raise SkipFile("invalid output exists, input also invalid, not overwriting")
-                    # otherwise, if input is valid, treat the invalid output as if it does not exist
-
-            # if we reach here we are no longer concerned about existing outputs (if they exist, overwrite)
-
-            # 4B what if input file is invalid? just copy it over
-            if not input_is_valid:
-                copy_file(input_path, output_path)
-                raise SkipFile("invalid input copied to output")
-
-            # if we reach here the input is valid
-
-            # 4C what if the input file was already previously compressed?
-            if not input_is_cam_codec:
-                if not input_recompress:  # if we aren't in recompress mode, just copy it
-                    copy_file(input_path, output_path)
-                    raise SkipFile("compressed input copied to output")
-                # otherwise, treat exactly as if it were not previously compressed
-
-            # If we reach here, the video file should be compressed and transferred
-
-            # (5) make output directory
-            print(f"    will attempt to save as {output_path.name}.")
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-
-            # (6) motion detection (whether the input was previously compressed or not)
-            motion_perc, found_motion, detection_time, fract_frames_exceeding = detect_motion(
-                input_path, motion_percentile, motion_threshold
-            )
-            logger.motion_detection_time = detection_time
-            logger.motion_perc = motion_perc
-            logger.found_motion = found_motion
-            logger.fract_frames_exceeding = fract_frames_exceeding
-
-            # (7) video compression using parameters determined by motion detection and view
-            success, err_msg, compression_time = compress_video(
-                input_path, output_path, found_motion, view, n_threads, taskcam_crf, compress_spd
+    Logger(log_path)  # writes the header
+
+    if catalog is None:
+        catalog = output / CATALOG_FILE_NAME
+    if trace_cache is None:
+        trace_cache = output / "auxiliary-data" / "motion-traces"
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = {}
+        for input_path in input_paths:
+            future = pool.submit(
+                process_file,
+                input_path,
+                output,
+                log_path,
+                catalog,
+                motion_percentile,
+                motion_threshold,
+                n_threads,
+                taskcam_crf,
+                compress_spd,
+                recompress,
+                detector,
+                trace_cache,
             )
-            logger.compression_time = compression_time
-            logger.compression_success = success
-
-            if err_msg:
-                logger.error = err_msg
-
-            # (8) check output exists, has non-zero size, and frame count matches
-            output_codec, output_n_frames = get_codec_nframes(output_path)
-            if (not output_path.exists()) or (output_path.stat().st_size == 0) or (input_n_frames != output_n_frames):
-                raise SkipFile("compressed output invalid")
-
-            logger.compression_ratio = input_path.stat().st_size / output_path.stat().st_size
-            logger.valid_output = input_n_frames == output_n_frames
+            futures[future] = input_path
 
-            if input_n_frames != output_n_frames:
-                raise SkipFile("compressed output invalid")
-
-        # log skips and exceptions
-        except SkipFile as s:
-            logger.skipped_reason = str(s)
-            print(f"    SKIPPED {input_path.resolve()}: {s}")
-        except Exception as e:
-            logger.error = str(e)
-            print(f"    ERROR {input_path.resolve()}: {e}")
-
-        # append a log row for this file (success, skip, or error)
-        finally:
-            try:
-                logger.append()
-            except Exception as e:
-                print(f"CRITICAL: Failed to write log row for {input_path.resolve()}: {e}")
+        # process_file logs its own errors; anything escaping it would otherwise be lost with the future
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                print(f"CRITICAL: {futures[future].resolve()} failed: {future.exception()!r}")
 
 
 if __name__ == "__main__":
@@ -400,22 +542,53 @@ if __name__ == "__main__":
     parser.add_argument("--pattern", default="**/LS*/*.mp4", type=str, help="pattern to match")
     parser.add_argument("--motion_percentile", default=99.9, type=float, help="percentile of frame-to-frame motion")
     parser.add_argument("--motion_threshold", default=0.001, type=float, help="motion detection threshold")
+    parser.add_argument(
+        "--detector",
+        default="mog2",
+        choices=list(motion.DETECTORS),
+        help="motion detector (see compare_detectors.py for the threshold matching mog2)",
+    )
+    parser.add_argument(
+        "--trace_cache",
+        default=None,
+        type=Path,
+        help="folder keeping per-file motion traces for reevaluate_motion.py "
+        "(default: <output>/auxiliary-data/motion-traces)",
+    )
     parser.add_argument(
         "--n_threads",
-        default=4,
+        default=None,
         type=int,
-        help="number of threads used by ffmpeg {4 for mac05, 5 for mac06, 5 for mac07}",
+        help="number of threads used by ffmpeg (default: from tune_encoder profile, else 4)",
     )
     parser.add_argument(
         "--taskcam_crf", default=25, type=int, help="compression quality {24 for visually lossless, ..., 30 for lossy}"
     )
     parser.add_argument(
         "--compress_spd",
-        default="veryfast",
+        default=None,
         type=str,
-        help="compression speed {ultrafast, superfast, veryfast, ..., veryslow}",
+        help="compression speed {ultrafast, superfast, veryfast, ..., veryslow} "
+        "(default: from tune_encoder profile, else veryfast)",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        default=None,
+        type=int,
+        help="number of files compressed at the same time (default: from tune_encoder profile, else 1)",
     )
     parser.add_argument("--recompress", action="store_true", help="force compression if input is already compressed")
+    parser.add_argument(
+        "--catalog", default=None, type=Path, help=f"slice catalog to update (default: <output>/{CATALOG_FILE_NAME})"
+    )
+    parser.add_argument("--nice", default=10, type=int, help="CPU priority, higher is lower (I/O priority is lowered too)")
+    parser.add_argument(
+        "--capture_cpus",
+        default=None,
+        type=int,
+        nargs="+",
+        help="cores to leave to the cameras, when compressing on the recording machine (Linux only)",
+    )
     kwargs = vars(parser.parse_args())
 
     # argument validation
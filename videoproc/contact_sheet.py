@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""
+Render a contact sheet of one camera over a time range from the thumbnail index (see ratrix_thumbs).
+
+The thumbnails are read from the memory-mapped day files, so a full day of a camera is laid out without
+decoding any video. If the range holds more thumbnails than --max_tiles, evenly spaced ones are shown.
+Each tile is labelled with its wall-clock time; gaps in the recording leave no tile.
+
+Usage:
+    python contact_sheet.py /Volumes/data cam3 --start "2025-07-22 00:00" --end "2025-07-23 00:00"
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import extract_clip
+import numpy as np
+
+# shared modules from the recording stack live one folder up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ratrix_thumbs import THUMBNAIL_DIR, query_thumbnails  # noqa: E402
+
+
+def render(times: np.ndarray, frames: list[np.ndarray], cols: int, label_format: str) -> np.ndarray:
+    """Tile the thumbnails row by row, with their time in the corner."""
+    height, width = frames[0].shape[:2]
+    rows = -(-len(frames) // cols)
+    sheet = np.zeros((rows * height, cols * width, 3), np.uint8)
+    for i, (t, frame) in enumerate(zip(times, frames)):
+        r, c = divmod(i, cols)
+        tile = sheet[r * height : (r + 1) * height, c * width : (c + 1) * width]
+        tile[:] = frame[:height, :width]  # copies out of the memory map
+        label = datetime.fromtimestamp(t).strftime(label_format)
+        cv2.putText(tile, label, (3, height - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 2, cv2.LINE_AA)
+        cv2.putText(tile, label, (3, height - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (255, 255, 255), 1, cv2.LINE_AA)
+    return sheet
+
+
+def main(root: Path, camera: str, start: datetime, end: datetime, output: Path | None, cols: int, max_tiles: int):
+    """thumbnails in range -> evenly spaced subset -> tiled image."""
+    timer = time.perf_counter()
+    times, frames = query_thumbnails(str(root / THUMBNAIL_DIR), camera, start.timestamp(), end.timestamp())
+    if not frames:
+        print(f"no thumbnails of {camera} between {start} and {end} in {root / THUMBNAIL_DIR}")
+        return
+    if len(frames) > max_tiles:
+        keep = np.linspace(0, len(frames) - 1, max_tiles).round().astype(int)
+        times, frames = times[keep], [frames[i] for i in keep]
+    label_format = "%H:%M:%S" if start.date() == end.date() else "%m-%d %H:%M:%S"
+    sheet = render(times, frames, min(cols, len(frames)), label_format)
+
+    if output is None:
+        output = Path(f"{camera}_{start:%Y%m%d_%H-%M-%S}_{end:%Y%m%d_%H-%M-%S}.jpg")
+    if not cv2.imwrite(str(output), sheet):
+        print(f"could not write {output}")
+        return
+    print(f"wrote {len(frames)} thumbnails to {output} in {time.perf_counter() - timer:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="contact sheet of one camera from the thumbnail index",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("root", type=Path, help="recording folder (the save_path, or its first drive)")
+    parser.add_argument("camera", type=str, help="camera name, eg cam3")
+    parser.add_argument("--start", required=True, type=extract_clip.parse_time, help="eg '2025-07-22 00:00'")
+    parser.add_argument("--end", required=True, type=extract_clip.parse_time, help="eg '2025-07-23 00:00'")
+    parser.add_argument("--output", default=None, type=Path, help="image file (default: <camera>_<start>_<end>.jpg)")
+    parser.add_argument("--cols", default=12, type=int, help="thumbnails per row")
+    parser.add_argument("--max_tiles", default=288, type=int, help="most thumbnails shown, evenly spaced")
+    kwargs = vars(parser.parse_args())
+
+    if kwargs["end"] <= kwargs["start"]:
+        raise ValueError("--end must be after --start")
+
+    main(**kwargs)
@@ -1,28 +1,154 @@
 #!/usr/bin/env python3
 
+"""
+Motion detection for compress_drive.
+
+Every 10th frame is reduced to 1/3 size and passed to a detector, which returns the fraction of
+the frame that changed. Besides the original MOG2 background subtractor, three cheaper detectors
+computed with plain NumPy are available (see DETECTORS); compare_detectors.py measures their speed
+and agreement with MOG2 on real footage.
+
+The per-frame motion of each file can be kept in a cache folder (cached_main), one .npy file per video
+and detector, named after a hash of the video's name, size and modification time and of the detector
+settings. Decisions for other thresholds are then recomputed from the cache by reevaluate_motion.py
+without decoding the videos again.
+"""
+
 import argparse
+import hashlib
+import json
+import os
 from pathlib import Path
 
 import cv2 as cv
 import numpy as np
 
 
+class Detector:
+    """Turns sampled frames (BGR, reduced size) into the fraction of the frame in motion."""
+
+    name = ""
+
+    def __init__(self):
+        self.mask = None  # last motion mask, for display
+
+    @property
+    def params(self) -> dict:
+        """Settings that change the result, part of the trace cache key."""
+        return {k: v for k, v in vars(self).items() if isinstance(v, (int, float, str))}
+
+    def apply(self, frame: np.ndarray) -> float:
+        raise NotImplementedError
+
+    @staticmethod
+    def gray(frame: np.ndarray) -> np.ndarray:
+        return cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+
+
+class MOG2Detector(Detector):
+    """Gaussian mixture background subtraction followed by a morphological opening."""
+
+    name = "mog2"
+
+    def __init__(self, history: int = 600, var_threshold: float = 16):
+        super().__init__()
+        self.history = history
+        self.var_threshold = var_threshold
+        self.mog = cv.createBackgroundSubtractorMOG2(
+            history=history,  # Number of frames that affect the background model
+            varThreshold=var_threshold,  # Sensitivity threshold
+            detectShadows=False,  # Increases speed
+        )
+        self.kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
+
+    def apply(self, frame: np.ndarray) -> float:
+        # (1) background subtraction using MOG
+        fg_mask = self.mog.apply(frame)
+
+        # (2) morphological opening to remove noise
+        self.mask = cv.morphologyEx(fg_mask, cv.MORPH_OPEN, self.kernel)
+        return cv.countNonZero(self.mask) / self.mask.size
+
+
+class RunningAverageDetector(Detector):
+    """Pixels differing from an exponentially weighted average of past frames."""
+
+    name = "running-average"
+
+    def __init__(self, alpha: float = 0.01, threshold: int = 20):
+        super().__init__()
+        self.alpha = alpha  # weight of each new frame, 0.01 remembers about the last 100 samples
+        self.threshold = threshold  # gray levels
+        self.background = None
+
+    def apply(self, frame: np.ndarray) -> float:
+        gray = self.gray(frame).astype(np.float32)
+        if self.background is None:
+            self.background = gray
+        self.mask = np.abs(gray - self.background) > self.threshold
+        self.background += self.alpha * (gray - self.background)
+        return float(self.mask.mean())
+
+
+class FrameDiffDetector(Detector):
+    """Pixels differing from the previous sample, on a further 2x downsampled frame."""
+
+    name = "frame-diff"
+
+    def __init__(self, threshold: int = 25, step: int = 2):
+        super().__init__()
+        self.threshold = threshold  # gray levels
+        self.step = step
+        self.previous = None
+
+    def apply(self, frame: np.ndarray) -> float:
+        gray = self.gray(frame)[:: self.step, :: self.step].astype(np.int16)
+        if self.previous is None:
+            self.previous = gray
+        self.mask = np.abs(gray - self.previous) > self.threshold
+        self.previous = gray
+        return float(self.mask.mean())
+
+
+class BlockMeanDetector(Detector):
+    """Blocks whose mean brightness changed since the previous sample; averaging suppresses sensor noise."""
+
+    name = "block-mean"
+
+    def __init__(self, block: int = 8, threshold: float = 3.0):
+        super().__init__()
+        self.block = block  # pixels per side
+        self.threshold = threshold  # gray levels
+        self.previous = None
+
+    def apply(self, frame: np.ndarray) -> float:
+        gray = self.gray(frame)
+        b = self.block
+        h, w = gray.shape[0] // b, gray.shape[1] // b
+        means = gray[: h * b, : w * b].reshape(h, b, w, b).mean(axis=(1, 3), dtype=np.float32)
+        if self.previous is None:
+            self.previous = means
+        self.mask = np.abs(means - self.previous) > self.threshold
+        self.previous = means
+        return float(self.mask.mean())
+
+
+DETECTORS: dict[str, type[Detector]] = {
+    d.name: d for d in [MOG2Detector, RunningAverageDetector, FrameDiffDetector, BlockMeanDetector]
+}
+
+
 def play_frame(frame):
     """display frame, exit if 'q' is pressed"""
     cv.imshow("motion detection", frame)
     return cv.waitKey(1) & 0xFF == ord("q")
 
 
-def main(path, play_video):
-    cap = cv.VideoCapture(path)
+def main(path, play_video, detector: str = "mog2"):
+    cap = cv.VideoCapture(str(path))
 
-    # initialize background subtractor and kernel
-    mog = cv.createBackgroundSubtractorMOG2(
-        history=600,  # Number of frames that affect the background model
-        varThreshold=16,  # Sensitivity threshold
-        detectShadows=False,  # Increases speed
-    )
-    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
+    # initialize detector
+    motion_detector = DETECTORS[detector]()
 
     # motion detection
     motion_by_frame = []
@@ -30,35 +156,29 @@ def main(path, play_video):
     n_frames = 0
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
+        # skip every 10 frames (1/3 sec) for faster processing; skipped frames are grabbed without conversion
         n_frames += 1
-
-        # skip every 10 frames (1/3 sec) for faster processing
         if n_frames % 10 != 0:
+            if not cap.grab():
+                break
             continue
+        ret, frame = cap.read()
+        if not ret:
+            break
 
         # reduce frame resolution for faster processing
         frame = cv.resize(frame, (frame.shape[1] // 3, frame.shape[0] // 3))
 
-        # skip frames for MOG stability
+        # skip frames for detector stability
         if n_frames <= n_frames_to_skip:
-            mog.apply(frame)
+            motion_detector.apply(frame)
             continue
 
-        # (1) background subtraction using MOG
-        fg_mask = mog.apply(frame)
-
-        # (2) morphological opening to remove noise
-        fg_mask_filt = cv.morphologyEx(fg_mask, cv.MORPH_OPEN, kernel)
-
         # motion by frame
-        motion_by_frame.append(cv.countNonZero(fg_mask_filt) / fg_mask_filt.size)
+        motion_by_frame.append(motion_detector.apply(frame))
 
         # display frame if show_frames is enabled
-        if play_video and play_frame(fg_mask_filt):
+        if play_video and play_frame((motion_detector.mask > 0).astype(np.uint8) * 255):
             break
 
     cap.release()
@@ -66,11 +186,54 @@ def main(path, play_video):
     return np.asarray(motion_by_frame)
 
 
+TRACE_VERSION = 1  # bump when main() changes how frames are sampled
+
+
+def trace_path(cache_dir: Path, path: Path, detector: str = "mog2") -> Path:
+    """Cache file for the motion trace of a video; changes whenever the video or the detector settings do."""
+    stat = Path(path).stat()
+    key = {
+        "file": Path(path).name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "detector": detector,
+        "params": DETECTORS[detector]().params,
+        "version": TRACE_VERSION,
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+    return Path(cache_dir) / detector / f"{digest}.npy"
+
+
+def load_trace(cache_dir: Path, path: Path, detector: str = "mog2") -> np.ndarray | None:
+    try:
+        return np.load(trace_path(cache_dir, path, detector))
+    except (OSError, ValueError):
+        return None
+
+
+def cached_main(path, detector: str = "mog2", cache_dir: Path | None = None) -> np.ndarray:
+    """main() without display, reusing the trace from cache_dir if there is one, else storing it there."""
+    if cache_dir is None:
+        return main(path, False, detector)
+    trace = load_trace(cache_dir, path, detector)
+    if trace is not None:
+        return trace
+    trace = main(path, False, detector).astype(np.float32)  # 4 bytes per sampled frame
+    out = trace_path(cache_dir, path, detector)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as file:
+        np.save(file, trace)
+    os.replace(tmp, out)  # never leave a partial trace for files processed concurrently
+    return trace
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Detect motion in video.")
     parser.add_argument("path", type=Path, help="Path to the video file.")
     parser.add_argument("--play_video", action="store_true", help="Play video during processing (press 'q' to exit).")
+    parser.add_argument("--detector", default="mog2", choices=list(DETECTORS), help="Motion detector.")
     args = parser.parse_args()
 
-    motion_by_frame = main(args.path, args.play_video)
+    motion_by_frame = main(args.path, args.play_video, args.detector)
     print(f"motion-99-perc: {np.percentile(motion_by_frame, 99)}")
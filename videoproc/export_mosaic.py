@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Export a tiled video of all cameras for a time interval, laid out like the recording window.
+
+Each camera is decoded by its own reader thread, which resizes frames to the tile size and tags them with their
+wall-clock time, and marks the end of each slice so the tile goes black (offline) until the next. The main thread steps through the output timeline, takes the latest frame of every camera at or
+before each output time, writes the tiles into one preallocated (rows, cols, h, w, 3) array and streams the composed
+mosaic to ffmpeg as raw video.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+
+import cv2
+import extract_clip
+import numpy as np
+
+# shared modules from the recording stack live one folder up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ratrix_utils import grid_positions, load_settings, save_volumes  # noqa: E402
+
+_END = None  # queue sentinel marking the end of a camera's frames
+_BLANK = None  # in place of a tile: no recording from this time on
+
+
+class CameraReader(Thread):
+    """Decode one camera's slices over [t1, t2] into (wall time, tile) pairs on a bounded queue."""
+
+    def __init__(
+        self, slices: list[extract_clip.Slice], t1: float, t2: float, fps_out: float, tile_size: tuple[int, int]
+    ):
+        super().__init__(daemon=True)
+        self.slices = slices
+        self.t1, self.t2 = t1, t2
+        self.period = 1 / fps_out
+        self.tile_size = tile_size
+        self.frames: Queue[tuple[float, np.ndarray | None] | None] = Queue(maxsize=64)
+        self.n_decoded = 0
+
+    def run(self):
+        try:
+            for piece in self.slices:
+                if not self._read_slice(piece):
+                    break
+        finally:
+            self.frames.put(_END)
+
+    def _read_slice(self, piece: extract_clip.Slice) -> bool:
+        cap = cv2.VideoCapture(str(piece.path))
+        if not cap.isOpened():
+            print(f"    WARNING: cannot open {piece.path}, leaving a gap")
+            return True
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        # exact capture times from the timestamp track, needed when idle_fps left frames out
+        times = extract_clip.frame_times(piece.path, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or piece.n_frames or 0)
+        # otherwise, the cameras run at only approximately the nominal fps: stretch media time onto the recorded
+        # wall time
+        scale = 1.0
+        if piece.end_time is not None and piece.n_frames:
+            scale = (piece.end_time - piece.start_time) / (piece.n_frames / fps)
+        frame_index = 0
+        if times is not None:
+            frame_index = int(np.searchsorted(times, self.t1))
+        elif self.t1 > piece.start_time:
+            frame_index = int((self.t1 - piece.start_time) / scale * fps)
+        if frame_index:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+
+        next_needed = self.t1
+        t = piece.start_time
+        while True:
+            if times is None:
+                t = piece.start_time + frame_index / fps * scale
+            elif frame_index < len(times):
+                t = float(times[frame_index])
+            else:
+                break  # past the last frame of the slice
+            if t > self.t2:
+                cap.release()
+                return False
+            # frames falling between output samples are skipped without being converted
+            if t + self.period < next_needed:
+                if not cap.grab():
+                    break
+                frame_index += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_index += 1
+            self.n_decoded += 1
+            self.frames.put((t, cv2.resize(frame, self.tile_size, interpolation=cv2.INTER_AREA)))
+            next_needed = max(next_needed, t) + self.period
+        cap.release()
+        # offline from the end of the slice until the next one starts
+        self.frames.put((piece.end_time if piece.end_time is not None else t + 1 / fps, _BLANK))
+        return True
+
+
+def main(
+    config_path: Path,
+    start: datetime,
+    end: datetime,
+    output: Path,
+    db: Path | None,
+    tile_width: int,
+    tile_height: int,
+    fps: float | None,
+    crf: int,
+):
+    """readers per camera -> align -> tile -> encode."""
+    config = load_settings(str(config_path))
+    if config is None:
+        return
+    t1, t2 = start.timestamp(), end.timestamp()
+    if t2 <= t1:
+        raise ValueError("end must be after start")
+    fps_out = fps or config.default_fps
+    timer = time.perf_counter()
+
+    n_rows, n_cols, positions = grid_positions(config.cameras)
+    readers = []
+    for camera in config.cameras:
+        slices = extract_clip.find_slices(Path(save_volumes(config)[0]), camera.name, t1, t2, db)
+        print(f"{camera.name}: {len(slices)} slices")
+        readers.append(CameraReader(slices, t1, t2, fps_out, (tile_width, tile_height)))
+    for reader in readers:
+        reader.start()
+
+    # tiles[r, c] holds the current frame of the camera at that grid position; cameras without data stay black
+    tiles = np.zeros((n_rows, n_cols, tile_height, tile_width, 3), dtype=np.uint8)
+    mosaic = np.empty((n_rows * tile_height, n_cols * tile_width, 3), dtype=np.uint8)
+    mosaic_view = mosaic.reshape(n_rows, tile_height, n_cols, tile_width, 3)
+    pending: list[tuple[float, np.ndarray] | None] = [reader.frames.get() for reader in readers]
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    encoder = subprocess.Popen(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{mosaic.shape[1]}x{mosaic.shape[0]}", "-r", str(fps_out),
+            "-i", "-",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf), "-pix_fmt", "yuv420p",
+            str(output),
+        ],
+        stdin=subprocess.PIPE,
+    )
+    assert encoder.stdin is not None
+
+    n_out = int((t2 - t1) * fps_out)
+    for k in range(n_out):
+        t = t1 + k / fps_out
+        for i, (reader, (row, col)) in enumerate(zip(readers, positions)):
+            # advance to the latest frame at or before t
+            while pending[i] is not _END and pending[i][0] <= t:
+                tile = pending[i][1]
+                if tile is _BLANK:
+                    tiles[row, col] = 0
+                else:
+                    tiles[row, col] = tile
+                pending[i] = reader.frames.get()
+        np.copyto(mosaic_view, tiles.transpose(0, 2, 1, 3, 4))
+        try:
+            encoder.stdin.write(mosaic.data)
+        except BrokenPipeError:
+            break  # ffmpeg exited, reported below
+
+    try:
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass
+    if encoder.wait() != 0:
+        print(f"ERROR: ffmpeg failed to encode {output} (exit code {encoder.returncode})")
+        return
+    elapsed = time.perf_counter() - timer
+    print(
+        f"saved {output}: {n_out} frames of {mosaic.shape[1]}x{mosaic.shape[0]}, "
+        f"{sum(r.n_decoded for r in readers)} source frames decoded, "
+        f"{elapsed:.1f} s ({(t2 - t1) / max(elapsed, 1e-9):.1f}x real time)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="export a tiled video of all cameras", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("config_path", type=Path, help="config.json of the recording rack")
+    parser.add_argument("--start", required=True, type=extract_clip.parse_time, help="eg '2025-07-22 14:02'")
+    parser.add_argument("--end", required=True, type=extract_clip.parse_time, help="eg '2025-07-22 14:17'")
+    parser.add_argument("--output", default=Path("mosaic.mp4"), type=Path, help="output file")
+    parser.add_argument("--db", default=None, type=Path, help="slice catalog to locate slices (default: file names)")
+    parser.add_argument("--tile_width", default=320, type=int, help="width of each camera tile")
+    parser.add_argument("--tile_height", default=240, type=int, help="height of each camera tile")
+    parser.add_argument("--fps", default=None, type=float, help="output frame rate (default: config default_fps)")
+    parser.add_argument("--crf", default=23, type=int, help="x264 quality of the mosaic")
+    kwargs = vars(parser.parse_args())
+
+    main(**kwargs)
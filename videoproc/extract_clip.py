@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+Extract one camera's video between two wall-clock times into a single file.
+
+The slices covering the range are found from the slice catalog (if given) or from the file names
+written by ratrix_cam_server. Inside each slice, everything between the first and last keyframe of
+the range is stream copied; only the partial GOPs at the edges are re-encoded. The pieces are then
+concatenated without re-encoding, so extracting an hour takes seconds and never decodes the range.
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+# shared modules from the recording stack live one folder up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ratrix_catalog import SLICE_TIME_FORMAT, manifest_volumes, parse_slice_file_name, query_slices  # noqa: E402
+from ratrix_timestamps import read_timestamps  # noqa: E402
+
+# encoder used for the re-encoded edges, by source codec (as named in ffmpeg's framecrc header)
+EDGE_ENCODERS = {
+    "mpeg4": ["-c:v", "mpeg4", "-q:v", "2"],
+    "mjpeg": ["-c:v", "mjpeg", "-q:v", "2"],
+    "h264": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"],
+    "hevc": ["-c:v", "libx265", "-preset", "veryfast", "-crf", "20", "-tag:v", "hvc1"],
+}
+
+
+class Slice(NamedTuple):
+    path: Path
+    start_time: float  # wall clock of the first frame, epoch seconds
+    end_time: float | None  # wall clock at the end of the slice, if known
+    n_frames: int | None
+
+
+class PacketIndex(NamedTuple):
+    codec: str
+    time_base: float
+    keyframes: list[float]  # presentation times (s) of keyframes, ascending
+    duration: float  # media duration (s)
+    n_frames: int
+
+
+def index_packets(path: Path) -> PacketIndex:
+    """Read packet timestamps and keyframe flags with a stream copy demux (no decoding)."""
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", str(path), "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    codec, time_base = "", 1.0
+    keyframes, pts_list = [], []
+    end = 0.0
+    for line in result.stdout.splitlines():
+        if line.startswith("#tb 0:"):
+            num, den = line.split(":", 1)[1].strip().split("/")
+            time_base = int(num) / int(den)
+        elif line.startswith("#codec_id 0:"):
+            codec = line.split(":", 1)[1].strip()
+        elif not line.startswith("#"):
+            fields = [f.strip() for f in line.split(",")]
+            pts, duration = int(fields[2]) * time_base, int(fields[3]) * time_base
+            pts_list.append(pts)
+            end = max(end, pts + duration)
+            # framecrc only prints flags (F=) that differ from a plain keyframe, and otherwise may print side data
+            # (S=) in that position
+            if len(fields) < 7 or not fields[6].startswith("F=") or int(fields[6][2:], 16) & 1:
+                keyframes.append(pts)
+    first = min(pts_list, default=0.0)
+    return PacketIndex(codec, time_base, sorted(k - first for k in keyframes), end - first, len(pts_list))
+
+
+def frame_times(path: Path, n_frames: int) -> np.ndarray | None:
+    """Capture time of every frame from the timestamp track of a slice, None without one that covers all frames."""
+    times = read_timestamps(str(path))
+    if times is None or n_frames <= 0 or len(times) < n_frames:
+        return None
+    return times[:n_frames]
+
+
+def find_slices(root: Path, camera: str, t1: float, t2: float, db: Path | None) -> list[Slice]:
+    """Slices for camera that may overlap [t1, t2], ordered by start time."""
+    if db is not None:
+        return [
+            Slice(Path(r.path), r.start_time, r.end_time, r.n_frames)
+            for r in query_slices(str(db), camera, t1, t2, location="raw")
+            if Path(r.path).is_file()
+        ]
+
+    # a rack recording to several drives lists the other drives in the manifest on the first
+    roots = [root, *(Path(v) for v in manifest_volumes(str(root)) if Path(v) != root and Path(v).is_dir())]
+    # folders are <study_label>_<camera>_<YYYYmmdd>; a slice may start the day before t1
+    first_day, last_day = datetime.fromtimestamp(t1).date() - timedelta(days=1), datetime.fromtimestamp(t2).date()
+    candidates: list[tuple[float, Path]] = []
+    for volume in roots:
+        day = first_day
+        while day <= last_day:
+            for folder in volume.glob(f"*_{camera}_{day:%Y%m%d}"):
+                for path in folder.iterdir():
+                    parsed = parse_slice_file_name(path.name)
+                    if parsed is not None and parsed[0] == camera:
+                        candidates.append((parsed[1].timestamp(), path))
+            day += timedelta(days=1)
+    candidates.sort()
+
+    # without a catalog a slice is taken to end where the next one starts (or at its media duration)
+    slices = []
+    for i, (start, path) in enumerate(candidates):
+        end = candidates[i + 1][0] if i + 1 < len(candidates) else None
+        if start <= t2 and (end is None or end >= t1):
+            slices.append(Slice(path, start, end, None))
+    return slices
+
+
+def _run_ffmpeg(args: list[str]):
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+
+def cut_slice(
+    piece: Slice, index: PacketIndex, t_in: float, t_out: float, work_dir: Path, reencode: bool
+) -> list[tuple[Path, str]]:
+    """
+    Cut the media interval [t_in, t_out) from a slice into up to three pieces: a re-encoded head up to the first
+    keyframe, a stream copied middle, and a re-encoded tail from the last keyframe. Returns (file, mode) pairs.
+    """
+    encoder = EDGE_ENCODERS.get(index.codec)
+    if encoder is None and not reencode:
+        print(f"    no edge encoder for codec '{index.codec}', cutting {piece.path.name} at keyframes only")
+    tb_den = str(round(1 / index.time_base))
+    half_frame = 0.5 * index.duration / max(index.n_frames, 1)
+
+    inner = [k for k in index.keyframes if t_in - half_frame <= k <= t_out - half_frame]
+    if reencode or not inner:
+        bounds = [(t_in, t_out, "encode")]
+    else:
+        k_in, k_out = inner[0], inner[-1]
+        if k_out - k_in < half_frame:
+            k_out = t_out  # a single keyframe: copy from it to the end
+        bounds = [(t_in, k_in, "encode"), (k_in, k_out, "copy"), (k_out, t_out, "encode")]
+        if encoder is None:
+            bounds = [(k_in, t_out, "copy")]
+
+    pieces = []
+    for start, end, mode in bounds:
+        if end - start < half_frame:
+            continue
+        out = work_dir / f"{len(list(work_dir.iterdir())):05d}.mp4"
+        seek = ["-ss", f"{start:.6f}", "-i", str(piece.path), "-t", f"{end - start:.6f}", "-map", "0:v:0"]
+        if mode == "copy":
+            _run_ffmpeg([*seek, "-c", "copy", "-video_track_timescale", tb_den, str(out)])
+        else:
+            _run_ffmpeg([*seek, *(encoder or ["-c:v", "mpeg4", "-q:v", "2"]), "-video_track_timescale", tb_den, str(out)])
+        pieces.append((out, mode))
+    return pieces
+
+
+def main(root: Path, camera: str, start: datetime, end: datetime, output: Path | None, db: Path | None, reencode: bool):
+    """locate slices -> cut each at keyframes -> concatenate."""
+    timer = time.perf_counter()
+    t1, t2 = start.timestamp(), end.timestamp()
+    if t2 <= t1:
+        raise ValueError("end must be after start")
+    if output is None:
+        output = Path(f"{camera}_{start.strftime(SLICE_TIME_FORMAT)}_{end:%H-%M-%S}.mp4")
+
+    slices = find_slices(root, camera, t1, t2, db)
+    if not slices:
+        print(f"no slices found for camera {camera} between {start} and {end}")
+        return
+    print(f"found {len(slices)} slices covering {start:%Y-%m-%d %H:%M:%S} to {end:%H:%M:%S}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp) / "pieces"
+        work_dir.mkdir()
+        pieces: list[tuple[Path, str]] = []
+        for piece in slices:
+            index = index_packets(piece.path)
+            times = frame_times(piece.path, index.n_frames)
+            if times is not None:
+                # exact capture times: also right when idle_fps left frames out, so media time is not wall time
+                frame_duration = index.duration / index.n_frames
+                t_in = int(np.searchsorted(times, t1)) * frame_duration
+                t_out = int(np.searchsorted(times, t2)) * frame_duration
+            else:
+                # map wall-clock offsets to media time: the cameras run at only approximately the nominal fps,
+                # so stretch by the ratio of media duration to recorded wall duration when the latter is known
+                scale = 1.0
+                if piece.end_time is not None and piece.n_frames and piece.end_time > piece.start_time:
+                    scale = index.duration / (piece.end_time - piece.start_time)
+                t_in = max(0.0, (t1 - piece.start_time) * scale)
+                t_out = min(index.duration, (t2 - piece.start_time) * scale)
+            if t_out <= t_in:
+                continue
+            print(f"    {piece.path.name}: {t_in:.2f} s to {t_out:.2f} s")
+            pieces += cut_slice(piece, index, t_in, t_out, work_dir, reencode)
+
+        if not pieces:
+            print("requested range falls between slices, nothing to extract")
+            return
+
+        list_file = Path(tmp) / "pieces.txt"
+        list_file.write_text("".join(f"file '{p}'\n" for p, _ in pieces))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        _run_ffmpeg(["-f", "concat", "-safe", "0", "-i", str(list_file), "-c", "copy", str(output)])
+
+    n_copied = sum(mode == "copy" for _, mode in pieces)
+    print(
+        f"saved {output} from {len(pieces)} pieces ({n_copied} stream copied) "
+        f"in {time.perf_counter() - timer:.1f} s"
+    )
+
+
+def parse_time(text: str) -> datetime:
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", SLICE_TIME_FORMAT):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"cannot parse time '{text}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="extract a time range of one camera", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("root", type=Path, help="recording folder (the save_path, or its first drive)")
+    parser.add_argument("camera", type=str, help="camera name, eg cam3")
+    parser.add_argument("--start", required=True, type=parse_time, help="eg '2025-07-22 14:02'")
+    parser.add_argument("--end", required=True, type=parse_time, help="eg '2025-07-22 14:17'")
+    parser.add_argument("--output", default=None, type=Path, help="output file (default: <camera>_<start>_<end>.mp4)")
+    parser.add_argument("--db", default=None, type=Path, help="slice catalog to locate slices (default: file names)")
+    parser.add_argument("--reencode", action="store_true", help="re-encode everything instead of stream copying")
+    kwargs = vars(parser.parse_args())
+
+    if not kwargs["root"].is_dir():
+        raise NotADirectoryError(f"{kwargs['root']} is not a valid directory")
+
+    main(**kwargs)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Recompute compress_drive's motion decisions from cached motion traces, without decoding any video.
+
+compress_drive keeps the per-frame motion of every file it analyses in its trace cache (by default
+<output>/auxiliary-data/motion-traces). Given the raw drive and that cache, this applies a new
+--motion_percentile / --motion_threshold to every file, prints how many files would be compressed as
+motion or no motion, and optionally writes the per-file results to a CSV file. Files without a cached
+trace (never analysed, or changed since) are counted and left out.
+
+Usage:
+    python reevaluate_motion.py /Volumes/data /Volumes/archive/auxiliary-data/motion-traces --motion_threshold 0.002
+"""
+
+import argparse
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import detect_motion as motion
+import numpy as np
+import scan_drive
+
+
+def main(
+    input: Path,
+    trace_cache: Path,
+    pattern: str,
+    detector: str,
+    motion_percentile: float,
+    motion_threshold: float,
+    csv_path: Path | None,
+):
+    """load traces -> decisions -> summary."""
+    start = time.perf_counter()
+    input_paths = scan_drive.scan(input, pattern)
+    if not input_paths:
+        print(f"no video files found in {input.resolve()} matching pattern '{pattern}'")
+        return
+
+    with ThreadPoolExecutor(max_workers=8) as pool:  # mostly waiting for small reads
+        traces = list(pool.map(lambda p: motion.load_trace(trace_cache, p, detector), input_paths))
+
+    rows = []
+    n_missing, n_too_short = 0, 0
+    for path, trace in zip(input_paths, traces):
+        if trace is None:
+            n_missing += 1
+            continue
+        if trace.size == 0:
+            n_too_short += 1  # compress_drive treats these as motion
+            continue
+        motion_perc = float(np.percentile(trace, motion_percentile))
+        rows.append(
+            {
+                "input_path": path,
+                "motion_perc": motion_perc,
+                "found_motion": motion_perc >= motion_threshold,
+                "fract_frames_exceeding": float(np.mean(trace > motion_threshold)),
+            }
+        )
+
+    n_motion = sum(row["found_motion"] for row in rows)
+    print(
+        f"{len(input_paths)} files: {n_motion} with motion, {len(rows) - n_motion} without, "
+        f"{n_too_short} too short to evaluate, {n_missing} not in the cache ({detector}, "
+        f"percentile {motion_percentile}, threshold {motion_threshold}, {time.perf_counter() - start:.1f} s)"
+    )
+    if csv_path is not None and rows:
+        with open(csv_path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"per-file results written to {csv_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="re-evaluate motion decisions from cached traces",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("input", type=Path, help="source path, as given to compress_drive")
+    parser.add_argument("trace_cache", type=Path, help="trace cache folder of compress_drive")
+    parser.add_argument("--pattern", default="**/LS*/*.mp4", type=str, help="pattern to match")
+    parser.add_argument("--detector", default="mog2", choices=list(motion.DETECTORS), help="motion detector")
+    parser.add_argument("--motion_percentile", default=99.9, type=float, help="percentile of frame-to-frame motion")
+    parser.add_argument("--motion_threshold", default=0.001, type=float, help="motion detection threshold")
+    parser.add_argument("--csv", dest="csv_path", default=None, type=Path, help="write per-file results to this file")
+    kwargs = vars(parser.parse_args())
+
+    if not kwargs["input"].is_dir():
+        raise NotADirectoryError(f"{kwargs['input']} is not a valid directory")
+
+    if not kwargs["trace_cache"].is_dir():
+        raise NotADirectoryError(f"{kwargs['trace_cache']} is not a valid directory")
+
+    main(**kwargs)
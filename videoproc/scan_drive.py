@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Fast listing of the video files on a drive, for compress_drive and reevaluate_motion.
+
+The drive is walked with os.scandir, one thread per top-level folder. Every folder's entries (the
+names of its files and subfolders) are kept in an index in ~/.ratrixcam/scan-index/, together with
+the folder's own modification time. On the next scan of the same drive, a folder whose modification
+time has not changed has had no file added, removed or renamed, so its entries are taken from the
+index instead of being listed again; only one stat per folder remains. File sizes and modification
+times are not kept, as they change without the folder's modification time changing.
+
+Usage:
+    python scan_drive.py /Volumes/data --pattern "**/LS*/*.mp4"
+    python scan_drive.py /Volumes/data --check  # compare with Path.glob
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+INDEX_DIR = Path.home() / ".ratrixcam" / "scan-index"
+INDEX_VERSION = 2
+
+
+def index_path(root: Path) -> Path:
+    digest = hashlib.sha1(str(root.resolve()).encode()).hexdigest()[:16]
+    return INDEX_DIR / f"{digest}.json"
+
+
+def load_index(path: Path) -> dict:
+    try:
+        index = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    return index["dirs"] if index.get("version") == INDEX_VERSION else {}
+
+
+def save_index(path: Path, root: Path, dirs: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"version": INDEX_VERSION, "root": str(root.resolve()), "dirs": dirs}))
+    os.replace(tmp, path)
+
+
+def list_dir(root: Path, rel: str, cached: dict | None) -> dict | None:
+    """
+    Entries of one folder: {"mtime_ns", "files": [names], "subdirs": [names]},
+    reused from the index when the folder has not changed. None if the folder cannot be read.
+    """
+    full = os.path.join(root, rel)
+    try:
+        mtime_ns = os.stat(full).st_mtime_ns
+        if cached is not None and cached["mtime_ns"] == mtime_ns:
+            return cached
+        files, subdirs = [], []
+        with os.scandir(full) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+    except OSError:
+        return None  # eg system folders of external drives that are not readable
+    return {"mtime_ns": mtime_ns, "files": sorted(files), "subdirs": sorted(subdirs)}
+
+
+def walk(root: Path, top: str, old: dict) -> dict:
+    """Folders below top (relative to root), depth first, without recursion limits."""
+    dirs = {}
+    stack = [top]
+    while stack:
+        rel = stack.pop()
+        listing = list_dir(root, rel, old.get(rel))
+        if listing is None:
+            continue
+        dirs[rel] = listing
+        stack.extend(os.path.join(rel, name) for name in listing["subdirs"])
+    return dirs
+
+
+def match(parts: list[str], pattern: list[str]) -> bool:
+    """Glob match of path components, where "**" matches any number of folders, like Path.glob."""
+    if not pattern:
+        return not parts
+    if pattern[0] == "**":
+        return any(match(parts[i:], pattern[1:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0]) and match(parts[1:], pattern[1:])
+
+
+def scan(root: Path, pattern: str = "**/*", n_workers: int = 8, use_index: bool = True) -> list[Path]:
+    """Files below root matching the glob pattern, sorted like sorted(root.glob(pattern))."""
+    start = time.perf_counter()
+    path = index_path(root)
+    old = load_index(path) if use_index else {}
+
+    top = list_dir(root, "", old.get(""))
+    if top is None:
+        return []
+    dirs = {"": top}
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for subtree in pool.map(lambda name: walk(root, name, old), top["subdirs"]):
+            dirs.update(subtree)
+    if use_index:
+        try:
+            save_index(path, root, dirs)
+        except OSError as e:
+            print(f"WARNING: could not save the file index {path}: {e}")
+
+    # folders are matched once each, then file names against the last component of the pattern;
+    # sorting by components gives the order of sorted Paths without comparing Path objects
+    *dir_pattern, name_pattern = pattern.split("/")
+    found = []
+    for rel, listing in dirs.items():
+        parts = Path(rel).parts
+        if match(list(parts), dir_pattern):
+            found.extend((*parts, name) for name in fnmatch.filter(listing["files"], name_pattern))
+    found.sort()
+    n_reused = sum(dirs[rel] is old.get(rel) for rel in dirs)
+    print(f"scanned {len(dirs)} folders ({n_reused} unchanged since last scan) in {time.perf_counter() - start:.1f} s")
+    return [root.joinpath(*parts) for parts in found]
+
+
+def check(root: Path, patterns: list[str]) -> bool:
+    """Compare scan with the files found by sorted(Path.glob) for each pattern; True if all agree."""
+    ok = True
+    for pattern in patterns:
+        expected = sorted(path for path in root.glob(pattern) if path.is_file())
+        found = scan(root, pattern, use_index=False)
+        if found == expected:
+            print(f"OK '{pattern}': {len(found)} files")
+            continue
+        ok = False
+        print(f"MISMATCH '{pattern}': {len(found)} files, Path.glob finds {len(expected)}")
+        for path in sorted(set(expected) - set(found))[:10]:
+            print(f"    missed {path}")
+        for path in sorted(set(found) - set(expected))[:10]:
+            print(f"    extra {path}")
+        if set(found) == set(expected):
+            print("    same files, different order")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="list the video files on a drive", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("input", type=Path, help="drive or folder to scan")
+    parser.add_argument("--pattern", default="**/LS*/*.mp4", type=str, help="pattern to match")
+    parser.add_argument("--no_index", action="store_true", help="list every folder, ignoring the saved index")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="compare the files found with Path.glob, for the pattern and for '**/*', '**/*.mp4' and 'a/**/*.mp4'",
+    )
+    args = parser.parse_args()
+
+    if not args.input.is_dir():
+        raise NotADirectoryError(f"{args.input} is not a valid directory")
+
+    if args.check:
+        raise SystemExit(0 if check(args.input, [args.pattern, "**/*", "**/*.mp4", "a/**/*.mp4"]) else 1)
+
+    paths = scan(args.input, args.pattern, use_index=not args.no_index)
+    print(f"{len(paths)} files matching '{args.pattern}'")
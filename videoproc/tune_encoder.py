@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+Find the fastest x264 settings for compress_drive on this machine.
+
+A few raw slices are sampled from a drive and trimmed to short clips. Each x264 preset is
+first tried once, measuring throughput, compression ratio and SSIM against the source.
+Of the presets whose SSIM is close to the best, those compressing nearly as well as the
+best of them are candidates, and the fastest candidate is kept.
+For that preset, combinations of ffmpeg thread count and number of files compressed
+concurrently are then timed, and the combination with the highest throughput is written
+as the profile for this host, which compress_drive loads when --compress_spd, --n_threads
+or --n_jobs are not given.
+
+Usage:
+    python tune_encoder.py /Volumes/data
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+PROFILE_DIR = Path.home() / ".ratrixcam"
+
+
+def profile_path() -> Path:
+    # one file per host, so a home folder shared between machines keeps them apart
+    return PROFILE_DIR / f"encoder_{socket.gethostname().split('.')[0]}.json"
+
+
+def load_profile() -> dict | None:
+    try:
+        return json.loads(profile_path().read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def make_samples(input: Path, pattern: str, n_samples: int, seconds: float, work_dir: Path) -> list[Path]:
+    """Stream copy the first seconds of randomly chosen slices (no re-encoding)."""
+    paths = sorted(input.glob(pattern))
+    if not paths:
+        return []
+    samples = []
+    for i, path in enumerate(random.Random(0).sample(paths, min(n_samples, len(paths)))):
+        out = work_dir / f"sample{i}.mp4"
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", str(path), "-t", str(seconds), "-map", "0:v:0",
+             "-c", "copy", str(out)],
+            check=True,
+        )  # fmt: skip
+        samples.append(out)
+    return samples
+
+
+def duration(path: Path) -> float:
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-i", str(path), "-map", "0:v:0", "-c", "copy", "-f", "null", "-"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    times = re.findall(r"time=(\d+):(\d+):([\d.]+)", result.stderr)
+    h, m, s = times[-1] if times else ("0", "0", "0")
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def encode(sample: Path, out: Path, preset: str, threads: int, crf: int):
+    # same settings as compress_drive.compress_video for a task camera with motion
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", str(sample), "-c:v", "libx264", "-preset", preset,
+         "-pix_fmt", "yuv420p", "-threads", str(threads), "-crf", str(crf), str(out)],
+        check=True,
+    )  # fmt: skip
+
+
+def ssim(encoded: Path, source: Path) -> float:
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-i", str(encoded), "-i", str(source), "-lavfi", "[0:v][1:v]ssim",
+         "-f", "null", "-"],  # fmt: skip
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    match = re.search(r"All:([\d.]+)", result.stderr)
+    return float(match.group(1)) if match else 0.0
+
+
+def run_trial(
+    samples: list[Path], seconds: list[float], work_dir: Path, preset: str, threads: int, jobs: int, crf: int
+):
+    """
+    Compress every sample with `jobs` files at a time; returns throughput (seconds of video per second),
+    compression ratio and mean SSIM over the samples.
+    """
+    outputs = [work_dir / f"{preset}_{threads}_{jobs}_{i}.mp4" for i in range(len(samples))]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda i: encode(samples[i], outputs[i], preset, threads, crf), range(len(samples))))
+    elapsed = time.perf_counter() - start
+    ratio = sum(s.stat().st_size for s in samples) / sum(o.stat().st_size for o in outputs)
+    quality = sum(ssim(o, s) for o, s in zip(outputs, samples)) / len(samples)
+    for out in outputs:
+        out.unlink()
+    return sum(seconds) / elapsed, ratio, quality
+
+
+def main(input: Path, pattern: str, n_samples: int, seconds: float, crf: int, max_ssim_loss: float, min_ratio: float):
+    """sample -> pick preset -> pick threads and jobs -> write profile."""
+    timer = time.perf_counter()
+    n_cpu = os.cpu_count() or 4
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        samples = make_samples(input, pattern, n_samples, seconds, work_dir)
+        if not samples:
+            print(f"no video files found in {input.resolve()} matching pattern '{pattern}'")
+            return
+        sample_seconds = [duration(s) for s in samples]
+        print(f"{len(samples)} samples, {sum(sample_seconds):.0f} s of video, {n_cpu} CPUs")
+
+        # (1) presets at full thread count, one file at a time
+        print(f"{'preset':>10} {'threads':>7} {'jobs':>4} {'x realtime':>10} {'ratio':>6} {'SSIM':>6}")
+        by_preset = {}
+        for preset in PRESETS:
+            speed, ratio, quality = run_trial(samples, sample_seconds, work_dir, preset, n_cpu, 1, crf)
+            by_preset[preset] = (speed, ratio, quality)
+            results.append(
+                {"preset": preset, "threads": n_cpu, "jobs": 1, "speed": speed, "ratio": ratio, "ssim": quality}
+            )
+            print(f"{preset:>10} {n_cpu:>7} {1:>4} {speed:>10.1f} {ratio:>6.1f} {quality:>6.4f}")
+        # quality first, then compression among the presets of acceptable quality, then speed
+        best_ssim = max(q for _, _, q in by_preset.values())
+        good = [p for p, (_, _, q) in by_preset.items() if q >= best_ssim - max_ssim_loss]
+        best_ratio = max(by_preset[p][1] for p in good)
+        acceptable = [p for p in good if by_preset[p][1] >= min_ratio * best_ratio]
+        preset = max(acceptable, key=lambda p: by_preset[p][0])
+
+        # (2) threads x concurrent files for the chosen preset, keeping the CPUs at most twice oversubscribed
+        thread_options = sorted({1, 2, 4, max(1, n_cpu // 2), n_cpu} & set(range(1, n_cpu + 1)))
+        best = (by_preset[preset][0], n_cpu, 1)
+        for threads in thread_options:
+            for jobs in [1, 2, 4, 8]:
+                if threads * jobs > 2 * n_cpu or jobs > len(samples) or (threads, jobs) == (n_cpu, 1):
+                    continue
+                speed, ratio, quality = run_trial(samples, sample_seconds, work_dir, preset, threads, jobs, crf)
+                results.append(
+                    {"preset": preset, "threads": threads, "jobs": jobs, "speed": speed, "ratio": ratio,
+                     "ssim": quality}
+                )  # fmt: skip
+                print(f"{preset:>10} {threads:>7} {jobs:>4} {speed:>10.1f} {ratio:>6.1f} {quality:>6.4f}")
+                best = max(best, (speed, threads, jobs))
+
+    speed, n_threads, n_jobs = best
+    profile = {
+        "host": socket.gethostname(),
+        "created": f"{datetime.now():%Y-%m-%d %H:%M:%S}",
+        "compress_spd": preset,
+        "n_threads": n_threads,
+        "n_jobs": n_jobs,
+        "speed_x_realtime": round(speed, 2),
+        "crf": crf,
+        "trials": results,
+    }
+    path = profile_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(profile, indent=4))
+    print(
+        f"recommended: --compress_spd {preset} --n_threads {n_threads} --n_jobs {n_jobs} ({speed:.1f}x real time), "
+        f"saved to {path} in {time.perf_counter() - timer:.0f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="tune compress_drive encoder settings for this machine",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("input", type=Path, help="folder with raw slices, eg a recording drive")
+    parser.add_argument("--pattern", default="**/*.mp4", type=str, help="pattern to match")
+    parser.add_argument("--n_samples", default=4, type=int, help="number of slices to sample")
+    parser.add_argument("--seconds", default=20, type=float, help="seconds of video used from each sample")
+    parser.add_argument("--crf", default=25, type=int, help="x264 quality, as compress_drive --taskcam_crf")
+    parser.add_argument("--max_ssim_loss", default=0.005, type=float, help="SSIM a faster preset may lose vs the best")
+    parser.add_argument("--min_ratio", default=0.85, type=float, help="fraction of the best compression ratio required")
+    kwargs = vars(parser.parse_args())
+
+    if not kwargs["input"].is_dir():
+        raise NotADirectoryError(f"{kwargs['input']} is not a valid directory")
+
+    main(**kwargs)